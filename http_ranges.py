@@ -0,0 +1,53 @@
+"""Requisições HTTP Range (RFC 9110), comuns a serve-app.py e start-web-server.py"""
+
+MAX_RANGES = 16  # pedidos com mais intervalos que isso recebem o arquivo inteiro
+
+
+def parse_range(range_header, size):
+    """Interpreta 'Range: bytes=...'.
+
+    Retorna a lista de intervalos (início, fim) inclusivos, [] se nenhum é
+    satisfazível (416) ou None quando o header deve ser ignorado (200).
+    """
+    unit, _, specs = range_header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                # bytes=-N: os últimos N bytes
+                suffix = int(end)
+                if suffix == 0:
+                    continue
+                start, end = max(0, size - suffix), size - 1
+            elif not end:
+                start, end = int(start), size - 1
+            else:
+                start, end = int(start), int(end)
+                if end < start:
+                    return None
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    return ranges
+
+
+def range_allowed(if_range, etag, last_modified):
+    """If-Range: só aplica o Range se o cliente ainda tem a mesma versão.
+
+    Sem ETag atual (etag=None), um If-Range com ETag nunca casa e o
+    arquivo sai inteiro.
+    """
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return etag is not None and if_range == etag
+    return if_range == last_modified
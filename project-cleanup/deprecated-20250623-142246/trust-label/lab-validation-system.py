@@ -8,18 +8,35 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime, timedelta
 import json
+import os
 import sqlite3
 import uuid
 import hashlib
 from enum import Enum
 import random
 
+from service_metrics import instrument_app, sampled_connection
+
 app = Flask(__name__)
 CORS(app)
+# Per-route latency and SQLite timings on GET /metrics (Prometheus text),
+# off unless QR_METRICS=1, with one SQL statement in
+# QR_METRICS_STATEMENT_SAMPLE timed: the same switches as the QR tracking API
+METRICS_ENABLED = os.environ.get('QR_METRICS', '0') == '1'
+METRICS_STATEMENT_SAMPLE = int(os.environ.get('QR_METRICS_STATEMENT_SAMPLE', 10))
+if METRICS_ENABLED:
+    instrument_app(app, 'lab-validation-system')
+    db_factory = sampled_connection(METRICS_STATEMENT_SAMPLE)
+else:
+    db_factory = sqlite3.Connection
 
 # Database setup
 DB_PATH = 'lab_validation.db'
 
+def connect_db():
+    """Open a connection, sampled on /metrics when metrics are enabled"""
+    return sqlite3.connect(DB_PATH, factory=db_factory)
+
 class ValidationStatus(Enum):
     PENDING = "pending"
     IN_ANALYSIS = "in_analysis"
@@ -35,7 +52,7 @@ class LabStatus(Enum):
 
 def init_db():
     """Initialize database with validation schema"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     c = conn.cursor()
     
     # Laboratories table
@@ -175,7 +192,7 @@ def create_validation_request():
     claims = json.dumps(data.get('claims', []))
     data_points = json.dumps(data.get('data_points', []))
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     c = conn.cursor()
     
     c.execute('''INSERT INTO validation_requests 
@@ -221,7 +238,7 @@ def get_lab_marketplace(validation_id):
 
 def find_matching_labs(validation_id):
     """Find laboratories that can handle the validation"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     
@@ -302,7 +319,7 @@ def assign_lab_to_validation():
     
     assignment_id = str(uuid.uuid4())
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     c = conn.cursor()
     
     # Create assignment
@@ -354,7 +371,7 @@ def upload_lab_report(validation_id):
         f"{report_number}{validation_id}{datetime.now()}".encode()
     ).hexdigest()
     
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     c = conn.cursor()
     
     # Store report
@@ -472,7 +489,7 @@ def determine_overall_status(results):
 
 def calculate_trust_score(validation_id):
     """Calculate Trust Score based on validation results"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     
@@ -515,7 +532,7 @@ def calculate_trust_score(validation_id):
 
 def store_trust_score(validation_id, score):
     """Store Trust Score in history"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     c = conn.cursor()
     
     # Get product_id from validation
@@ -539,7 +556,7 @@ def store_trust_score(validation_id, score):
 @app.route('/api/v1/validation/<validation_id>/status', methods=['GET'])
 def get_validation_status(validation_id):
     """Get detailed validation status"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     
@@ -595,7 +612,7 @@ def get_validation_status(validation_id):
 @app.route('/api/v1/labs', methods=['GET'])
 def get_laboratories():
     """Get list of all laboratories"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_db()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     
@@ -703,6 +720,7 @@ def index():
         <li>GET /api/v1/validation/{id}/status - Get validation status</li>
         <li>GET /api/v1/labs - List all laboratories</li>
         <li>POST /api/v1/validation/simulate - Simulate complete flow</li>
+        <li>GET /metrics - Prometheus metrics</li>
     </ul>
     '''
 
@@ -717,6 +735,7 @@ if __name__ == '__main__':
     print("  ✓ Real-time capacity tracking")
     print("  ✓ Trust Score calculation")
     print("  ✓ Report integrity (SHA-256)")
+    print("  ✓ Prometheus metrics on /metrics")
     print("\nPress Ctrl+C to stop")
     
     app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
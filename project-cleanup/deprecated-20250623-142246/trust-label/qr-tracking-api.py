@@ -4,133 +4,293 @@ TRUST Label - Smart QR Code Tracking API
 Backend service for tracking QR code scans with analytics
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-from datetime import datetime
+from datetime import date, datetime, timedelta
+import csv
+import io
+import itertools
 import json
-import sqlite3
+import hashlib
 import os
 import uuid
 from collections import defaultdict
-import hashlib
+import atexit
+import queue
+import threading
+import time
+
+from qr_anchoring import Anchorer, anchor_status, leaf_hash
+from qr_cache import TTLCache
+from qr_db import ConnectionPool
+from qr_dedup import ScanDeduplicator
+from qr_events import ScanEventHub, scan_event
+from qr_export import (EXPORT_FORMATS, MIMETYPES as EXPORT_MIMETYPES, archived_months,
+                       export_chunks, iter_scan_pages, scan_time, PARQUET_AVAILABLE)
+from qr_geoip import GeoResolver, client_ip
+from qr_ingest import RescanFlusher, Scan, ScanWriter, record_scans, unique_visitors as count_unique_visitors
+from qr_migrations import migrate
+from qr_partitions import (DEFAULT_RETAIN_MONTHS, RetentionJob, count_scans,
+                           recent_scans as partition_recent_scans)
+from qr_sketches import BloomFilter
+from qr_timeline import GRANULARITIES, TimelineCompactor, parse_time, scan_timeline
+from qr_topk import GRANULARITIES as TOPK_GRANULARITIES, TopKTracker, period_of
+from qr_useragent import classify_user_agent as get_device_info
+from service_metrics import REGISTRY as METRICS, instrument_app, sampled_connection
 
 app = Flask(__name__)
 CORS(app)
 
+# Per-route latency and SQLite timings on GET /metrics (Prometheus text),
+# off unless QR_METRICS=1. One SQL statement in QR_METRICS_STATEMENT_SAMPLE
+# is timed, as timing each one costs more than a point query itself.
+METRICS_ENABLED = os.environ.get('QR_METRICS', '0') == '1'
+METRICS_STATEMENT_SAMPLE = int(os.environ.get('QR_METRICS_STATEMENT_SAMPLE', 10))
+if METRICS_ENABLED:
+    instrument_app(app, 'qr-tracking-api')
+
 # Database setup
 DB_PATH = 'qr_tracking.db'
+DB_POOL_SIZE = int(os.environ.get('QR_DB_POOL_SIZE', 8))
+
+if METRICS_ENABLED:
+    db = ConnectionPool(DB_PATH, size=DB_POOL_SIZE, factory=sampled_connection(METRICS_STATEMENT_SAMPLE),
+                        metrics=METRICS)
+else:
+    db = ConnectionPool(DB_PATH, size=DB_POOL_SIZE)
+
+# Scan ingestion: 'sync' commits every scan inline, 'queued' batches them
+# through a background group-commit writer
+SCAN_INGEST_MODE = os.environ.get('QR_SCAN_INGEST', 'sync')
+SCAN_BATCH_SIZE = int(os.environ.get('QR_SCAN_BATCH_SIZE', 500))
+SCAN_FLUSH_INTERVAL = float(os.environ.get('QR_SCAN_FLUSH_MS', 200)) / 1000
+SCAN_QUEUE_SIZE = int(os.environ.get('QR_SCAN_QUEUE_SIZE', 50000))
+
+DASHBOARD_CACHE_TTL = float(os.environ.get('QR_DASHBOARD_CACHE_TTL', 5))
+dashboard_cache = TTLCache(maxsize=1, ttl=DASHBOARD_CACHE_TTL)
+
+# Bulk generation: rows committed per transaction, and the per-request cap
+BULK_BATCH_SIZE = int(os.environ.get('QR_BULK_BATCH_SIZE', 1000))
+BULK_MAX_COUNT = int(os.environ.get('QR_BULK_MAX_COUNT', 1000000))
 
 def init_db():
     """Initialize SQLite database with tracking schema"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # QR Codes table
-    c.execute('''CREATE TABLE IF NOT EXISTS qr_codes
-                 (id TEXT PRIMARY KEY,
-                  product_id TEXT,
-                  product_name TEXT,
-                  brand TEXT,
-                  created_at TIMESTAMP,
-                  validation_data TEXT,
-                  blockchain_ref TEXT,
-                  is_active INTEGER DEFAULT 1)''')
-    
-    # Scan tracking table
-    c.execute('''CREATE TABLE IF NOT EXISTS scan_tracking
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  qr_code_id TEXT,
-                  scanned_at TIMESTAMP,
-                  ip_address TEXT,
-                  user_agent TEXT,
-                  location_lat REAL,
-                  location_lng REAL,
-                  city TEXT,
-                  country TEXT,
-                  device_type TEXT,
-                  browser TEXT,
-                  referrer TEXT,
-                  FOREIGN KEY(qr_code_id) REFERENCES qr_codes(id))''')
-    
-    # Analytics summary table
-    c.execute('''CREATE TABLE IF NOT EXISTS analytics_summary
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  qr_code_id TEXT,
-                  date DATE,
-                  total_scans INTEGER DEFAULT 0,
-                  unique_ips INTEGER DEFAULT 0,
-                  mobile_scans INTEGER DEFAULT 0,
-                  desktop_scans INTEGER DEFAULT 0,
-                  top_city TEXT,
-                  FOREIGN KEY(qr_code_id) REFERENCES qr_codes(id))''')
-    
-    conn.commit()
-    conn.close()
+    with db.transaction(write=True) as conn:
+        migrate(conn)
 
 # Initialize database on startup
 init_db()
 
-def get_device_info(user_agent):
-    """Extract device type and browser from user agent"""
-    user_agent_lower = user_agent.lower()
-    
-    # Device type detection
-    if 'mobile' in user_agent_lower or 'android' in user_agent_lower or 'iphone' in user_agent_lower:
-        device_type = 'mobile'
-    elif 'tablet' in user_agent_lower or 'ipad' in user_agent_lower:
-        device_type = 'tablet'
-    else:
-        device_type = 'desktop'
-    
-    # Browser detection
-    if 'chrome' in user_agent_lower and 'edg' not in user_agent_lower:
-        browser = 'Chrome'
-    elif 'safari' in user_agent_lower and 'chrome' not in user_agent_lower:
-        browser = 'Safari'
-    elif 'firefox' in user_agent_lower:
-        browser = 'Firefox'
-    elif 'edg' in user_agent_lower:
-        browser = 'Edge'
-    else:
-        browser = 'Other'
-    
-    return device_type, browser
+# Most-scanned products and cities (Space-Saving summaries, see qr_topk):
+# counted in memory as scans commit, merged into SQLite every QR_TOPK_FLUSH
+# seconds. Closed after the scan writer, whose last batches it counts.
+TOPK_FLUSH_INTERVAL = float(os.environ.get('QR_TOPK_FLUSH', 10))
+topk = TopKTracker(db, interval=TOPK_FLUSH_INTERVAL)
 
-@app.route('/api/v1/qr/generate', methods=['POST'])
-def generate_qr_code():
-    """Generate a new trackable QR code"""
-    data = request.json
-    
+# Scans repeating (qr_id, client ip, user agent) within QR_DEDUP_WINDOW
+# seconds only bump analytics_summary.rescans, written in one batch every
+# QR_DEDUP_FLUSH seconds by a background thread. A window of 0 stores every scan.
+DEDUP_WINDOW = float(os.environ.get('QR_DEDUP_WINDOW', 10))
+DEDUP_FLUSH_INTERVAL = float(os.environ.get('QR_DEDUP_FLUSH', 5))
+scan_dedup = ScanDeduplicator(DEDUP_WINDOW) if DEDUP_WINDOW > 0 else None
+rescan_flusher = None
+if scan_dedup is not None:
+    rescan_flusher = RescanFlusher(db, scan_dedup, interval=DEDUP_FLUSH_INTERVAL)
+
+def scan_dedup_key(scan):
+    return (scan.qr_code_id, client_ip(scan.ip_address), scan.user_agent)
+
+def forget_scans(scans):
+    """Let the next repeat of scans that were not stored be stored, not counted as a rescan"""
+    if scan_dedup is not None:
+        for scan in scans:
+            scan_dedup.forget(*scan_dedup_key(scan))
+
+scan_writer = None
+if SCAN_INGEST_MODE == 'queued':
+    scan_writer = ScanWriter(db, batch_size=SCAN_BATCH_SIZE,
+                             flush_interval=SCAN_FLUSH_INTERVAL,
+                             max_pending=SCAN_QUEUE_SIZE,
+                             on_commit=topk.record,
+                             on_drop=forget_scans)
+
+# New QR codes are anchored in Merkle batches every QR_ANCHOR_INTERVAL seconds
+ANCHOR_INTERVAL = float(os.environ.get('QR_ANCHOR_INTERVAL', 60))
+ANCHOR_BATCH_SIZE = int(os.environ.get('QR_ANCHOR_BATCH_SIZE', 10000))
+anchorer = Anchorer(db, interval=ANCHOR_INTERVAL, batch_size=ANCHOR_BATCH_SIZE)
+
+# Timeline compaction: finished hours roll up into days, days into weeks
+TIMELINE_COMPACT_INTERVAL = float(os.environ.get('QR_TIMELINE_COMPACT_INTERVAL', 300))
+TIMELINE_HOURLY_RETENTION_DAYS = int(os.environ.get('QR_TIMELINE_HOURLY_DAYS', 35))
+timeline_compactor = TimelineCompactor(db, interval=TIMELINE_COMPACT_INTERVAL,
+                                       hourly_retention_days=TIMELINE_HOURLY_RETENTION_DAYS)
+
+# Scan partitions older than QR_SCAN_RETENTION_MONTHS months are archived
+# to QR_SCAN_ARCHIVE_DIR (see qr_partitions), checked every
+# QR_SCAN_RETENTION_INTERVAL seconds. 0 months leaves retention to the CLI.
+SCAN_RETENTION_MONTHS = int(os.environ.get('QR_SCAN_RETENTION_MONTHS', DEFAULT_RETAIN_MONTHS))
+SCAN_ARCHIVE_DIR = os.environ.get('QR_SCAN_ARCHIVE_DIR', 'scan_archive')
+SCAN_RETENTION_INTERVAL = float(os.environ.get('QR_SCAN_RETENTION_INTERVAL', 3600))
+retention_job = None
+if SCAN_RETENTION_MONTHS > 0:
+    retention_job = RetentionJob(db, retain_months=SCAN_RETENTION_MONTHS, archive_dir=SCAN_ARCHIVE_DIR,
+                                 interval=SCAN_RETENTION_INTERVAL)
+
+# Serialized verify responses
+VERIFY_CACHE_SIZE = int(os.environ.get('QR_VERIFY_CACHE_SIZE', 100000))
+VERIFY_CACHE_TTL = float(os.environ.get('QR_VERIFY_CACHE_TTL', 60))
+VERIFY_MAX_AGE = int(os.environ.get('QR_VERIFY_MAX_AGE', 30))
+verify_cache = TTLCache(maxsize=VERIFY_CACHE_SIZE, ttl=VERIFY_CACHE_TTL)
+
+# Brands of scanned codes, for scan events. Entries do not expire: a code
+# changed or deleted by any writer is dropped when sync_qr_codes reads it
+# from qr_code_changes (polled on scans as well), and by PATCH. generate
+# fills in new codes; other codes are read on their first scan.
+BRAND_CACHE_SIZE = int(os.environ.get('QR_BRAND_CACHE_SIZE', 100000))
+brand_cache = TTLCache(maxsize=BRAND_CACHE_SIZE, ttl=float('inf'))
+
+# Offline IP-range database (CSV, see qr_geoip) for scans that carry no
+# location; without it scans keep the 'Unknown'/'BR' defaults
+GEOIP_DB_PATH = os.environ.get('QR_GEOIP_DB', 'geoip.csv')
+geo_resolver = GeoResolver.from_csv(GEOIP_DB_PATH) if os.path.exists(GEOIP_DB_PATH) else None
+
+# Live scan events for dashboards (SSE on /api/v1/events/scans). Streams
+# with the same filter share one ring of QR_EVENTS_BUFFER messages; each
+# gets a snapshot of the interval's counts every QR_EVENTS_SNAPSHOT seconds.
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('QR_EVENTS_MAX_SUBSCRIBERS', 10000))
+EVENTS_BUFFER_SIZE = int(os.environ.get('QR_EVENTS_BUFFER', 256))
+EVENTS_SNAPSHOT_INTERVAL = float(os.environ.get('QR_EVENTS_SNAPSHOT', 5))
+EVENTS_HEARTBEAT = float(os.environ.get('QR_EVENTS_HEARTBEAT', 15))
+scan_events = ScanEventHub(max_subscribers=EVENTS_MAX_SUBSCRIBERS,
+                           snapshot_interval=EVENTS_SNAPSHOT_INTERVAL,
+                           buffer_size=EVENTS_BUFFER_SIZE)
+
+# The jobs above get their threads here rather than at import: the
+# Werkzeug reloader's parent and qr_asgi's multi-worker supervisor import
+# this module without serving, and would run a second set of jobs
+# against the same database.
+background_jobs = {'started': False, 'lock': threading.Lock()}
+
+def start_background_jobs():
+    """Start this process's background threads, once.
+
+    Called by __main__ and qr_asgi's lifespan startup; any other server
+    starts them on its first request.
+    """
+    with background_jobs['lock']:
+        if background_jobs['started']:
+            return
+        background_jobs['started'] = True
+        # atexit runs last-registered first: the scan writer drains before
+        # top-K and rescans flush, and every job before the pool closes
+        for job in (topk, rescan_flusher, scan_writer, anchorer, timeline_compactor,
+                    retention_job, scan_events):
+            if job is not None:
+                job.start()
+                atexit.register(job.close)
+
+@app.before_request
+def ensure_background_jobs():
+    if not background_jobs['started']:
+        start_background_jobs()
+
+# Bloom filter over every QR id, active or not: unknown ids are rejected
+# without I/O. Deactivated codes stay in it, as a Bloom filter cannot drop
+# an id, and a rebuild keeps them too; so whether an id reaches SQLite
+# never depends on when the filter was built. Sized for
+# max(QR_FILTER_CAPACITY, 2x the codes at startup) and rebuilt with double
+# the capacity once that is exceeded.
+QR_FILTER_CAPACITY = int(os.environ.get('QR_FILTER_CAPACITY', 1000000))
+QR_FILTER_FPR = float(os.environ.get('QR_FILTER_FPR', 0.01))
+
+# Codes minted and changed by other processes are picked up from qr_codes
+# (by rowid) and qr_code_changes (filled by triggers) at most every
+# QR_CHANGES_POLL seconds; the verify cache TTL bounds staleness regardless
+QR_CHANGES_POLL = float(os.environ.get('QR_CHANGES_POLL', 1.0))
+qr_changes = {'rowid': 0, 'seq': 0, 'next_poll': 0.0, 'lock': threading.Lock()}
+
+def build_qr_filter(conn, min_capacity):
+    rows = conn.execute('SELECT id FROM qr_codes').fetchall()
+    qr_filter = BloomFilter(max(min_capacity, 2 * len(rows)), QR_FILTER_FPR)
+    for row in rows:
+        qr_filter.add(row['id'])
+    return qr_filter
+
+with db.transaction() as conn:
+    qr_filter = build_qr_filter(conn, QR_FILTER_CAPACITY)
+    qr_changes['rowid'] = conn.execute('SELECT COALESCE(MAX(rowid), 0) FROM qr_codes').fetchone()[0]
+    qr_changes['seq'] = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM qr_code_changes').fetchone()[0]
+
+def sync_qr_codes():
+    """Catch up with QR codes minted or changed since the last poll.
+
+    New codes go into the Bloom filter; changed codes leave the verify
+    and brand caches.
+    """
+    global qr_filter
+    now = time.monotonic()
+    if now < qr_changes['next_poll'] or not qr_changes['lock'].acquire(blocking=False):
+        return
+    try:
+        qr_changes['next_poll'] = now + QR_CHANGES_POLL
+        with db.transaction() as conn:
+            minted = conn.execute('SELECT rowid, id FROM qr_codes WHERE rowid > ? ORDER BY rowid',
+                                  (qr_changes['rowid'],)).fetchall()
+            changed = conn.execute('SELECT seq, qr_code_id FROM qr_code_changes WHERE seq > ? ORDER BY seq',
+                                   (qr_changes['seq'],)).fetchall()
+            if qr_filter.count + len(minted) > qr_filter.capacity:
+                qr_filter = build_qr_filter(conn, 2 * qr_filter.capacity)
+                minted = []
+        for row in minted:
+            qr_filter.add(row['id'])
+        for row in changed:
+            verify_cache.invalidate(row['qr_code_id'])
+            brand_cache.invalidate(row['qr_code_id'])
+        if minted:
+            qr_changes['rowid'] = minted[-1]['rowid']
+        if changed:
+            qr_changes['seq'] = changed[-1]['seq']
+    finally:
+        qr_changes['lock'].release()
+
+def known_qr_code(qr_id):
+    """False only if qr_id is certainly not a QR code"""
+    if qr_id in qr_filter:
+        return True
+    # It may have been minted by another process since the last poll
+    sync_qr_codes()
+    return qr_id in qr_filter
+
+INSERT_QR_CODE_SQL = '''INSERT INTO qr_codes
+                        (id, product_id, product_name, brand, created_at, validation_data, blockchain_ref)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+def new_qr_code(data, created_at):
+    """Build the qr_codes row and the QR data payload for one product"""
     # Generate unique QR code ID
     qr_id = str(uuid.uuid4())
-    
-    # Create blockchain reference (mock)
-    blockchain_ref = hashlib.sha256(f"{qr_id}{datetime.now()}".encode()).hexdigest()[:16]
-    
-    # Store in database
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''INSERT INTO qr_codes 
-                 (id, product_id, product_name, brand, created_at, validation_data, blockchain_ref)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)''',
-              (qr_id, 
-               data.get('product_id'),
-               data.get('product_name'),
-               data.get('brand'),
-               datetime.now(),
-               json.dumps(data.get('validation_data', {})),
-               blockchain_ref))
-    
-    conn.commit()
-    conn.close()
-    
+
+    validation_data = json.dumps(data.get('validation_data', {}))
+
+    # The blockchain reference is the code's Merkle leaf; the background
+    # anchorer later commits it to the chain as part of a batch root
+    blockchain_ref = leaf_hash(qr_id, data.get('product_id'), data.get('product_name'),
+                               data.get('brand'), validation_data).hex()
+
+    row = (qr_id,
+           data.get('product_id'),
+           data.get('product_name'),
+           data.get('brand'),
+           created_at,
+           validation_data,
+           blockchain_ref)
+
     # Generate QR data payload
     qr_data = {
         'type': 'TRUST_LABEL_SMART_QR',
         'qr_id': qr_id,
         'product_id': data.get('product_id'),
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': created_at.isoformat(),
         'track_url': f'http://localhost:5001/api/v1/qr/track/{qr_id}',
         'verify_url': f'http://localhost:8001/verify.html?qr={qr_id}',
         'blockchain': {
@@ -139,150 +299,260 @@ def generate_qr_code():
             'contract': '0x742d35Cc6634C0532925a3b844Bc8e70c8B5C4A3'
         }
     }
-    
+    return row, qr_data
+
+@app.route('/api/v1/qr/generate', methods=['POST'])
+def generate_qr_code():
+    """Generate a new trackable QR code"""
+    data = request.json
+    row, qr_data = new_qr_code(data, datetime.now())
+
+    # Store in database
+    with db.transaction(write=True) as conn:
+        conn.execute(INSERT_QR_CODE_SQL, row)
+    qr_filter.add(qr_data['qr_id'])
+    brand_cache.set(qr_data['qr_id'], {'brand': row[3]})
+
     return jsonify({
         'success': True,
-        'qr_id': qr_id,
+        'qr_id': qr_data['qr_id'],
         'qr_data': qr_data,
         'tracking_enabled': True
     })
 
-@app.route('/api/v1/qr/track/<qr_id>', methods=['POST', 'GET'])
-def track_scan(qr_id):
-    """Track a QR code scan"""
-    # Extract tracking information
-    ip_address = request.headers.get('X-Forwarded-For', request.remote_addr)
-    user_agent = request.headers.get('User-Agent', '')
-    referrer = request.headers.get('Referer', '')
-    
+BULK_CSV_COLUMNS = ['qr_id', 'product_id', 'product_name', 'brand',
+                    'blockchain_ref', 'track_url', 'verify_url', 'qr_data']
+
+def bulk_lines(products, total, output_format):
+    """Insert QR codes one batch per transaction, yielding each batch's output after commit.
+
+    Only the current batch is held in memory, and every payload that
+    reaches the client belongs to a committed row.
+    """
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(BULK_CSV_COLUMNS)
+        yield buffer.getvalue()
+
+    for start in range(0, total, BULK_BATCH_SIZE):
+        created_at = datetime.now()
+        batch = [new_qr_code(data, created_at)
+                 for data in itertools.islice(products, BULK_BATCH_SIZE)]
+        with db.transaction(write=True) as conn:
+            conn.executemany(INSERT_QR_CODE_SQL, [row for row, _ in batch])
+        for row, _ in batch:
+            qr_filter.add(row[0])
+
+        buffer = io.StringIO()
+        if output_format == 'csv':
+            writer = csv.writer(buffer)
+            for row, qr_data in batch:
+                writer.writerow([row[0], row[1], row[2], row[3], row[6],
+                                 qr_data['track_url'], qr_data['verify_url'],
+                                 json.dumps(qr_data)])
+        else:
+            for _, qr_data in batch:
+                buffer.write(json.dumps(qr_data))
+                buffer.write('\n')
+        yield buffer.getvalue()
+
+@app.route('/api/v1/qr/generate/bulk', methods=['POST'])
+def generate_qr_codes_bulk():
+    """Generate many QR codes and stream their payloads as NDJSON or CSV.
+
+    Body: {"count": N, "product": {...}} to mint N labels for one product,
+    or {"products": [{...}, ...]} for one label per payload.
+    """
+    data = request.get_json(silent=True) or {}
+    output_format = request.args.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format must be ndjson or csv'}), 400
+
+    if 'products' in data:
+        products = data['products']
+        if not isinstance(products, list) or not all(isinstance(p, dict) for p in products):
+            return jsonify({'error': 'products must be a list of objects'}), 400
+        total = len(products)
+        products = iter(products)
+    else:
+        product = data.get('product', {})
+        total = data.get('count')
+        if not isinstance(product, dict) or not isinstance(total, int) or isinstance(total, bool):
+            return jsonify({'error': 'count (integer) and product (object) are required'}), 400
+        products = itertools.repeat(product, max(total, 0))
+
+    if not 0 < total <= BULK_MAX_COUNT:
+        return jsonify({'error': f'Between 1 and {BULK_MAX_COUNT} QR codes per request'}), 400
+
+    mimetype = 'text/csv' if output_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(bulk_lines(products, total, output_format)),
+                    mimetype=mimetype,
+                    headers={'X-Total-Count': str(total)})
+
+def build_scan(qr_id, ip_address, user_agent, referrer, location_data):
     # Get device info
     device_type, browser = get_device_info(user_agent)
-    
-    # Get location data from request (if provided)
-    location_data = request.json if request.method == 'POST' else {}
-    
-    # Store tracking data
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
+
+    # Fill in what the client did not send from the IP, first hop of X-Forwarded-For
+    geo = None
+    if geo_resolver is not None and ip_address and not ('city' in location_data and 'country' in location_data):
+        geo = geo_resolver.lookup(client_ip(ip_address))
+
+    return Scan(qr_id,
+                datetime.now(),
+                ip_address,
+                user_agent,
+                location_data.get('lat', geo.lat if geo else None),
+                location_data.get('lng', geo.lng if geo else None),
+                location_data.get('city', geo.city if geo and geo.city else 'Unknown'),
+                location_data.get('country', geo.country if geo and geo.country else 'BR'),
+                device_type,
+                browser,
+                referrer)
+
+def scanned_qr_code(qr_id):
+    """{'brand': ...} of an existing QR code, else None; from brand_cache when possible"""
+    # Drops brands changed or deleted out-of-band, at most every QR_CHANGES_POLL
+    sync_qr_codes()
+    qr_code = brand_cache.get(qr_id)
+    if qr_code is None:
+        # As for verify: a change committing during the read is not cached
+        generation = brand_cache.generation()
+        with db.transaction() as conn:
+            row = conn.execute('SELECT brand FROM qr_codes WHERE id = ?', (qr_id,)).fetchone()
+        # Unknown ids are not cached: another process may mint them
+        if row is None:
+            return None
+        qr_code = {'brand': row['brand']}
+        brand_cache.set_if_unchanged(qr_id, qr_code, generation)
+    return qr_code
+
+def store_scan(scan):
+    """Persist (or enqueue) a scan; returns (payload, status, headers).
+
+    Shared by the Flask route and the ASGI hot path in qr_asgi.
+    """
+    qr_id = scan.qr_code_id
+
     # Check if QR code exists
-    c.execute('SELECT * FROM qr_codes WHERE id = ?', (qr_id,))
-    qr_code = c.fetchone()
-    
+    qr_code = scanned_qr_code(qr_id)
     if not qr_code:
-        conn.close()
-        return jsonify({'error': 'QR code not found'}), 404
-    
-    # Insert tracking record
-    c.execute('''INSERT INTO scan_tracking 
-                 (qr_code_id, scanned_at, ip_address, user_agent, 
-                  location_lat, location_lng, city, country, 
-                  device_type, browser, referrer)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-              (qr_id,
-               datetime.now(),
-               ip_address,
-               user_agent,
-               location_data.get('lat'),
-               location_data.get('lng'),
-               location_data.get('city', 'Unknown'),
-               location_data.get('country', 'BR'),
-               device_type,
-               browser,
-               referrer))
-    
-    # Update analytics summary
-    today = datetime.now().date()
-    c.execute('''SELECT id FROM analytics_summary 
-                 WHERE qr_code_id = ? AND date = ?''', (qr_id, today))
-    
-    summary = c.fetchone()
-    if summary:
-        # Update existing summary
-        c.execute('''UPDATE analytics_summary 
-                     SET total_scans = total_scans + 1
-                     WHERE qr_code_id = ? AND date = ?''', (qr_id, today))
-    else:
-        # Create new summary
-        c.execute('''INSERT INTO analytics_summary 
-                     (qr_code_id, date, total_scans)
-                     VALUES (?, ?, 1)''', (qr_id, today))
-    
-    conn.commit()
-    conn.close()
-    
-    return jsonify({
+        return {'error': 'QR code not found'}, 404, {}
+
+    if scan_dedup is not None and not scan_dedup.check(*scan_dedup_key(scan), scan.scanned_at.date()):
+        return {
+            'success': True,
+            'message': 'Repeat scan counted',
+            'qr_id': qr_id,
+            'timestamp': scan.scanned_at.isoformat(),
+            'duplicate': True
+        }, 200, {}
+
+    if scan_writer is not None:
+        # Group-commit mode: the background writer persists the scan
+        try:
+            scan_writer.submit(scan)
+        except queue.Full:
+            forget_scans([scan])
+            return {'error': 'Scan ingestion queue is full'}, 503, {'Retry-After': '1'}
+        scan_events.publish(scan_event(scan, qr_code['brand']))
+        return {
+            'success': True,
+            'message': 'Scan queued for tracking',
+            'qr_id': qr_id,
+            'timestamp': scan.scanned_at.isoformat(),
+            'queued': True
+        }, 202, {}
+
+    # Store tracking data and update analytics summary
+    try:
+        with db.transaction(write=True) as conn:
+            late = record_scans(conn, [scan])
+    except Exception:
+        forget_scans([scan])
+        raise
+    if late:
+        forget_scans(late)
+        return {'error': f'Scans for {scan.scanned_at:%Y-%m} are archived and no longer accepted'}, 409, {}
+    topk.record([scan])
+    scan_events.publish(scan_event(scan, qr_code['brand']))
+
+    return {
         'success': True,
         'message': 'Scan tracked successfully',
         'qr_id': qr_id,
         'timestamp': datetime.now().isoformat()
-    })
+    }, 200, {}
+
+@app.route('/api/v1/qr/track/<qr_id>', methods=['POST', 'GET'])
+def track_scan(qr_id):
+    """Track a QR code scan"""
+    # Unknown ids (scrapers, forged labels) are rejected without touching SQLite
+    if not known_qr_code(qr_id):
+        return jsonify({'error': 'QR code not found'}), 404
+
+    # Get location data from request (if provided)
+    location_data = request.json if request.method == 'POST' else {}
+
+    scan = build_scan(qr_id,
+                      request.headers.get('X-Forwarded-For', request.remote_addr),
+                      request.headers.get('User-Agent', ''),
+                      request.headers.get('Referer', ''),
+                      location_data)
+    payload, status, headers = store_scan(scan)
+    return jsonify(payload), status, headers
 
 @app.route('/api/v1/qr/<qr_id>/analytics', methods=['GET'])
 def get_qr_analytics(qr_id):
     """Get analytics data for a specific QR code"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    # Get QR code info
-    c.execute('SELECT * FROM qr_codes WHERE id = ?', (qr_id,))
-    qr_code = c.fetchone()
-    
-    if not qr_code:
-        conn.close()
-        return jsonify({'error': 'QR code not found'}), 404
-    
-    # Get total scans
-    c.execute('SELECT COUNT(*) as total FROM scan_tracking WHERE qr_code_id = ?', (qr_id,))
-    total_scans = c.fetchone()['total']
-    
-    # Get unique IPs
-    c.execute('SELECT COUNT(DISTINCT ip_address) as unique_ips FROM scan_tracking WHERE qr_code_id = ?', (qr_id,))
-    unique_visitors = c.fetchone()['unique_ips']
-    
-    # Get device breakdown
-    c.execute('''SELECT device_type, COUNT(*) as count 
-                 FROM scan_tracking 
-                 WHERE qr_code_id = ? 
-                 GROUP BY device_type''', (qr_id,))
-    device_stats = {row['device_type']: row['count'] for row in c.fetchall()}
-    
-    # Get browser breakdown
-    c.execute('''SELECT browser, COUNT(*) as count 
-                 FROM scan_tracking 
-                 WHERE qr_code_id = ? 
-                 GROUP BY browser''', (qr_id,))
-    browser_stats = {row['browser']: row['count'] for row in c.fetchall()}
-    
-    # Get location breakdown
-    c.execute('''SELECT city, country, COUNT(*) as count 
-                 FROM scan_tracking 
-                 WHERE qr_code_id = ? AND city IS NOT NULL
-                 GROUP BY city, country
-                 ORDER BY count DESC
-                 LIMIT 10''', (qr_id,))
-    location_stats = [dict(row) for row in c.fetchall()]
-    
-    # Get scan timeline (last 30 days)
-    c.execute('''SELECT DATE(scanned_at) as date, COUNT(*) as scans
-                 FROM scan_tracking
-                 WHERE qr_code_id = ? 
-                 AND scanned_at >= date('now', '-30 days')
-                 GROUP BY DATE(scanned_at)
-                 ORDER BY date''', (qr_id,))
-    timeline = [dict(row) for row in c.fetchall()]
-    
-    # Get recent scans
-    c.execute('''SELECT scanned_at, ip_address, city, device_type, browser
-                 FROM scan_tracking
-                 WHERE qr_code_id = ?
-                 ORDER BY scanned_at DESC
-                 LIMIT 10''', (qr_id,))
-    recent_scans = [dict(row) for row in c.fetchall()]
-    
-    conn.close()
-    
+    with db.transaction() as conn:
+        c = conn.cursor()
+
+        # Get QR code info
+        c.execute('SELECT * FROM qr_codes WHERE id = ?', (qr_id,))
+        qr_code = c.fetchone()
+
+        if not qr_code:
+            return jsonify({'error': 'QR code not found'}), 404
+
+        # Everything below reads the daily rollups maintained at ingest time,
+        # so the cost follows the number of days, not the number of scans
+        c.execute('''SELECT COALESCE(SUM(total_scans), 0) as total, COALESCE(SUM(rescans), 0) as rescans
+                     FROM analytics_summary WHERE qr_code_id = ?''', (qr_id,))
+        row = c.fetchone()
+        total_scans, rescans = row['total'], row['rescans']
+
+        # Get unique IPs (HyperLogLog estimate)
+        unique_visitors, _ = count_unique_visitors(conn, [qr_id])
+
+        # Get device and browser breakdown
+        c.execute('''SELECT dimension, value, SUM(scans) as count
+                     FROM analytics_daily_breakdown
+                     WHERE qr_code_id = ? AND dimension IN ('device', 'browser')
+                     GROUP BY dimension, value''', (qr_id,))
+        device_stats = {}
+        browser_stats = {}
+        for row in c.fetchall():
+            stats = device_stats if row['dimension'] == 'device' else browser_stats
+            stats[row['value']] = row['count']
+
+        # Get location breakdown (top cities summary of the code)
+        location_stats = [{'city': city, 'country': country, 'count': count}
+                          for (city, country), count, _ in topk.top(conn, 'city', 'all', 'all', 10,
+                                                                    subject=qr_id)]
+
+        # Get scan timeline (last 30 days)
+        c.execute('''SELECT date, total_scans as scans, rescans
+                     FROM analytics_summary
+                     WHERE qr_code_id = ?
+                     AND date >= date('now', '-30 days')
+                     ORDER BY date''', (qr_id,))
+        timeline = [dict(row) for row in c.fetchall()]
+
+        # Get recent scans (newest partitions first)
+        recent_scans = [dict(row) for row in partition_recent_scans(conn, qr_id, limit=10)]
+
     return jsonify({
         'qr_id': qr_id,
         'product_info': {
@@ -293,6 +563,7 @@ def get_qr_analytics(qr_id):
         },
         'analytics': {
             'total_scans': total_scans,
+            'rescans': rescans,
             'unique_visitors': unique_visitors,
             'device_breakdown': device_stats,
             'browser_breakdown': browser_stats,
@@ -302,46 +573,106 @@ def get_qr_analytics(qr_id):
         }
     })
 
-@app.route('/api/v1/analytics/dashboard', methods=['GET'])
-def get_dashboard_analytics():
-    """Get overall dashboard analytics"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    # Total QR codes
-    c.execute('SELECT COUNT(*) as total FROM qr_codes WHERE is_active = 1')
-    total_qr_codes = c.fetchone()['total']
-    
-    # Total scans today
-    c.execute('''SELECT COUNT(*) as total FROM scan_tracking 
-                 WHERE DATE(scanned_at) = DATE('now')''')
-    scans_today = c.fetchone()['total']
-    
-    # Total scans this month
-    c.execute('''SELECT COUNT(*) as total FROM scan_tracking 
-                 WHERE strftime('%Y-%m', scanned_at) = strftime('%Y-%m', 'now')''')
-    scans_month = c.fetchone()['total']
-    
-    # Most scanned products
-    c.execute('''SELECT q.product_name, q.brand, COUNT(s.id) as scan_count
-                 FROM qr_codes q
-                 JOIN scan_tracking s ON q.id = s.qr_code_id
-                 GROUP BY q.id
-                 ORDER BY scan_count DESC
-                 LIMIT 5''')
-    top_products = [dict(row) for row in c.fetchall()]
-    
-    # Scan growth (compare to last month)
-    c.execute('''SELECT COUNT(*) as total FROM scan_tracking 
-                 WHERE strftime('%Y-%m', scanned_at) = strftime('%Y-%m', 'now', '-1 month')''')
-    scans_last_month = c.fetchone()['total']
-    
-    growth_rate = ((scans_month - scans_last_month) / scans_last_month * 100) if scans_last_month > 0 else 0
-    
-    conn.close()
-    
+@app.route('/api/v1/qr/<qr_id>/timeline', methods=['GET'])
+def get_qr_timeline(qr_id):
+    """Scan counts per hour, day or week over [from, to) (default: the last 30 days)"""
+    granularity = request.args.get('granularity', 'auto')
+    if granularity != 'auto' and granularity not in GRANULARITIES:
+        return jsonify({'error': f"granularity must be one of auto, {', '.join(GRANULARITIES)}"}), 400
+    try:
+        end = parse_time(request.args['to']) if 'to' in request.args else datetime.now()
+        start = parse_time(request.args['from']) if 'from' in request.args else end - timedelta(days=30)
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or timestamps'}), 400
+    if start >= end:
+        return jsonify({'error': 'from must be before to'}), 400
+
+    with db.transaction() as conn:
+        if conn.execute('SELECT 1 FROM qr_codes WHERE id = ?', (qr_id,)).fetchone() is None:
+            return jsonify({'error': 'QR code not found'}), 404
+        granularity, timeline = scan_timeline(conn, qr_id, start, end, granularity)
+
     return jsonify({
+        'qr_id': qr_id,
+        'granularity': granularity,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'total_scans': sum(scans for _, scans in timeline),
+        'timeline': [{'bucket': bucket, 'scans': scans} for bucket, scans in timeline]
+    })
+
+def period_scans(conn, period, start, end):
+    """Scans in a day or month, from the maintained counters.
+
+    Falls back to an indexed half-open [start, end) count over the
+    overlapping scan partitions when the period has no counter row.
+    """
+    row = conn.execute('SELECT scans FROM analytics_scan_counters WHERE period = ?',
+                       (period,)).fetchone()
+    if row:
+        return row['scans']
+    return count_scans(conn, start, end)
+
+def month_start(day, months_back=0):
+    month_index = day.year * 12 + day.month - 1 - months_back
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def top_products_of(conn, granularity, period, k, with_error=False):
+    """Top k products of a summary, with their names"""
+    top = topk.top(conn, 'product', granularity, period, k)
+    if not top:
+        return []
+    placeholders = ','.join('?' * len(top))
+    names = {row['id']: row for row in conn.execute(
+        f'SELECT id, product_name, brand FROM qr_codes WHERE id IN ({placeholders})',
+        [qr_id for qr_id, _, _ in top])}
+    products = []
+    for qr_id, count, error in top:
+        row = names.get(qr_id)
+        product = {'qr_id': qr_id,
+                   'product_name': row['product_name'] if row else None,
+                   'brand': row['brand'] if row else None,
+                   'scan_count': count}
+        if with_error:
+            product['max_error'] = error
+        products.append(product)
+    return products
+
+def build_dashboard():
+    today = datetime.now().date()
+    tomorrow = today + timedelta(days=1)
+    this_month = month_start(today)
+    last_month = month_start(today, 1)
+    next_month = month_start(today, -1)
+
+    with db.transaction() as conn:
+        c = conn.cursor()
+
+        # Total QR codes
+        c.execute('SELECT COUNT(*) as total FROM qr_codes WHERE is_active = 1')
+        total_qr_codes = c.fetchone()['total']
+
+        # Total scans today
+        scans_today = period_scans(conn, today.isoformat(),
+                                   today.isoformat(), tomorrow.isoformat())
+
+        # Total scans this month
+        scans_month = period_scans(conn, this_month.isoformat()[:7],
+                                   this_month.isoformat(), next_month.isoformat())
+
+        # Most scanned products, overall and in the current day/week/month
+        top_products = top_products_of(conn, 'all', 'all', 5)
+        trending_products = {granularity: top_products_of(conn, granularity,
+                                                          period_of(granularity, today.isoformat()), 5)
+                             for granularity in ('day', 'week', 'month')}
+
+        # Scan growth (compare to last month)
+        scans_last_month = period_scans(conn, last_month.isoformat()[:7],
+                                        last_month.isoformat(), this_month.isoformat())
+
+    growth_rate = ((scans_month - scans_last_month) / scans_last_month * 100) if scans_last_month > 0 else 0
+
+    return {
         'summary': {
             'total_qr_codes': total_qr_codes,
             'scans_today': scans_today,
@@ -349,32 +680,114 @@ def get_dashboard_analytics():
             'growth_rate': round(growth_rate, 1)
         },
         'top_products': top_products,
+        'trending_products': trending_products,
         'quick_stats': {
             'active_qr_codes': total_qr_codes,
             'average_daily_scans': scans_month // 30 if scans_month > 0 else 0
         }
+    }
+
+@app.route('/api/v1/analytics/dashboard', methods=['GET'])
+def get_dashboard_analytics():
+    """Get overall dashboard analytics"""
+    # Everyone refreshing within the TTL shares one computation
+    return jsonify(dashboard_cache.get_or_set('dashboard', build_dashboard))
+
+@app.route('/api/v1/analytics/top', methods=['GET'])
+def get_top_k():
+    """Most scanned products or cities of a day, week, month or all time.
+
+    period is any day in the wanted period (default: today). Per-code top
+    cities (qr_id) cover all time only. Counts are estimates: each count
+    overstates the true one by at most its max_error.
+    """
+    dimension = request.args.get('dimension', 'product')
+    granularity = request.args.get('granularity', 'all')
+    qr_id = request.args.get('qr_id')
+    limit = request.args.get('limit', 10, type=int)
+    if dimension not in ('product', 'city'):
+        return jsonify({'error': 'dimension must be product or city'}), 400
+    if granularity not in TOPK_GRANULARITIES:
+        return jsonify({'error': f"granularity must be one of {', '.join(TOPK_GRANULARITIES)}"}), 400
+    if not 0 < limit <= 100:
+        return jsonify({'error': 'limit must be between 1 and 100'}), 400
+    if qr_id is not None and (dimension != 'city' or granularity != 'all'):
+        return jsonify({'error': 'qr_id is only supported for dimension=city, granularity=all'}), 400
+    try:
+        day = date.fromisoformat(request.args.get('period', date.today().isoformat())[:10])
+    except ValueError:
+        return jsonify({'error': 'period must be an ISO date'}), 400
+    period = period_of(granularity, day.isoformat())
+
+    with db.transaction() as conn:
+        if dimension == 'product':
+            top = top_products_of(conn, granularity, period, limit, with_error=True)
+        else:
+            top = [{'city': city, 'country': country, 'scan_count': count, 'max_error': error}
+                   for (city, country), count, error in topk.top(conn, 'city', granularity, period, limit,
+                                                                 subject=qr_id or '')]
+
+    return jsonify({
+        'dimension': dimension,
+        'granularity': granularity,
+        'period': period,
+        'qr_id': qr_id,
+        'top': top
     })
 
-@app.route('/api/v1/qr/verify/<qr_id>', methods=['GET'])
-def verify_qr_code(qr_id):
-    """Verify and get QR code data for public display"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    
-    c.execute('SELECT * FROM qr_codes WHERE id = ? AND is_active = 1', (qr_id,))
-    qr_code = c.fetchone()
-    
-    if not qr_code:
-        conn.close()
-        return jsonify({'error': 'Invalid or inactive QR code'}), 404
-    
-    # Parse validation data
-    validation_data = json.loads(qr_code['validation_data'] or '{}')
-    
-    conn.close()
-    
+@app.route('/api/v1/analytics/unique-visitors', methods=['GET'])
+def get_unique_visitors():
+    """Estimate unique visitors for a QR code or a brand over an optional date range"""
+    qr_id = request.args.get('qr_id')
+    brand = request.args.get('brand')
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+
+    if not qr_id and not brand:
+        return jsonify({'error': 'qr_id or brand is required'}), 400
+    for value in (date_from, date_to):
+        if value is not None:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+
+    with db.transaction() as conn:
+        if qr_id:
+            qr_ids = [qr_id]
+        else:
+            rows = conn.execute('SELECT id FROM qr_codes WHERE brand = ?', (brand,)).fetchall()
+            qr_ids = [row['id'] for row in rows]
+        estimate, standard_error = count_unique_visitors(conn, qr_ids, date_from, date_to)
+
     return jsonify({
+        'qr_id': qr_id,
+        'brand': brand,
+        'from': date_from,
+        'to': date_to,
+        'qr_codes': len(qr_ids),
+        'unique_visitors': estimate,
+        'standard_error': round(standard_error, 4)
+    })
+
+def build_verify_response(qr_id):
+    """Serialized verify body and whether it may be cached, or None if the code is not valid"""
+    with db.transaction() as conn:
+        c = conn.cursor()
+
+        c.execute('SELECT * FROM qr_codes WHERE id = ? AND is_active = 1', (qr_id,))
+        qr_code = c.fetchone()
+
+        if not qr_code:
+            return None
+
+        # Parse validation data
+        validation_data = json.loads(qr_code['validation_data'] or '{}')
+
+        # Check the Merkle inclusion proof against the batch root
+        anchor = anchor_status(conn, qr_code)
+
+    body = app.json.dumps({
         'valid': True,
         'product': {
             'name': qr_code['product_name'],
@@ -383,12 +796,141 @@ def verify_qr_code(qr_id):
         },
         'validation': validation_data,
         'blockchain': {
-            'verified': True,
+            # A new code is 'pending' until the anchorer's next batch, not forged:
+            # only a failed proof clears verified
+            'verified': anchor['status'] != 'invalid',
+            'anchor_status': anchor['status'],
             'reference': qr_code['blockchain_ref'],
-            'network': 'Ethereum Mainnet'
+            'network': 'Ethereum Mainnet',
+            'anchor': anchor
         },
         'trust_score': validation_data.get('trust_score', 95)
-    })
+    }).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    # Pending codes flip to anchored within one anchoring interval
+    return body, etag, anchor['status'] != 'pending'
+
+@app.route('/api/v1/scans/export', methods=['GET'])
+def export_scans():
+    """Stream raw scans as CSV, NDJSON or Parquet, ordered by (scanned_at, id).
+
+    Filters: qr_id, brand, from (inclusive), to (exclusive). To resume,
+    pass the last row's scanned_at and id as after_scanned_at/after_id.
+    """
+    output_format = request.args.get('format', 'ndjson')
+    if output_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    if output_format == 'parquet' and not PARQUET_AVAILABLE:
+        return jsonify({'error': 'Parquet export requires pyarrow'}), 501
+
+    after_scanned_at = request.args.get('after_scanned_at')
+    after_id = request.args.get('after_id', type=int)
+    if (after_scanned_at is None) != (after_id is None):
+        return jsonify({'error': 'after_scanned_at and after_id go together'}), 400
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit <= 0:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    try:
+        start, end, after_scanned_at = (scan_time(value) if value is not None else None
+                                        for value in (request.args.get('from'), request.args.get('to'),
+                                                      after_scanned_at))
+    except ValueError:
+        return jsonify({'error': 'from, to and after_scanned_at must be ISO dates or timestamps'}), 400
+
+    pages = iter_scan_pages(db,
+                            qr_id=request.args.get('qr_id'),
+                            brand=request.args.get('brand'),
+                            start=start,
+                            end=end,
+                            after=(after_scanned_at, after_id) if after_id is not None else None,
+                            limit=limit)
+    archived = [month for month, _ in archived_months(db, start, end)]
+    return Response(export_chunks(pages, output_format),
+                    mimetype=EXPORT_MIMETYPES[output_format],
+                    headers={'Content-Disposition': f'attachment; filename=scans.{output_format}',
+                             'X-Archived-Months': ','.join(archived)})
+
+def load_verify_entry(qr_id):
+    """(body, etag) for a verify response, or None if the code is not valid.
+
+    Does the filter check and SQLite work of a verify cache miss; shared
+    with the ASGI hot path in qr_asgi.
+    """
+    if not known_qr_code(qr_id):
+        return None
+    # A PATCH committing while the row is read invalidates the code after
+    # this point, and the outdated entry is then not cached
+    generation = verify_cache.generation()
+    built = build_verify_response(qr_id)
+    if built is None:
+        return None
+    body, etag, cacheable = built
+    entry = (body, etag)
+    if cacheable:
+        verify_cache.set_if_unchanged(qr_id, entry, generation)
+    return entry
+
+@app.route('/api/v1/events/scans', methods=['GET'])
+def stream_scan_events():
+    """Server-Sent Events: a 'scan' event per tracked scan and a 'snapshot'
+    of the interval's counts every QR_EVENTS_SNAPSHOT seconds.
+
+    Filter with qr_id or brand (neither: all scans). A client that falls
+    behind receives a 'dropped' event with how many events it missed.
+    """
+    qr_id = request.args.get('qr_id')
+    brand = request.args.get('brand')
+    if qr_id is not None and brand is not None:
+        return jsonify({'error': 'Filter by qr_id or brand, not both'}), 400
+    if qr_id is not None and not known_qr_code(qr_id):
+        return jsonify({'error': 'QR code not found'}), 404
+
+    subscription = scan_events.subscribe(qr_id=qr_id, brand=brand)
+    if subscription is None:
+        return jsonify({'error': 'Too many open event streams'}), 503, {'Retry-After': '5'}
+    return Response(scan_events.stream(subscription, EVENTS_HEARTBEAT),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/v1/qr/verify/<qr_id>', methods=['GET'])
+def verify_qr_code(qr_id):
+    """Verify and get QR code data for public display"""
+    sync_qr_codes()
+    entry = verify_cache.get(qr_id) or load_verify_entry(qr_id)
+    if entry is None:
+        return jsonify({'error': 'Invalid or inactive QR code'}), 404
+
+    body, etag = entry
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = VERIFY_MAX_AGE
+    return response.make_conditional(request)
+
+@app.route('/api/v1/qr/<qr_id>', methods=['PATCH'])
+def update_qr_code(qr_id):
+    """Activate or deactivate a QR code"""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('is_active'), bool):
+        return jsonify({'error': 'is_active (boolean) is required'}), 400
+
+    with db.transaction(write=True) as conn:
+        updated = conn.execute('UPDATE qr_codes SET is_active = ? WHERE id = ?',
+                               (int(data['is_active']), qr_id)).rowcount
+    if not updated:
+        return jsonify({'error': 'QR code not found'}), 404
+
+    # Other processes pick the change up from qr_code_changes; the id
+    # stays in the Bloom filter either way
+    verify_cache.invalidate(qr_id)
+    brand_cache.invalidate(qr_id)
+    return jsonify({'success': True, 'qr_id': qr_id, 'is_active': data['is_active']})
+
+@app.route('/api/v1/qr/filter/stats', methods=['GET'])
+def get_qr_filter_stats():
+    """Size and accuracy of the in-memory QR id filter"""
+    return jsonify(qr_filter.stats())
 
 # Serve static files for testing
 @app.route('/')
@@ -398,10 +940,19 @@ def index():
     <p>API is running on port 5001</p>
     <ul>
         <li>POST /api/v1/qr/generate - Generate new QR code</li>
+        <li>POST /api/v1/qr/generate/bulk?format=ndjson|csv - Generate many QR codes (streamed)</li>
         <li>POST/GET /api/v1/qr/track/{qr_id} - Track QR scan</li>
         <li>GET /api/v1/qr/{qr_id}/analytics - Get QR analytics</li>
+        <li>GET /api/v1/qr/{qr_id}/timeline?from&amp;to&amp;granularity=auto|hour|day|week - Scan timeline</li>
         <li>GET /api/v1/analytics/dashboard - Dashboard stats</li>
+        <li>GET /api/v1/analytics/top?dimension=product|city&amp;granularity=day|week|month|all&amp;period&amp;qr_id - Most scanned products or cities</li>
+        <li>GET /api/v1/scans/export?format=csv|ndjson|parquet&amp;qr_id|brand&amp;from&amp;to - Export raw scans (streamed)</li>
+        <li>GET /api/v1/analytics/unique-visitors?qr_id|brand&amp;from&amp;to - Unique visitor estimate</li>
+        <li>GET /api/v1/events/scans?qr_id|brand - Live scan events and snapshots (Server-Sent Events)</li>
         <li>GET /api/v1/qr/verify/{qr_id} - Verify QR code</li>
+        <li>PATCH /api/v1/qr/{qr_id} - Activate/deactivate QR code</li>
+        <li>GET /api/v1/qr/filter/stats - QR id filter memory and false-positive rate</li>
+        <li>GET /metrics - Prometheus metrics: route latency, SQLite timings, lock waits (QR_METRICS=1)</li>
     </ul>
     '''
 
@@ -409,13 +960,30 @@ if __name__ == '__main__':
     print("🚀 TRUST Label QR Tracking API")
     print("================================")
     print(f"Database: {DB_PATH}")
+    stats = qr_filter.stats()
+    print(f"QR id filter: {stats['items']} codes, {stats['memory_bytes'] / 1024:.0f} KB, "
+          f"{stats['hashes']} hashes, target FPR {stats['target_fpr']:.2%}")
+    if geo_resolver is not None:
+        print(f"GeoIP: {len(geo_resolver)} ranges from {GEOIP_DB_PATH}")
     print("API running on: http://localhost:5001")
     print("\nEndpoints:")
     print("  POST   /api/v1/qr/generate")
+    print("  POST   /api/v1/qr/generate/bulk")
     print("  POST   /api/v1/qr/track/<qr_id>")
     print("  GET    /api/v1/qr/<qr_id>/analytics")
+    print("  GET    /api/v1/qr/<qr_id>/timeline")
     print("  GET    /api/v1/analytics/dashboard")
+    print("  GET    /api/v1/analytics/top")
+    print("  GET    /api/v1/analytics/unique-visitors")
+    print("  GET    /api/v1/scans/export")
+    print("  GET    /api/v1/events/scans")
     print("  GET    /api/v1/qr/verify/<qr_id>")
+    print("  PATCH  /api/v1/qr/<qr_id>")
+    print("  GET    /api/v1/qr/filter/stats")
+    if METRICS_ENABLED:
+        print("  GET    /metrics")
     print("\nPress Ctrl+C to stop")
     
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    # No debug reloader: its parent process would import a second copy of the app
+    start_background_jobs()
+    app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+TRUST Label - Batched Merkle anchoring
+Newly minted QR codes are grouped into batches; each batch commits one
+Merkle root to the chain and every code keeps a compact inclusion proof.
+
+Usage: python qr_anchoring.py [db_path]
+Migrates the database and anchors every pending QR code now.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from qr_migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+# Domain separation between leaves and inner nodes, so an inner node can
+# never be passed off as a leaf (second-preimage attack on the tree)
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+# A proof step is one side byte followed by the 32-byte sibling hash
+SIBLING_LEFT = 0
+SIBLING_RIGHT = 1
+STEP_SIZE = 33
+
+
+def leaf_hash(qr_id, product_id, product_name, brand, validation_data):
+    """Commitment to the fields shown on verification (validation_data as stored JSON text)"""
+    payload = json.dumps([qr_id, product_id, product_name, brand, validation_data],
+                         separators=(',', ':'))
+    return hashlib.sha256(LEAF_PREFIX + payload.encode('utf-8')).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def build_tree(leaves):
+    """Return the tree levels, leaves first and root last.
+
+    An odd node out is promoted to the next level unchanged rather than
+    paired with a copy of itself, so different leaf lists never share a root.
+    """
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def inclusion_proof(levels, index):
+    """Sibling path from leaf index to the root, encoded as bytes"""
+    proof = bytearray()
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            side = SIBLING_LEFT if sibling < index else SIBLING_RIGHT
+            proof.append(side)
+            proof += level[sibling]
+        index //= 2
+    return bytes(proof)
+
+
+def verify_proof(leaf, proof, root):
+    """Fold the proof into the leaf and compare with the root: O(log n) hashes"""
+    if len(proof) % STEP_SIZE:
+        return False
+    node = leaf
+    for offset in range(0, len(proof), STEP_SIZE):
+        sibling = proof[offset + 1:offset + STEP_SIZE]
+        if proof[offset] == SIBLING_LEFT:
+            node = node_hash(sibling, node)
+        else:
+            node = node_hash(node, sibling)
+    return node == root
+
+
+class LocalChain:
+    """Stand-in for the external chain: an append-only, hash-linked log of roots"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def commit(self, merkle_root):
+        """Record a root and return its transaction hash"""
+        row = self.conn.execute('SELECT tx_hash FROM anchor_chain ORDER BY height DESC LIMIT 1').fetchone()
+        prev_hash = row[0] if row else '0' * 64
+        tx_hash = hashlib.sha256(f'{prev_hash}{merkle_root}'.encode()).hexdigest()
+        self.conn.execute('''INSERT INTO anchor_chain (tx_hash, merkle_root, prev_hash, anchored_at)
+                             VALUES (?, ?, ?, ?)''',
+                          (tx_hash, merkle_root, prev_hash, datetime.now()))
+        return tx_hash
+
+    def contains(self, tx_hash, merkle_root):
+        row = self.conn.execute('SELECT merkle_root FROM anchor_chain WHERE tx_hash = ?',
+                                (tx_hash,)).fetchone()
+        return row is not None and row[0] == merkle_root
+
+
+def anchor_pending(conn, batch_size=10000, chain=None):
+    """Anchor up to batch_size not-yet-anchored QR codes, in the caller's write transaction.
+
+    Returns the new batch id, or None if nothing was pending.
+    """
+    chain = chain or LocalChain(conn)
+    row = conn.execute('SELECT last_rowid FROM anchor_batches ORDER BY id DESC LIMIT 1').fetchone()
+    rows = conn.execute('''SELECT rowid, id, product_id, product_name, brand, validation_data
+                           FROM qr_codes WHERE rowid > ? ORDER BY rowid LIMIT ?''',
+                        (row[0] if row else 0, batch_size)).fetchall()
+    if not rows:
+        return None
+
+    levels = build_tree([leaf_hash(*r[1:]) for r in rows])
+    merkle_root = levels[-1][0].hex()
+    tx_hash = chain.commit(merkle_root)
+    cursor = conn.execute('''INSERT INTO anchor_batches
+                             (merkle_root, leaf_count, first_rowid, last_rowid, created_at, chain_tx)
+                             VALUES (?, ?, ?, ?, ?, ?)''',
+                          (merkle_root, len(rows), rows[0][0], rows[-1][0], datetime.now(), tx_hash))
+    batch_id = cursor.lastrowid
+    conn.executemany('''INSERT INTO qr_anchor_proofs (qr_code_id, batch_id, leaf_index, proof)
+                        VALUES (?, ?, ?, ?)''',
+                     ((r[1], batch_id, i, inclusion_proof(levels, i)) for i, r in enumerate(rows)))
+    return batch_id
+
+
+def anchor_status(conn, qr_code):
+    """Check a qr_codes row against its batch root and the chain"""
+    row = conn.execute('''SELECT p.batch_id, p.leaf_index, p.proof, b.merkle_root, b.chain_tx
+                          FROM qr_anchor_proofs p
+                          JOIN anchor_batches b ON b.id = p.batch_id
+                          WHERE p.qr_code_id = ?''', (qr_code['id'],)).fetchone()
+    if row is None:
+        return {'status': 'pending'}
+
+    leaf = leaf_hash(qr_code['id'], qr_code['product_id'], qr_code['product_name'],
+                     qr_code['brand'], qr_code['validation_data'])
+    valid = (verify_proof(leaf, row['proof'], bytes.fromhex(row['merkle_root']))
+             and LocalChain(conn).contains(row['chain_tx'], row['merkle_root']))
+    return {
+        'status': 'anchored' if valid else 'invalid',
+        'batch_id': row['batch_id'],
+        'leaf_index': row['leaf_index'],
+        'merkle_root': row['merkle_root'],
+        'chain_tx': row['chain_tx'],
+        'proof_length': len(row['proof']) // STEP_SIZE
+    }
+
+
+class Anchorer:
+    """Background thread that anchors pending QR codes every interval seconds"""
+
+    def __init__(self, pool, interval=60.0, batch_size=10000):
+        self.pool = pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='qr-anchorer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=30.0):
+        """Stop the loop after anchoring whatever is still pending"""
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+
+    def run_once(self):
+        """Anchor batches until nothing is pending; returns the number of batches"""
+        batches = 0
+        while True:
+            with self.pool.transaction(write=True) as conn:
+                if anchor_pending(conn, self.batch_size) is None:
+                    return batches
+            batches += 1
+
+    def _run(self):
+        while True:
+            stopping = self._stop.wait(self.interval)
+            try:
+                self.run_once()
+            except sqlite3.Error:
+                logger.exception('Anchoring failed; pending codes are retried next interval')
+            if stopping:
+                return
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'qr_tracking.db'
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    migrate(conn)
+    conn.execute('COMMIT')
+    total = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        batch_id = anchor_pending(conn)
+        conn.execute('COMMIT')
+        if batch_id is None:
+            break
+        root, count = conn.execute('SELECT merkle_root, leaf_count FROM anchor_batches WHERE id = ?',
+                                   (batch_id,)).fetchone()
+        total += count
+        print(f"⚓ Batch {batch_id}: {count} codes, root {root}")
+    print(f"Anchored {total} QR codes")
@@ -0,0 +1,320 @@
+"""
+TRUST Label - ASGI serving mode for the QR tracking API
+Scan tracking, verify and the live event stream run natively on the event
+loop, with SQLite work on a dedicated DB thread pool; every other route is
+the Flask app behind asgiref's WSGI adapter. Routes and payloads are the
+same in both modes. Event streams are per worker process: with several
+workers a stream only sees the scans its own worker tracked.
+
+Requires: pip install uvicorn asgiref
+Usage: python qr_asgi.py [--port 5001] [--workers N]
+   or: uvicorn qr_asgi:app --port 5001 --workers N
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from qr_events import SSE_HEARTBEAT, SSE_RETRY
+
+_spec = importlib.util.spec_from_file_location(
+    'qr_tracking_api', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qr-tracking-api.py'))
+api = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(api)
+
+TRACK_ROUTE = re.compile(r'^/api/v1/qr/track/([^/]+)$')
+VERIFY_ROUTE = re.compile(r'^/api/v1/qr/verify/([^/]+)$')
+EVENTS_ROUTE = '/api/v1/events/scans'
+
+# Largest scan body read on the hot path; anything bigger goes to Flask
+MAX_SCAN_BODY = 64 * 1024
+
+# Returned by a native handler that handed the request to Flask after all
+FLASK_HANDLED = object()
+
+# One DB thread per pooled connection: SQLite calls never block the loop
+db_executor = ThreadPoolExecutor(max_workers=api.DB_POOL_SIZE, thread_name_prefix='qr-db')
+
+
+async def run_db(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+async def send_json(send, status, payload, headers=()):
+    await send_body(send, status, api.app.json.dumps(payload).encode('utf-8'),
+                    [(b'content-type', b'application/json')] + list(headers))
+
+
+async def send_body(send, status, body, headers):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers + [(b'content-length', str(len(body)).encode()),
+                              (b'access-control-allow-origin', b'*')],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class ChannelWakeups:
+    """Wakes the event streams of one loop: a single thread-safe callback per
+    event channel, however many streams on this loop read that channel"""
+
+    def __init__(self):
+        self.watched = {}
+
+    def acquire(self, channel):
+        entry = self.watched.get(channel)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+
+            def listener():
+                try:
+                    loop.call_soon_threadsafe(self._wake, channel)
+                except RuntimeError:
+                    pass  # loop closed during shutdown; nothing left to wake
+            entry = self.watched[channel] = {'changed': asyncio.Event(), 'streams': 0,
+                                             'listener': listener}
+            channel.add_listener(listener)
+        entry['streams'] += 1
+
+    def changed(self, channel):
+        """Event set at the next append to channel (take it before polling)"""
+        return self.watched[channel]['changed']
+
+    def release(self, channel):
+        entry = self.watched[channel]
+        entry['streams'] -= 1
+        if entry['streams'] == 0:
+            channel.remove_listener(entry['listener'])
+            del self.watched[channel]
+
+    def _wake(self, channel):
+        entry = self.watched.get(channel)
+        if entry is not None:
+            entry['changed'].set()
+            entry['changed'] = asyncio.Event()
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+class QRTrackingASGI:
+    """Serves the hot paths natively and hands everything else to the Flask app"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.wakeups = ChannelWakeups()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            method = scope['method']
+            match = TRACK_ROUTE.match(scope['path'])
+            if match and method in ('GET', 'POST'):
+                return await self.observed(method, '/api/v1/qr/track/<qr_id>', send,
+                                           lambda send: self.track_scan(scope, receive, send, match.group(1)))
+            match = VERIFY_ROUTE.match(scope['path'])
+            if match and method == 'GET':
+                return await self.observed(method, '/api/v1/qr/verify/<qr_id>', send,
+                                           lambda send: self.verify_qr_code(scope, send, match.group(1)))
+            if scope['path'] == EVENTS_ROUTE and method == 'GET':
+                # Long-lived: not timed, as a latency would only measure the stream length
+                return await self.stream_scan_events(scope, receive, send)
+        return await self.fallback(scope, receive, send)
+
+    async def observed(self, method, route, send, handler):
+        """Run a native handler, recording its latency like the Flask routes do"""
+        if not api.METRICS_ENABLED:
+            return await handler(send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_observed(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        if await handler(send_observed) is not FLASK_HANDLED:
+            api.METRICS.observe('http_request_duration_seconds',
+                                ('qr-tracking-api', method, route, str(status)),
+                                time.perf_counter() - started)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Only in workers: the multi-worker supervisor imports the API too
+                await run_db(api.start_background_jobs)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await run_db(api.anchorer.close)
+                await run_db(api.timeline_compactor.close)
+                if api.retention_job is not None:
+                    await run_db(api.retention_job.close)
+                await run_db(api.scan_events.close)
+                if api.scan_writer is not None:
+                    await run_db(api.scan_writer.close)
+                if api.rescan_flusher is not None:
+                    await run_db(api.rescan_flusher.close)
+                await run_db(api.topk.close)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def track_scan(self, scope, receive, send, qr_id):
+        location_data = {}
+        if scope['method'] == 'POST':
+            body, more = b'', True
+            while more and len(body) <= MAX_SCAN_BODY:
+                message = await receive()
+                body += message.get('body', b'')
+                more = message.get('more_body', False)
+            location_data = parse_location(scope, body, more)
+            if location_data is None:
+                # Let Flask produce its usual 400/415 for bodies it rejects (and time it)
+                await self.fallback(scope, replay(body, more, receive), send)
+                return FLASK_HANDLED
+
+        # Unknown ids (scrapers, forged labels) are rejected without touching SQLite
+        if qr_id not in api.qr_filter and not await run_db(api.known_qr_code, qr_id):
+            return await send_json(send, 404, {'error': 'QR code not found'})
+
+        client = scope.get('client')
+        scan = api.build_scan(qr_id,
+                              header(scope, b'x-forwarded-for') or (client[0] if client else None),
+                              header(scope, b'user-agent') or '',
+                              header(scope, b'referer') or '',
+                              location_data)
+        payload, status, headers = await run_db(api.store_scan, scan)
+        await send_json(send, status, payload,
+                        [(k.lower().encode(), v.encode()) for k, v in headers.items()])
+
+    async def verify_qr_code(self, scope, send, qr_id):
+        if time.monotonic() >= api.qr_changes['next_poll']:
+            await run_db(api.sync_qr_codes)
+        entry = api.verify_cache.get(qr_id)
+        if entry is None:
+            entry = await run_db(api.load_verify_entry, qr_id)
+        if entry is None:
+            return await send_json(send, 404, {'error': 'Invalid or inactive QR code'})
+
+        body, etag = entry
+        headers = [(b'etag', f'"{etag}"'.encode()),
+                   (b'cache-control', f'public, max-age={api.VERIFY_MAX_AGE}'.encode())]
+        if etag_matches(header(scope, b'if-none-match'), etag):
+            return await send_body(send, 304, b'', headers)
+        await send_body(send, 200, body, [(b'content-type', b'application/json')] + headers)
+
+    async def stream_scan_events(self, scope, receive, send):
+        params = parse_qs(scope['query_string'].decode('latin-1'))
+        qr_id = params.get('qr_id', [None])[0]
+        brand = params.get('brand', [None])[0]
+        if qr_id is not None and brand is not None:
+            return await send_json(send, 400, {'error': 'Filter by qr_id or brand, not both'})
+        if qr_id is not None and qr_id not in api.qr_filter and not await run_db(api.known_qr_code, qr_id):
+            return await send_json(send, 404, {'error': 'QR code not found'})
+
+        subscription = api.scan_events.subscribe(qr_id=qr_id, brand=brand)
+        if subscription is None:
+            return await send_json(send, 503, {'error': 'Too many open event streams'},
+                                   [(b'retry-after', b'5')])
+        channel = subscription.channel
+        self.wakeups.acquire(channel)
+        stream = asyncio.current_task()
+
+        async def cancel_on_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            stream.cancel()
+        watcher = asyncio.ensure_future(cancel_on_disconnect())
+
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'),
+                                    (b'cache-control', b'no-cache'),
+                                    (b'access-control-allow-origin', b'*')]})
+            await send({'type': 'http.response.body', 'body': SSE_RETRY, 'more_body': True})
+            while True:
+                changed = self.wakeups.changed(channel)
+                messages = subscription.poll()
+                if messages:
+                    await send({'type': 'http.response.body', 'body': b''.join(messages),
+                                'more_body': True})
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), api.EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    await send({'type': 'http.response.body', 'body': SSE_HEARTBEAT,
+                                'more_body': True})
+        except asyncio.CancelledError:
+            if not watcher.done():
+                raise  # server shutdown, not the client leaving
+        finally:
+            watcher.cancel()
+            self.wakeups.release(channel)
+            api.scan_events.unsubscribe(subscription)
+
+
+def parse_location(scope, body, more):
+    """JSON object body of a scan, or None if Flask should handle the request"""
+    content_type = header(scope, b'content-type') or ''
+    if more or not content_type.startswith('application/json'):
+        return None
+    try:
+        location_data = json.loads(body)
+    except ValueError:
+        return None
+    return location_data if isinstance(location_data, dict) else None
+
+
+def replay(body, more, receive):
+    """receive() that yields an already-read body before the rest of the stream"""
+    sent = False
+
+    async def replayed():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': more}
+        return await receive()
+    return replayed
+
+
+app = QRTrackingASGI(WsgiToAsgi(api.app))
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='TRUST Label QR Tracking API (ASGI)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (each opens its own pool and filter)')
+    args = parser.parse_args()
+
+    print("🚀 TRUST Label QR Tracking API (ASGI)")
+    print(f"API running on: http://localhost:{args.port} with {args.workers} worker(s)")
+    # Workers re-import the module; a single worker reuses the app loaded here
+    uvicorn.run(app if args.workers == 1 else 'qr_asgi:app', host=args.host, port=args.port,
+                workers=args.workers, log_level='warning', access_log=False)
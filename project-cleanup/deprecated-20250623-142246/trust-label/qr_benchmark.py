@@ -0,0 +1,246 @@
+"""
+TRUST Label - Benchmark suite for the QR tracking API
+Seeds a database with reproducible synthetic codes and scans, drives the
+scan, verify, analytics and dashboard routes at a fixed concurrency, saves
+the results as a JSON baseline and compares runs to flag regressions.
+
+Usage: python qr_benchmark.py seed [db_path] [--codes 10000] [--scans 1000000] [--days 90]
+       python qr_benchmark.py run [--url http://localhost:5001] [--db qr_tracking.db]
+                                  [--concurrency 32] [--duration 10] [--output baseline.json]
+       python qr_benchmark.py compare baseline.json current.json [--rps-tolerance 0.10]
+                                      [--latency-tolerance 0.20]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from qr_anchoring import leaf_hash
+from qr_ingest import Scan, record_scans
+from qr_loadtest import create_codes, run_scenario
+from qr_topk import TopKTracker
+from qr_useragent import CORPUS, classify_user_agent
+
+BENCHMARK_SCENARIOS = ('scan', 'verify', 'analytics', 'dashboard')
+
+# Rough Brazilian scan mix: (city, country, lat, lng, weight)
+CITIES = (
+    ('São Paulo', 'BR', -23.55, -46.63, 30),
+    ('Rio de Janeiro', 'BR', -22.91, -43.17, 15),
+    ('Belo Horizonte', 'BR', -19.92, -43.94, 7),
+    ('Brasília', 'BR', -15.79, -47.88, 6),
+    ('Curitiba', 'BR', -25.43, -49.27, 6),
+    ('Porto Alegre', 'BR', -30.03, -51.23, 5),
+    ('Salvador', 'BR', -12.97, -38.50, 5),
+    ('Recife', 'BR', -8.05, -34.88, 4),
+    ('Fortaleza', 'BR', -3.73, -38.52, 4),
+    ('Campinas', 'BR', -22.91, -47.06, 3),
+    ('Lisboa', 'PT', 38.72, -9.14, 2),
+    ('Unknown', 'BR', None, None, 13),
+)
+
+# Mobile-heavy, as label scans are
+USER_AGENT_WEIGHTS = {'mobile': 8, 'tablet': 1, 'desktop': 1}
+
+REFERRERS = ('', '', '', 'https://instagram.com/', 'https://www.google.com/')
+
+# Scans generated and committed per record_scans transaction
+SEED_BATCH_SIZE = 20000
+
+
+def seed_codes(conn, count, rng, brands=20):
+    """Insert count active QR codes; returns their ids"""
+    created_at = datetime.now()
+    rows = []
+    for i in range(count):
+        qr_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        brand = f'Brand {i % brands}'
+        product_id = f'bench-{i}'
+        product_name = f'Product {i}'
+        rows.append((qr_id, product_id, product_name, brand, created_at, '{}',
+                     leaf_hash(qr_id, product_id, product_name, brand, '{}').hex()))
+    conn.executemany('''INSERT INTO qr_codes
+                        (id, product_id, product_name, brand, created_at, validation_data, blockchain_ref)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    return [row[0] for row in rows]
+
+
+def synthetic_scans(codes, count, days, rng, batch_size=SEED_BATCH_SIZE, visitors=200000):
+    """Yield batches of Scan tuples spread evenly over the last days, oldest first.
+
+    Code popularity is Zipf-like (a few labels get most scans), cities and
+    user agents follow the weights above, and each batch covers a short
+    time slice so its rollup and sketch rows stay few.
+    """
+    code_weights = [1 / (rank + 1) for rank in range(len(codes))]
+    agents = [ua for ua, _, _ in CORPUS]
+    agent_weights = [USER_AGENT_WEIGHTS[device] for _, device, _ in CORPUS]
+    city_weights = [city[-1] for city in CITIES]
+    start = datetime.now() - timedelta(days=days)
+    span = days * 86400 / max(1, -(-count // batch_size))
+    made = 0
+    while made < count:
+        size = min(batch_size, count - made)
+        slice_start = start + timedelta(seconds=span * (made // batch_size))
+        offsets = sorted(rng.random() * span for _ in range(size))
+        batch = []
+        for offset, qr_id, ua, city in zip(offsets,
+                                           rng.choices(codes, code_weights, k=size),
+                                           rng.choices(agents, agent_weights, k=size),
+                                           rng.choices(CITIES, city_weights, k=size)):
+            device, browser = classify_user_agent(ua)
+            visitor = rng.randrange(visitors)
+            batch.append(Scan(qr_id, slice_start + timedelta(seconds=offset),
+                              f'100.{visitor >> 16 & 255}.{visitor >> 8 & 255}.{visitor & 255}',
+                              ua, city[2], city[3], city[0], city[1], device, browser,
+                              rng.choice(REFERRERS)))
+        yield batch
+        made += size
+
+
+def seed(db_path, codes=10000, scans=1000000, days=90, random_seed=42):
+    from qr_db import ConnectionPool
+    from qr_migrations import migrate
+
+    rng = random.Random(random_seed)
+    pool = ConnectionPool(db_path, size=1)
+    with pool.transaction(write=True) as conn:
+        migrate(conn)
+        qr_ids = seed_codes(conn, codes, rng)
+    print(f"✅ {codes} QR codes")
+
+    started = time.perf_counter()
+    done = 0
+    topk = TopKTracker(pool)
+    for batch in synthetic_scans(qr_ids, scans, days, rng):
+        with pool.transaction(write=True) as conn:
+            record_scans(conn, batch)
+        topk.record(batch)
+        done += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f"\r   {done}/{scans} scans ({done / elapsed:,.0f}/s)", end='', flush=True)
+    topk.run_once()
+    print(f"\n✅ {scans} scans over {days} days in {time.perf_counter() - started:.0f}s")
+
+
+def sample_codes(db_path, count):
+    """Random active QR ids of an existing (seeded) database"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute(
+            'SELECT id FROM qr_codes WHERE is_active = 1 ORDER BY RANDOM() LIMIT ?', (count,))]
+    finally:
+        conn.close()
+
+
+async def run(url, scenarios, concurrency, duration, codes):
+    results = {}
+    for scenario in scenarios:
+        results[scenario] = await run_scenario(url, scenario, concurrency, duration, codes)
+        print(json.dumps(results[scenario]), file=sys.stderr)
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'url': url,
+        'concurrency': concurrency,
+        'duration_s': duration,
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'scenarios': results,
+    }
+
+
+def compare(baseline, current, rps_tolerance=0.10, latency_tolerance=0.20):
+    """Rows of (scenario, metric, before, after, change, regressed) for shared scenarios"""
+    rows = []
+    for scenario, before in baseline['scenarios'].items():
+        after = current['scenarios'].get(scenario)
+        if after is None:
+            continue
+        for metric in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if metric not in before or metric not in after or not before[metric]:
+                continue
+            change = after[metric] / before[metric] - 1
+            # Throughput regresses when it drops, latency when it grows
+            regressed = (change < -rps_tolerance if metric == 'rps' else change > latency_tolerance)
+            rows.append((scenario, metric, before[metric], after[metric], change, regressed))
+        if after.get('errors', 0) > before.get('errors', 0):
+            rows.append((scenario, 'errors', before.get('errors', 0), after['errors'], None, True))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the QR tracking API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='fill a database with synthetic data')
+    seed_parser.add_argument('db_path', nargs='?', default='qr_tracking.db')
+    seed_parser.add_argument('--codes', type=int, default=10000)
+    seed_parser.add_argument('--scans', type=int, default=1000000)
+    seed_parser.add_argument('--days', type=int, default=90)
+    seed_parser.add_argument('--seed', type=int, default=42, help='random seed')
+
+    run_parser = commands.add_parser('run', help='drive the API and write a JSON baseline')
+    run_parser.add_argument('--url', default='http://localhost:5001')
+    run_parser.add_argument('--db', help='seeded database to draw QR ids from '
+                                         '(default: create codes through the API)')
+    run_parser.add_argument('--codes', type=int, default=1000, help='QR ids used by the run')
+    run_parser.add_argument('--scenario', action='append', choices=BENCHMARK_SCENARIOS)
+    run_parser.add_argument('--concurrency', type=int, default=32)
+    run_parser.add_argument('--duration', type=float, default=10.0)
+    run_parser.add_argument('--output', help='baseline file to write (default: stdout)')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions between two runs')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--rps-tolerance', type=float, default=0.10)
+    compare_parser.add_argument('--latency-tolerance', type=float, default=0.20)
+
+    args = parser.parse_args()
+
+    if args.command == 'seed':
+        seed(args.db_path, args.codes, args.scans, args.days, args.seed)
+
+    elif args.command == 'run':
+        if args.db:
+            codes = sample_codes(args.db, args.codes)
+        else:
+            parts = urlsplit(args.url)
+            codes = asyncio.run(create_codes(parts.hostname, parts.port or 80, args.codes))
+        result = asyncio.run(run(args.url, args.scenario or list(BENCHMARK_SCENARIOS),
+                                 args.concurrency, args.duration, codes))
+        output = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+            print(f"✅ Baseline written to {args.output}")
+        else:
+            print(output)
+
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        rows = compare(baseline, current, args.rps_tolerance, args.latency_tolerance)
+        regressions = 0
+        for scenario, metric, before, after, change, regressed in rows:
+            regressions += regressed
+            delta = f'{change:+.1%}' if change is not None else ''
+            print(f"{'❌' if regressed else '✅'} {scenario:<10} {metric:<7} {before:>10} -> {after:<10} {delta}")
+        if baseline.get('cpu_count') != current.get('cpu_count'):
+            print("⚠️  Runs come from machines with different CPU counts")
+        print(f"{regressions} regression(s)")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+TRUST Label - In-process response caching
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds.
+
+    get_or_set() computes a missing entry under a per-cache lock, so a burst
+    of requests for a cold key triggers one computation, not one per request.
+
+    A value read outside that lock can be outdated by the time it is stored:
+    take generation() before reading and store with set_if_unchanged(),
+    which skips keys invalidated in between.
+    """
+
+    def __init__(self, maxsize=1024, ttl=5.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._fill_lock = threading.Lock()
+        # Generation of the latest invalidations, newest last; keys dropped
+        # from it were invalidated at or before _floor
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def get(self, key):
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def set_if_unchanged(self, key, value, generation):
+        """set() unless key was invalidated after generation() returned generation; True if stored"""
+        with self._lock:
+            if self._invalidated.get(key, self._floor) > generation:
+                return False
+            self._store(key, value)
+            return True
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._fill_lock:
+            # Another thread may have filled it while we waited
+            value = self._lookup(key)
+            if value is None:
+                value = factory()
+                self.set(key, value)
+            return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            if len(self._invalidated) > self.maxsize:
+                self._floor = self._invalidated.popitem(last=False)[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self._invalidated.clear()
+            self._floor = self._generation
+
+    def __len__(self):
+        return len(self._data)
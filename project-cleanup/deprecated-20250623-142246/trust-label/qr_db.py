@@ -0,0 +1,114 @@
+"""
+TRUST Label - SQLite connection management
+Pooled, long-lived connections in WAL mode for the QR tracking API
+"""
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Applied to every new connection. journal_mode=WAL is persisted in the
+# database file; the rest are per-connection settings.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),       # readers never block the writer (and vice versa)
+    ('synchronous', 'NORMAL'),     # fsync on checkpoint only; safe with WAL
+    ('cache_size', -64000),        # 64 MB page cache per connection
+    ('mmap_size', 268435456),      # 256 MB memory-mapped reads
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),        # wait for the write lock instead of failing
+)
+
+# Prepared statements kept per connection by the sqlite3 module
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionPool:
+    """Fixed-size pool of reusable SQLite connections.
+
+    A connection is checked out for the duration of one transaction, so it
+    works with both thread-per-request servers (Flask's dev server) and
+    fixed worker pools.
+    """
+
+    def __init__(self, db_path, size=8, timeout=10.0, factory=sqlite3.Connection, metrics=None):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.factory = factory
+        # Optional service_metrics registry for pool and write-lock waits
+        self.metrics = metrics
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path,
+                               timeout=self.timeout,
+                               isolation_level=None,  # transactions are explicit
+                               check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE,
+                               factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        started = time.perf_counter()
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('connection pool exhausted') from None
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe('db_pool_acquire_wait_seconds', (), time.perf_counter() - started)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self, write=False):
+        """Check out a connection and run one transaction on it.
+
+        Writers use BEGIN IMMEDIATE so they queue on busy_timeout up front
+        instead of failing with "database is locked" when a read lock is
+        upgraded mid-transaction.
+        """
+        conn = self.acquire()
+        try:
+            if write and self.metrics is not None:
+                started = time.perf_counter()
+                conn.execute('BEGIN IMMEDIATE')
+                self.metrics.observe('sqlite_write_lock_wait_seconds', (), time.perf_counter() - started)
+            else:
+                conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            yield conn
+            conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+        self._idle = queue.LifoQueue()
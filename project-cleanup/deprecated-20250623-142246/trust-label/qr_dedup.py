@@ -0,0 +1,128 @@
+"""
+TRUST Label - Repeat scan deduplication
+A phone held over a label fires the scan endpoint several times within
+seconds. Scans repeating (qr_id, ip, user_agent) inside a sliding window
+are counted as rescans instead of being stored as new scan rows.
+
+Usage: python qr_dedup.py [window_seconds]
+Replays a burst-heavy synthetic scan stream and reports the write reduction.
+"""
+
+import threading
+import time
+from collections import Counter, deque
+
+
+class ScanDeduplicator:
+    """Sliding-window duplicate detector with time-bucketed eviction.
+
+    The window is split into `buckets` slots of window/buckets seconds. Each
+    recorded key remembers the slot it was recorded in and is listed under
+    that slot; once a slot falls out of the window its keys are dropped in
+    one pass, so memory holds only the keys of the last window (plus one
+    slot) and eviction never scans the whole table. A key is a duplicate
+    while it was recorded less than `window` seconds ago, to within one
+    slot. Rescans are not extended windows: the next scan after the window
+    is recorded again even if rescans kept arriving.
+    """
+
+    def __init__(self, window=10.0, buckets=10):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_width = window / buckets
+        self._seen = {}
+        self._slots = deque()
+        self._lock = threading.Lock()
+        self._rescans = Counter()
+        self._last_take = time.monotonic()
+        self.recorded = 0
+        self.duplicates = 0
+
+    def check(self, qr_id, ip_address, user_agent, day, now=None):
+        """True if the scan should be stored; False if it was counted as a rescan of day"""
+        slot = int((time.monotonic() if now is None else now) // self.bucket_width)
+        key = (qr_id, ip_address, user_agent)
+        with self._lock:
+            self._evict(slot)
+            seen = self._seen.get(key)
+            if seen is not None and slot - seen < self.buckets:
+                self._rescans[(qr_id, day)] += 1
+                self.duplicates += 1
+                return False
+            self._seen[key] = slot
+            if not self._slots or self._slots[-1][0] != slot:
+                self._slots.append((slot, []))
+            self._slots[-1][1].append(key)
+            self.recorded += 1
+            return True
+
+    def forget(self, qr_id, ip_address, user_agent):
+        """Drop a recorded key whose scan could not be stored after all"""
+        with self._lock:
+            if self._seen.pop((qr_id, ip_address, user_agent), None) is not None:
+                self.recorded -= 1
+
+    def _evict(self, slot):
+        while self._slots and slot - self._slots[0][0] >= self.buckets:
+            expired, keys = self._slots.popleft()
+            for key in keys:
+                if self._seen.get(key) == expired:
+                    del self._seen[key]
+
+    def take_rescans(self, min_interval=0.0):
+        """Pending {(qr_id, day): rescans}, cleared; empty until min_interval has passed"""
+        with self._lock:
+            now = time.monotonic()
+            if not self._rescans or now - self._last_take < min_interval:
+                return {}
+            rescans, self._rescans = self._rescans, Counter()
+            self._last_take = now
+            return rescans
+
+    def restore_rescans(self, rescans):
+        """Put back rescans from take_rescans() that could not be written"""
+        with self._lock:
+            self._rescans.update(rescans)
+
+    def __len__(self):
+        return len(self._seen)
+
+    def stats(self):
+        return {
+            'window_seconds': self.window,
+            'tracked_keys': len(self._seen),
+            'recorded': self.recorded,
+            'duplicates': self.duplicates,
+        }
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+
+    window = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    dedup = ScanDeduplicator(window)
+
+    # One hour of traffic: 20k visitors, each firing a burst of 1-6 scans
+    # over a few seconds, some coming back later in the hour
+    events = []
+    for visitor in range(20000):
+        qr_id = f'qr-{random.randrange(500)}'
+        ip = f'10.{visitor // 256 % 256}.{visitor % 256}.1'
+        for visit_start in random.sample(range(3600), random.choice((1, 1, 1, 2))):
+            for i in range(random.randint(1, 6)):
+                events.append((visit_start + i * random.uniform(0.2, 1.5), qr_id, ip))
+    events.sort()
+
+    peak = 0
+    started = time.perf_counter()
+    for at, qr_id, ip in events:
+        dedup.check(qr_id, ip, 'Mozilla/5.0', '2025-01-01', now=at)
+        peak = max(peak, len(dedup))
+    elapsed = time.perf_counter() - started
+
+    stats = dedup.stats()
+    print(f"Window {window:g}s: {len(events)} scans -> {stats['recorded']} rows "
+          f"({1 - stats['recorded'] / len(events):.0%} fewer writes), "
+          f"{stats['duplicates']} rescans")
+    print(f"Peak tracked keys: {peak}, {elapsed / len(events) * 1e6:.2f} us per check")
@@ -0,0 +1,259 @@
+"""
+TRUST Label - Real-time scan events
+Fans scan events out to dashboard subscribers over Server-Sent Events,
+filtered by QR code, brand or neither.
+
+Subscribers with the same filter share a channel: a bounded ring of
+encoded SSE messages plus the scan counters of the current snapshot
+interval. Each subscriber only keeps its position in the ring, so a
+publish costs one JSON encoding and at most three ring appends however many
+dashboards are open. A subscriber that falls more than the ring size
+behind loses its oldest events (drop-oldest) and is told how many; the
+periodic snapshot messages carry exact per-interval counts regardless.
+
+Usage: python qr_events.py [subscribers] [events]
+Measures publish cost and memory with many open subscriptions.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter, deque
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+# Messages kept per channel; a subscriber further behind drops the oldest
+CHANNEL_BUFFER_SIZE = 256
+
+SSE_RETRY = b'retry: 3000\n\n'
+# A comment line keeps proxies from closing idle streams
+SSE_HEARTBEAT = b': keepalive\n\n'
+
+
+def sse_message(event_type, data):
+    return f'event: {event_type}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
+
+
+def scan_event(scan, brand):
+    return {
+        'qr_id': scan.qr_code_id,
+        'brand': brand,
+        'scanned_at': scan.scanned_at.isoformat(),
+        'city': scan.city,
+        'country': scan.country,
+        'device_type': scan.device_type,
+        'browser': scan.browser,
+    }
+
+
+class Channel:
+    """Ring of SSE messages for one filter, with a sequence number per message"""
+
+    def __init__(self, key, size=CHANNEL_BUFFER_SIZE):
+        self.key = key
+        self.messages = deque(maxlen=size)
+        self.seq = 0
+        self.subscribers = 0
+        self.delta = Counter()
+        self.delta_since = time.time()
+        # Called after every append (from the publishing thread); the ASGI
+        # app registers one per event loop instead of waiting per stream
+        self.listeners = ()
+        self.changed = threading.Condition()
+
+    def append(self, message, event=None):
+        with self.changed:
+            self.seq += 1
+            self.messages.append(message)
+            if event is not None:
+                self.delta['scans'] += 1
+                self.delta[('city', event['city'] or 'Unknown')] += 1
+                self.delta[('device', event['device_type'] or 'Unknown')] += 1
+            self.changed.notify_all()
+            listeners = self.listeners
+        for listener in listeners:
+            listener()
+
+    def add_listener(self, listener):
+        with self.changed:
+            self.listeners = self.listeners + (listener,)
+
+    def remove_listener(self, listener):
+        with self.changed:
+            self.listeners = tuple(l for l in self.listeners if l is not listener)
+
+    def read(self, cursor):
+        """(messages after cursor, how many of those were already dropped, new cursor)"""
+        with self.changed:
+            oldest = self.seq - len(self.messages) + 1
+            dropped = max(0, oldest - cursor - 1)
+            messages = list(islice(self.messages, max(0, cursor + 1 - oldest), None))
+            return messages, dropped, self.seq
+
+    def wait(self, cursor, timeout):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.seq > cursor, timeout)
+
+    def append_snapshot(self):
+        """Publish the counts since the previous snapshot and start a new interval"""
+        now = time.time()
+        with self.changed:
+            delta, self.delta = self.delta, Counter()
+            since, self.delta_since = self.delta_since, now
+        snapshot = {'since': since, 'until': now, 'scans': delta.pop('scans', 0),
+                    'by_city': {}, 'by_device': {}}
+        for (dimension, value), count in delta.items():
+            snapshot['by_' + dimension][value] = count
+        self.append(sse_message('snapshot', snapshot))
+
+
+class Subscription:
+    """One open stream: a channel and the last message it has seen"""
+
+    __slots__ = ('channel', 'cursor')
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.cursor = channel.seq
+
+    def poll(self):
+        """Encoded messages not yet sent, led by a notice if some were dropped"""
+        messages, dropped, self.cursor = self.channel.read(self.cursor)
+        if dropped:
+            messages.insert(0, sse_message('dropped', {'events': dropped}))
+        return messages
+
+    def wait(self, timeout):
+        return self.channel.wait(self.cursor, timeout)
+
+
+class ScanEventHub:
+    """Channels by filter key ('all', 'qr:<id>', 'brand:<name>'), created on first subscribe"""
+
+    def __init__(self, max_subscribers=10000, snapshot_interval=5.0, buffer_size=CHANNEL_BUFFER_SIZE):
+        self.max_subscribers = max_subscribers
+        self.snapshot_interval = snapshot_interval
+        self.buffer_size = buffer_size
+        self.channels = {}
+        self.subscribers = 0
+        self.published = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='qr-event-snapshots', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=5.0):
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+
+    def subscribe(self, qr_id=None, brand=None):
+        """A Subscription, or None when max_subscribers streams are already open"""
+        key = f'qr:{qr_id}' if qr_id is not None else f'brand:{brand}' if brand is not None else 'all'
+        with self._lock:
+            if self.subscribers >= self.max_subscribers:
+                return None
+            channel = self.channels.get(key)
+            if channel is None:
+                channel = self.channels[key] = Channel(key, self.buffer_size)
+            channel.subscribers += 1
+            self.subscribers += 1
+        return Subscription(channel)
+
+    def unsubscribe(self, subscription):
+        channel = subscription.channel
+        with self._lock:
+            channel.subscribers -= 1
+            self.subscribers -= 1
+            if channel.subscribers == 0 and self.channels.get(channel.key) is channel:
+                del self.channels[channel.key]
+
+    def publish(self, event):
+        """Deliver a scan event (a dict with qr_id and brand) to the matching channels"""
+        channels = self.channels
+        if not channels:
+            return
+        message = None
+        for key in ('all', f"qr:{event['qr_id']}", f"brand:{event['brand']}"):
+            channel = channels.get(key)
+            if channel is not None:
+                if message is None:
+                    message = sse_message('scan', event)
+                channel.append(message, event)
+        self.published += 1
+
+    def stream(self, subscription, heartbeat=15.0):
+        """Blocking SSE byte stream for a thread-per-request server; unsubscribes when closed"""
+        try:
+            yield SSE_RETRY
+            while True:
+                messages = subscription.poll()
+                if messages:
+                    yield b''.join(messages)
+                elif not subscription.wait(heartbeat):
+                    yield SSE_HEARTBEAT
+        finally:
+            self.unsubscribe(subscription)
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            for channel in list(self.channels.values()):
+                try:
+                    channel.append_snapshot()
+                except Exception:
+                    logger.exception('Snapshot for channel %s failed', channel.key)
+
+
+if __name__ == '__main__':
+    import random
+    import sys
+    import tracemalloc
+
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    events = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    qr_ids = [f'qr-{i}' for i in range(1000)]
+    brands = [f'Brand {i}' for i in range(50)]
+
+    tracemalloc.start()
+    hub = ScanEventHub(max_subscribers=subscribers)
+    subscriptions = []
+    for i in range(subscribers):
+        # Mostly per-product dashboards, some brand pages and a few global views
+        kind = i % 20
+        if kind == 0:
+            subscriptions.append(hub.subscribe())
+        elif kind < 5:
+            subscriptions.append(hub.subscribe(brand=random.choice(brands)))
+        else:
+            subscriptions.append(hub.subscribe(qr_id=random.choice(qr_ids)))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    payload = [{'qr_id': random.choice(qr_ids), 'brand': random.choice(brands), 'scanned_at': '',
+                'city': 'São Paulo', 'country': 'BR', 'device_type': 'mobile', 'browser': 'Safari'}
+               for _ in range(events)]
+    started = time.perf_counter()
+    for event in payload:
+        hub.publish(event)
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    delivered = dropped = 0
+    for subscription in subscriptions:
+        for message in subscription.poll():
+            if message.startswith(b'event: dropped'):
+                dropped += json.loads(message.split(b'data: ', 1)[1])['events']
+            else:
+                delivered += 1
+    drain = time.perf_counter() - started
+
+    print(f"{subscribers} subscribers on {len(hub.channels)} channels: "
+          f"{memory / subscribers:.0f} bytes each")
+    print(f"Publish: {elapsed / events * 1e6:.1f} us per event")
+    print(f"Drain after {events} events: {delivered} delivered, {dropped} dropped (oldest), "
+          f"{drain * 1000:.0f} ms for all subscribers")
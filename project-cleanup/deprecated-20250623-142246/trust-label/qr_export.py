@@ -0,0 +1,216 @@
+"""
+TRUST Label - Scan history export
+Streams scans in (scanned_at, id) order as CSV, NDJSON or Parquet, one
+keyset page at a time, so memory stays flat however large the export is.
+
+Usage: python qr_export.py [db_path] [--format csv|ndjson|parquet] [--qr-id ID] [--brand BRAND]
+                           [--from TS] [--to TS] [--after-scanned-at TS --after-id N]
+                           [--limit N] [--output FILE]
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+
+from qr_partitions import SCAN_COLUMNS, hot_partitions, month_bounds
+from qr_timeline import parse_time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARQUET_AVAILABLE = pa is not None
+
+EXPORT_FORMATS = ('csv', 'ndjson', 'parquet')
+MIMETYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Rows per keyset page (one short read transaction each) and per Parquet row group
+EXPORT_PAGE_SIZE = 5000
+
+
+def scan_time(value):
+    """A time bound in the stored scanned_at form, 'YYYY-MM-DD HH:MM:SS[.ffffff]'.
+
+    Bounds are compared with the stored text, so '2025-03-01T10:00' has to
+    become '2025-03-01 10:00:00' first. Aware times are converted to local
+    time, which is what scans are stored in. Raises ValueError for values
+    parse_time does not accept.
+    """
+    moment = parse_time(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return str(moment)
+
+
+def iter_scan_pages(pool, qr_id=None, brand=None, start=None, end=None, after=None,
+                    limit=None, page_size=EXPORT_PAGE_SIZE):
+    """Yield lists of scan rows ordered by (scanned_at, id).
+
+    start/end bound scanned_at as a half-open range; after=(scanned_at, id)
+    resumes just past a row from a previous export. Every page is fetched
+    in its own read transaction with "WHERE (scanned_at, id) > (?, ?)
+    ... LIMIT n", so no snapshot or connection is held between pages.
+    Only hot partitions are read; archived months are already files.
+    """
+    start = scan_time(start) if start is not None else None
+    end = scan_time(end) if end is not None else None
+    after = (scan_time(after[0]), int(after[1])) if after is not None else None
+    with pool.transaction() as conn:
+        partitions = hot_partitions(conn, start, end)
+
+    columns = ', '.join(f's.{column}' for column in SCAN_COLUMNS)
+    remaining = limit
+    for month, table in partitions:
+        month_start, month_end = month_bounds(month)
+        conditions = ['s.scanned_at >= ?', 's.scanned_at < ?', '(s.scanned_at, s.id) > (?, ?)']
+        lower = max(month_start, start) if start is not None else month_start
+        upper = min(month_end, end) if end is not None else month_end
+        join = ''
+        filters = []
+        if qr_id is not None:
+            conditions.append('s.qr_code_id = ?')
+            filters.append(qr_id)
+        if brand is not None:
+            join = 'JOIN qr_codes q ON q.id = s.qr_code_id'
+            conditions.append('q.brand = ?')
+            filters.append(brand)
+
+        cursor = after if after is not None else ('', 0)
+        while remaining is None or remaining > 0:
+            size = page_size if remaining is None else min(page_size, remaining)
+            with pool.transaction() as conn:
+                rows = conn.execute(f'''SELECT {columns} FROM {table} s {join}
+                                        WHERE {' AND '.join(conditions)}
+                                        ORDER BY s.scanned_at, s.id
+                                        LIMIT ?''',
+                                    # The cursor also tightens the index range start
+                                    [max(lower, cursor[0]), upper, *cursor, *filters, size]).fetchall()
+            if not rows:
+                break
+            yield rows
+            if remaining is not None:
+                remaining -= len(rows)
+            if len(rows) < size:
+                break
+            cursor = (rows[-1]['scanned_at'], rows[-1]['id'])
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands its bytes to the caller between row groups"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def export_chunks(pages, output_format):
+    """Encode pages of scan rows as a stream of bytes chunks"""
+    if output_format == 'parquet':
+        if pa is None:
+            raise RuntimeError('Parquet export requires pyarrow')
+        sink = _ChunkSink()
+        schema = pa.schema([(column, pa.float64() if column.startswith('location_')
+                             else pa.int64() if column == 'id' else pa.string())
+                            for column in SCAN_COLUMNS])
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        for rows in pages:
+            writer.write_table(pa.table({column: [row[column] for row in rows] for column in SCAN_COLUMNS},
+                                        schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+        return
+
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(SCAN_COLUMNS)
+        yield buffer.getvalue().encode('utf-8')
+
+    for rows in pages:
+        buffer = io.StringIO()
+        if output_format == 'csv':
+            csv.writer(buffer).writerows(tuple(row) for row in rows)
+        else:
+            for row in rows:
+                buffer.write(json.dumps(dict(row)))
+                buffer.write('\n')
+        yield buffer.getvalue().encode('utf-8')
+
+
+def archived_months(pool, start=None, end=None):
+    """Archived months overlapping [start, end): not covered by an export"""
+    start = scan_time(start) if start is not None else None
+    end = scan_time(end) if end is not None else None
+    with pool.transaction() as conn:
+        rows = conn.execute('''SELECT month, archive_path FROM scan_partitions
+                               WHERE status = 'archived' ORDER BY month''').fetchall()
+    months = []
+    for month, path in rows:
+        month_start, month_end = month_bounds(month)
+        if (start is None or month_end > start) and (end is None or month_start < end):
+            months.append((month, path))
+    return months
+
+
+if __name__ == '__main__':
+    from qr_db import ConnectionPool
+    from qr_migrations import migrate
+
+    parser = argparse.ArgumentParser(description='Export scan history')
+    parser.add_argument('db_path', nargs='?', default='qr_tracking.db')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--qr-id')
+    parser.add_argument('--brand')
+    parser.add_argument('--from', dest='start', type=scan_time, help='scanned_at lower bound (inclusive)')
+    parser.add_argument('--to', dest='end', type=scan_time, help='scanned_at upper bound (exclusive)')
+    parser.add_argument('--after-scanned-at', type=scan_time)
+    parser.add_argument('--after-id', type=int)
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--output', help='file to write (default: stdout)')
+    args = parser.parse_args()
+
+    if args.format == 'parquet' and not args.output:
+        parser.error('--output is required for parquet')
+    if (args.after_scanned_at is None) != (args.after_id is None):
+        parser.error('--after-scanned-at and --after-id go together')
+
+    pool = ConnectionPool(args.db_path, size=1)
+    with pool.transaction(write=True) as conn:
+        migrate(conn)
+
+    after = (args.after_scanned_at, args.after_id) if args.after_id is not None else None
+    pages = iter_scan_pages(pool, args.qr_id, args.brand, args.start, args.end, after, args.limit)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(pages, args.format):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+    for month, path in archived_months(pool, args.start, args.end):
+        print(f"⚠️  {month} is archived in {path} and not included", file=sys.stderr)
@@ -0,0 +1,164 @@
+"""
+TRUST Label - Offline IP geolocation
+Resolves scan IPs to city/country from a local IP-range CSV: ranges are
+held in sorted arrays and found with a binary search, and results are
+memoized per IP. No external service is called.
+
+The CSV has one range per row: start_ip, end_ip, country, city and
+optionally latitude, longitude (IPv4 and IPv6 may be mixed; a header row
+and .gz compression are accepted). DB-IP's "IP to City Lite" CSV, with
+columns ip_start, ip_end, continent, country, stateprov, city, latitude,
+longitude, is read as well.
+
+Usage: python qr_geoip.py [csv_path | --synthetic N] [ip ...]
+Loads the database, resolves the given IPs and measures lookup cost.
+"""
+
+import bisect
+import csv
+import gzip
+import ipaddress
+import socket
+import sys
+import time
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+
+Location = namedtuple('Location', ['country', 'city', 'lat', 'lng'])
+
+# Distinct client IPs memoized per process
+GEO_CACHE_SIZE = 65536
+
+DBIP_COLUMNS = 8
+
+# ::ffff:0:0/96 embeds an IPv4 address in its low 32 bits
+IPV4_MAPPED_PREFIX = 0xffff << 32
+
+
+class GeoResolver:
+    """Binary search over sorted, non-overlapping IP ranges"""
+
+    def __init__(self, ranges=()):
+        # IPv4 bounds fit in compact unsigned 32-bit arrays; IPv6 needs ints
+        self.v4_starts, self.v4_ends, self.v4_locations = array('I'), array('I'), array('I')
+        self.v6_starts, self.v6_ends, self.v6_locations = [], [], array('I')
+        self.locations = []
+        location_ids = {}
+        for start, end, location in sorted(ranges, key=lambda r: (r[0].version, int(r[0]))):
+            location_id = location_ids.get(location)
+            if location_id is None:
+                location_id = location_ids[location] = len(self.locations)
+                self.locations.append(location)
+            if start.version == 4:
+                self.v4_starts.append(int(start))
+                self.v4_ends.append(int(end))
+                self.v4_locations.append(location_id)
+            else:
+                self.v6_starts.append(int(start))
+                self.v6_ends.append(int(end))
+                self.v6_locations.append(location_id)
+        self.lookup = lru_cache(maxsize=GEO_CACHE_SIZE)(self._lookup)
+
+    def __len__(self):
+        return len(self.v4_starts) + len(self.v6_starts)
+
+    @classmethod
+    def from_csv(cls, path):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', newline='') as f:
+            return cls(parse_rows(csv.reader(f)))
+
+    def _lookup(self, ip):
+        """Location of an IP address string, or None if unknown or unparsable"""
+        # inet_pton is several times cheaper than building ipaddress objects
+        ip = ip.strip()
+        try:
+            value = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+            version = 4
+        except OSError:
+            try:
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+            except OSError:
+                return None
+            version = 6
+            if value >> 32 == 0xffff:
+                value -= IPV4_MAPPED_PREFIX
+                version = 4
+        if version == 4:
+            starts, ends, location_ids = self.v4_starts, self.v4_ends, self.v4_locations
+        else:
+            starts, ends, location_ids = self.v6_starts, self.v6_ends, self.v6_locations
+        i = bisect.bisect_right(starts, value) - 1
+        if i < 0 or value > ends[i]:
+            return None
+        return self.locations[location_ids[i]]
+
+
+def parse_rows(rows):
+    """(start, end, Location) from CSV rows, skipping a header and malformed lines"""
+    for row in rows:
+        if len(row) < 4:
+            continue
+        try:
+            start = ipaddress.ip_address(row[0].strip())
+            end = ipaddress.ip_address(row[1].strip())
+        except ValueError:
+            continue
+        if len(row) >= DBIP_COLUMNS:
+            country, city, lat, lng = row[3], row[5], row[6], row[7]
+        else:
+            country, city = row[2], row[3]
+            lat, lng = (row[4], row[5]) if len(row) >= 6 else (None, None)
+        yield start, end, Location(country.strip() or None, city.strip() or None,
+                                   float(lat) if lat else None, float(lng) if lng else None)
+
+
+def client_ip(forwarded_for):
+    """Originating client of an X-Forwarded-For value (its first entry)"""
+    return forwarded_for.split(',', 1)[0].strip() if forwarded_for else forwarded_for
+
+
+def synthetic_ranges(count):
+    """count adjacent /24-sized IPv4 ranges plus a few IPv6 ones, for benchmarks"""
+    for i in range(count):
+        start = 0x01000000 + i * 256
+        yield (ipaddress.IPv4Address(start), ipaddress.IPv4Address(start + 255),
+               Location('BR', f'City {i % 5000}', None, None))
+    for i in range(count // 10):
+        start = (0x2001_0db8 << 96) + (i << 64)
+        yield (ipaddress.IPv6Address(start), ipaddress.IPv6Address(start + (1 << 64) - 1),
+               Location('PT', f'Cidade {i % 500}', None, None))
+
+
+if __name__ == '__main__':
+    import random
+
+    args = sys.argv[1:]
+    started = time.perf_counter()
+    if args[:1] == ['--synthetic']:
+        resolver = GeoResolver(synthetic_ranges(int(args[1])))
+        args = args[2:]
+    else:
+        resolver = GeoResolver.from_csv(args.pop(0) if args else 'geoip.csv')
+    print(f"Loaded {len(resolver)} ranges, {len(resolver.locations)} locations "
+          f"in {time.perf_counter() - started:.2f}s")
+
+    for ip in args:
+        print(f"  {ip}: {resolver.lookup(ip)}")
+
+    if resolver.v4_starts:
+        low, high = resolver.v4_starts[0], resolver.v4_ends[-1]
+        ips = [str(ipaddress.IPv4Address(random.randint(low, high))) for _ in range(20000)]
+        started = time.perf_counter()
+        for ip in ips:
+            resolver._lookup(ip)
+        cold = (time.perf_counter() - started) / len(ips) * 1e6
+        hot_ips = ips[:500] * 40
+        for ip in hot_ips:
+            resolver.lookup(ip)
+        started = time.perf_counter()
+        for ip in hot_ips:
+            resolver.lookup(ip)
+        hot = (time.perf_counter() - started) / len(hot_ips) * 1e6
+        print(f"Lookup: {cold:.2f} us uncached, {hot:.2f} us memoized")
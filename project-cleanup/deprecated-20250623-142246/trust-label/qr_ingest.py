@@ -0,0 +1,312 @@
+"""
+TRUST Label - Scan ingestion
+Writes scans to SQLite, either inline or through a group-commit queue
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import date
+from collections import Counter, defaultdict, namedtuple
+
+from qr_partitions import insert_scans, month_of
+from qr_sketches import HyperLogLog
+from qr_timeline import record_timeline
+
+logger = logging.getLogger(__name__)
+
+Scan = namedtuple('Scan', ['qr_code_id', 'scanned_at', 'ip_address', 'user_agent',
+                           'location_lat', 'location_lng', 'city', 'country',
+                           'device_type', 'browser', 'referrer'])
+
+# Relies on the unique (qr_code_id, date) index from migration 2
+UPSERT_SUMMARY_SQL = '''INSERT INTO analytics_summary
+                        (qr_code_id, date, total_scans, unique_ips,
+                         mobile_scans, desktop_scans, tablet_scans)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(qr_code_id, date) DO UPDATE SET
+                            total_scans = total_scans + excluded.total_scans,
+                            unique_ips = excluded.unique_ips,
+                            mobile_scans = mobile_scans + excluded.mobile_scans,
+                            desktop_scans = desktop_scans + excluded.desktop_scans,
+                            tablet_scans = tablet_scans + excluded.tablet_scans'''
+
+UPSERT_BREAKDOWN_SQL = '''INSERT INTO analytics_daily_breakdown
+                          (qr_code_id, date, dimension, value, detail, scans)
+                          VALUES (?, ?, ?, ?, ?, ?)
+                          ON CONFLICT(qr_code_id, date, dimension, value, detail)
+                          DO UPDATE SET scans = scans + excluded.scans'''
+
+SELECT_SKETCH_SQL = '''SELECT registers FROM analytics_visitor_sketches
+                       WHERE qr_code_id = ? AND period = ?'''
+
+UPSERT_SKETCH_SQL = '''INSERT INTO analytics_visitor_sketches (qr_code_id, period, registers)
+                       VALUES (?, ?, ?)
+                       ON CONFLICT(qr_code_id, period) DO UPDATE SET registers = excluded.registers'''
+
+UPDATE_TOP_CITY_SQL = '''UPDATE analytics_summary
+                         SET top_city = (SELECT value FROM analytics_daily_breakdown
+                                         WHERE qr_code_id = ? AND date = ? AND dimension = 'city'
+                                         ORDER BY scans DESC LIMIT 1)
+                         WHERE qr_code_id = ? AND date = ?'''
+
+UPSERT_COUNTER_SQL = '''INSERT INTO analytics_scan_counters (period, scans) VALUES (?, ?)
+                        ON CONFLICT(period) DO UPDATE SET scans = scans + excluded.scans'''
+
+UPSERT_RESCANS_SQL = '''INSERT INTO analytics_summary (qr_code_id, date, rescans) VALUES (?, ?, ?)
+                        ON CONFLICT(qr_code_id, date) DO UPDATE SET
+                            rescans = rescans + excluded.rescans'''
+
+DEVICE_COLUMNS = ('mobile', 'desktop', 'tablet')
+
+
+def record_scans(conn, scans):
+    """Insert a batch of scans and fold them into the daily rollups, in the caller's transaction.
+
+    Scans for archived months are left out entirely and returned.
+    """
+    late = insert_scans(conn, scans)
+    if late:
+        archived = {month_of(scan.scanned_at) for scan in late}
+        logger.warning('Dropped %d late scans for archived months %s', len(late), ', '.join(sorted(archived)))
+        scans = [scan for scan in scans if month_of(scan.scanned_at) not in archived]
+
+    # Aggregate the batch in memory so each rollup row is touched once
+    daily = {}
+    breakdown = Counter()
+    visitors = defaultdict(set)
+    for scan in scans:
+        key = (scan.qr_code_id, scan.scanned_at.date())
+        counts = daily.get(key)
+        if counts is None:
+            counts = daily[key] = Counter()
+        counts['total'] += 1
+        counts[scan.device_type] += 1
+        breakdown[key + ('device', scan.device_type or 'Unknown', '')] += 1
+        breakdown[key + ('browser', scan.browser or 'Unknown', '')] += 1
+        if scan.city is not None:
+            breakdown[key + ('city', scan.city, scan.country or '')] += 1
+        visitors[(scan.qr_code_id, key[1].isoformat())].add(scan.ip_address or '')
+        visitors[(scan.qr_code_id, 'all')].add(scan.ip_address or '')
+
+    # unique_ips is the HyperLogLog estimate of the day's sketch; each
+    # (qr, period) sketch is read and written once per batch
+    sketches = load_sketches(conn, visitors)
+    changed_sketches = []
+    for (qr_id, period), ips in visitors.items():
+        sketch = sketches[(qr_id, period)]
+        changed = False
+        for ip in ips:
+            changed = sketch.add(ip) or changed
+        if changed:
+            changed_sketches.append((qr_id, period, sketch.to_bytes()))
+        if period != 'all':
+            key = (qr_id, date.fromisoformat(period))
+            daily[key]['unique_ips'] = round(sketch.count())
+    conn.executemany(UPSERT_SKETCH_SQL, changed_sketches)
+
+    conn.executemany(UPSERT_SUMMARY_SQL, [
+        key + (counts['total'], counts['unique_ips']) + tuple(counts[d] for d in DEVICE_COLUMNS)
+        for key, counts in daily.items()])
+    conn.executemany(UPSERT_BREAKDOWN_SQL,
+                     [key + (count,) for key, count in breakdown.items()])
+
+    city_days = {key[:2] for key in breakdown if key[2] == 'city'}
+    conn.executemany(UPDATE_TOP_CITY_SQL, [day + day for day in city_days])
+
+    # Global day/month counters behind the dashboard
+    periods = Counter()
+    for (_, day), counts in daily.items():
+        periods[day.isoformat()] += counts['total']
+        periods[day.isoformat()[:7]] += counts['total']
+    conn.executemany(UPSERT_COUNTER_SQL, periods.items())
+
+    # Hourly timeline buckets; coarser ones come from compaction (qr_timeline)
+    record_timeline(conn, scans)
+    return late
+
+
+def record_rescans(conn, rescans):
+    """Fold {(qr_id, day): count} of deduplicated repeat scans into the daily summary"""
+    conn.executemany(UPSERT_RESCANS_SQL, [key + (count,) for key, count in rescans.items()])
+
+
+def load_sketches(conn, keys):
+    """{(qr_id, period): HyperLogLog} for keys, one SELECT per QR code; missing ones start empty"""
+    periods = defaultdict(list)
+    for qr_id, period in keys:
+        periods[qr_id].append(period)
+    sketches = {}
+    for qr_id, wanted in periods.items():
+        rows = conn.execute(f'''SELECT period, registers FROM analytics_visitor_sketches
+                                WHERE qr_code_id = ? AND period IN ({', '.join('?' * len(wanted))})''',
+                            [qr_id] + wanted)
+        for period, registers in rows:
+            sketches[(qr_id, period)] = HyperLogLog(registers=registers)
+        for period in wanted:
+            sketches.setdefault((qr_id, period), HyperLogLog())
+    return sketches
+
+
+def unique_visitors(conn, qr_ids, date_from=None, date_to=None):
+    """Estimate distinct visitors across QR codes and an optional day range.
+
+    Without a range the lifetime sketches are merged; with one, every daily
+    sketch in [date_from, date_to] is. Returns (estimate, standard_error).
+    """
+    merged = HyperLogLog()
+    for qr_id in qr_ids:
+        if date_from is None and date_to is None:
+            rows = conn.execute(SELECT_SKETCH_SQL, (qr_id, 'all'))
+        else:
+            rows = conn.execute('''SELECT registers FROM analytics_visitor_sketches
+                                   WHERE qr_code_id = ? AND period >= ? AND period <= ?
+                                   AND period != 'all' ''',
+                                (qr_id, date_from or '0000-00-00', date_to or '9999-12-31'))
+        for (registers,) in rows:
+            merged.merge(HyperLogLog(registers=registers))
+    return round(merged.count()), merged.standard_error
+
+
+_STOP = object()
+
+
+class ScanWriter:
+    """Write-behind queue: scans are committed in batches by one background thread.
+
+    A batch is flushed when it reaches batch_size or when flush_interval
+    seconds have passed since its first scan, whichever comes first. The
+    queue is bounded; submit() blocks for up to enqueue_timeout and then
+    raises queue.Full so the caller can shed load. on_commit is called with
+    the scans of every committed batch, on_drop with scans given up on:
+    batches still failing after max_retries, and late scans for archived
+    months.
+    """
+
+    def __init__(self, pool, batch_size=500, flush_interval=0.2, max_pending=50000,
+                 enqueue_timeout=1.0, max_retries=3, on_commit=None, on_drop=None):
+        self.pool = pool
+        self.on_commit = on_commit
+        self.on_drop = on_drop
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.flushed = 0
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name='scan-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, scan):
+        self.queue.put(scan, timeout=self.enqueue_timeout)
+
+    @property
+    def pending(self):
+        return self.queue.qsize()
+
+    def close(self, timeout=30.0):
+        """Stop accepting work and wait for everything queued to be committed"""
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                with self.pool.transaction(write=True) as conn:
+                    late = record_scans(conn, batch)
+                if late:
+                    self._drop(late)
+                    archived = {month_of(scan.scanned_at) for scan in late}
+                    batch = [scan for scan in batch if month_of(scan.scanned_at) not in archived]
+                self.flushed += len(batch)
+                if self.on_commit is not None:
+                    self.on_commit(batch)
+                return
+            except sqlite3.Error:
+                logger.exception('Scan batch of %d failed (attempt %d/%d)',
+                                 len(batch), attempt, self.max_retries)
+                time.sleep(0.1 * attempt)
+        self._drop(batch)
+
+    def _drop(self, scans):
+        self.dropped += len(scans)
+        if self.on_drop is not None:
+            self.on_drop(scans)
+
+
+class RescanFlusher:
+    """Background thread writing the rescans counted by a ScanDeduplicator every interval seconds"""
+
+    def __init__(self, pool, dedup, interval=5.0):
+        self.pool = pool
+        self.dedup = dedup
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='qr-rescan-flusher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=30.0):
+        """Stop the loop after writing whatever rescans are still pending"""
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+        else:
+            try:
+                self.run_once()
+            except sqlite3.Error:
+                logger.exception('Final rescan flush failed')
+
+    def run_once(self):
+        """Write pending rescans; returns how many (qr_id, day) counts were updated"""
+        rescans = self.dedup.take_rescans()
+        if not rescans:
+            return 0
+        try:
+            with self.pool.transaction(write=True) as conn:
+                record_rescans(conn, rescans)
+        except sqlite3.Error:
+            self.dedup.restore_rescans(rescans)
+            raise
+        return len(rescans)
+
+    def _run(self):
+        while True:
+            stopping = self._stop.wait(self.interval)
+            try:
+                self.run_once()
+            except sqlite3.Error:
+                logger.exception('Rescan flush failed; retried next interval')
+            if stopping:
+                return
@@ -0,0 +1,179 @@
+"""
+TRUST Label - Load generator for the QR tracking API
+Drives scan, verify and analytics traffic over keep-alive HTTP/1.1
+connections from one asyncio process and reports throughput and latency
+percentiles. qr_benchmark builds seeded, comparable runs on top of it.
+
+Usage: python qr_loadtest.py [--url http://localhost:5001] [--scenario scan|verify|unknown|analytics|dashboard]
+                             [--concurrency 64] [--duration 10] [--codes 100]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from urllib.parse import urlsplit
+
+USER_AGENTS = (
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 '
+    '(KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+)
+
+SCENARIOS = ('scan', 'verify', 'unknown', 'analytics', 'dashboard')
+
+
+class Connection:
+    """Minimal keep-alive HTTP/1.1 client connection"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}']
+        for name, value in (headers or {}).items():
+            lines.append(f'{name}: {value}')
+        if body is not None:
+            lines += ['Content-Type: application/json', f'Content-Length: {len(body)}']
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await self.writer.drain()
+
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        response_headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(':')
+                response_headers[name.strip().lower()] = value.strip()
+        version, status = status_line.split(' ', 2)[:2]
+        if 'content-length' in response_headers:
+            payload = await self.reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                chunks.append(await self.reader.readexactly(size + 2))
+                if size == 0:
+                    break
+            payload = b''.join(chunk[:-2] for chunk in chunks)
+        else:
+            # Streamed response without a length: delimited by connection close
+            payload = await self.reader.read()
+            response_headers['connection'] = 'close'
+        if version == 'HTTP/1.0' or response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return int(status), payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def create_codes(host, port, count):
+    conn = Connection(host, port)
+    body = json.dumps({'count': count, 'product': {'product_name': 'Load test', 'brand': 'LoadTest'}})
+    status, payload = await conn.request('POST', '/api/v1/qr/generate/bulk', body.encode())
+    conn.close()
+    if status != 200:
+        raise RuntimeError(f'bulk generate failed with HTTP {status}')
+    return [json.loads(line)['qr_id'] for line in payload.splitlines()]
+
+
+def scenario_request(scenario, codes):
+    """(method, path, headers) of the next request for a scenario"""
+    headers = {'User-Agent': random.choice(USER_AGENTS),
+               'X-Forwarded-For': f'10.{random.randrange(256)}.{random.randrange(256)}.1'}
+    if scenario == 'scan':
+        return 'GET', f'/api/v1/qr/track/{random.choice(codes)}', headers
+    if scenario == 'verify':
+        return 'GET', f'/api/v1/qr/verify/{random.choice(codes)}', headers
+    if scenario == 'unknown':
+        return 'GET', f'/api/v1/qr/verify/{uuid.uuid4()}', headers
+    if scenario == 'analytics':
+        return 'GET', f'/api/v1/qr/{random.choice(codes)}/analytics', headers
+    if scenario == 'dashboard':
+        return 'GET', '/api/v1/analytics/dashboard', headers
+    raise ValueError(f'unknown scenario {scenario}')
+
+
+async def run_scenario(url, scenario, concurrency=64, duration=10.0, codes=None):
+    """Run one scenario for duration seconds; returns a summary dict"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies = []
+    statuses = {}
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        nonlocal errors
+        conn = Connection(host, port)
+        while time.monotonic() < deadline:
+            method, path, headers = scenario_request(scenario, codes)
+            started = time.perf_counter()
+            try:
+                status, _ = await conn.request(method, path, headers=headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                conn.close()
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+        conn.close()
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    cores = os.cpu_count() or 1
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 2),
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'rps': round(len(latencies) / elapsed, 1),
+        'rps_per_core': round(len(latencies) / elapsed / cores, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def main(args):
+    parts = urlsplit(args.url)
+    codes = await create_codes(parts.hostname, parts.port or 80, args.codes)
+    for scenario in args.scenario:
+        summary = await run_scenario(args.url, scenario, args.concurrency, args.duration, codes)
+        print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the QR tracking API')
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--codes', type=int, default=100, help='QR codes created for the run')
+    args = parser.parse_args()
+    args.scenario = args.scenario or ['scan', 'verify']
+    asyncio.run(main(args))
@@ -0,0 +1,456 @@
+"""
+TRUST Label - Schema migrations
+Versioned schema changes for qr_tracking.db, tracked in PRAGMA user_version
+
+Usage: python qr_migrations.py [db_path]
+Migrates the database and checks that no hot query plans a table scan.
+"""
+
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+from qr_partitions import create_partition, hot_partitions, month_bounds, refresh_scan_view
+from qr_sketches import HyperLogLog
+from qr_timeline import HOURLY_RETENTION_DAYS, week_bucket
+from qr_topk import backfill_topk
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    """Apply every pending migration inside the caller's transaction"""
+    current = schema_version(conn)
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        func(conn)
+        conn.execute(f'PRAGMA user_version = {version}')
+        applied.append((version, description))
+    return applied
+
+
+@migration(1, 'base tracking schema')
+def create_base_schema(conn):
+    c = conn.cursor()
+    
+    # QR Codes table
+    c.execute('''CREATE TABLE IF NOT EXISTS qr_codes
+                 (id TEXT PRIMARY KEY,
+                  product_id TEXT,
+                  product_name TEXT,
+                  brand TEXT,
+                  created_at TIMESTAMP,
+                  validation_data TEXT,
+                  blockchain_ref TEXT,
+                  is_active INTEGER DEFAULT 1)''')
+    
+    # Scan tracking table
+    c.execute('''CREATE TABLE IF NOT EXISTS scan_tracking
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  qr_code_id TEXT,
+                  scanned_at TIMESTAMP,
+                  ip_address TEXT,
+                  user_agent TEXT,
+                  location_lat REAL,
+                  location_lng REAL,
+                  city TEXT,
+                  country TEXT,
+                  device_type TEXT,
+                  browser TEXT,
+                  referrer TEXT,
+                  FOREIGN KEY(qr_code_id) REFERENCES qr_codes(id))''')
+    
+    # Analytics summary table
+    c.execute('''CREATE TABLE IF NOT EXISTS analytics_summary
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  qr_code_id TEXT,
+                  date DATE,
+                  total_scans INTEGER DEFAULT 0,
+                  unique_ips INTEGER DEFAULT 0,
+                  mobile_scans INTEGER DEFAULT 0,
+                  desktop_scans INTEGER DEFAULT 0,
+                  top_city TEXT,
+                  FOREIGN KEY(qr_code_id) REFERENCES qr_codes(id))''')
+
+
+@migration(2, 'scan and summary indexes')
+def add_scan_indexes(conn):
+    # Per-QR lookups, timelines and "recent scans" walk this index in order
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_scan_tracking_qr_scanned
+                    ON scan_tracking (qr_code_id, scanned_at)''')
+
+    # Older databases may hold duplicate daily rows from the old
+    # select-then-insert summary update; fold them before going unique
+    conn.execute('''UPDATE analytics_summary
+                    SET total_scans = (SELECT SUM(s.total_scans) FROM analytics_summary s
+                                       WHERE s.qr_code_id = analytics_summary.qr_code_id
+                                       AND s.date = analytics_summary.date)
+                    WHERE id IN (SELECT MIN(id) FROM analytics_summary
+                                 GROUP BY qr_code_id, date HAVING COUNT(*) > 1)''')
+    conn.execute('''DELETE FROM analytics_summary
+                    WHERE id NOT IN (SELECT MIN(id) FROM analytics_summary
+                                     GROUP BY qr_code_id, date)''')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_analytics_summary_qr_date
+                    ON analytics_summary (qr_code_id, date)''')
+
+
+@migration(3, 'daily device, browser, city and visitor rollups')
+def add_daily_rollups(conn):
+    conn.execute('ALTER TABLE analytics_summary ADD COLUMN tablet_scans INTEGER DEFAULT 0')
+
+    # One row per (QR, day, dimension, value); detail carries the country for cities
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_daily_breakdown
+                    (qr_code_id TEXT NOT NULL,
+                     date DATE NOT NULL,
+                     dimension TEXT NOT NULL,
+                     value TEXT NOT NULL,
+                     detail TEXT NOT NULL DEFAULT '',
+                     scans INTEGER NOT NULL DEFAULT 0,
+                     PRIMARY KEY (qr_code_id, date, dimension, value, detail))
+                    WITHOUT ROWID''')
+
+    # Distinct visitors per QR per day, for unique_ips
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_daily_visitors
+                    (qr_code_id TEXT NOT NULL,
+                     date DATE NOT NULL,
+                     ip_address TEXT NOT NULL,
+                     PRIMARY KEY (qr_code_id, date, ip_address))
+                    WITHOUT ROWID''')
+
+    # Backfill from the raw scans already recorded
+    for dimension, column in (('device', 'device_type'), ('browser', 'browser')):
+        conn.execute(f'''INSERT INTO analytics_daily_breakdown
+                         (qr_code_id, date, dimension, value, scans)
+                         SELECT qr_code_id, DATE(scanned_at), '{dimension}',
+                                COALESCE({column}, 'Unknown'), COUNT(*)
+                         FROM scan_tracking
+                         GROUP BY 1, 2, 4''')
+    conn.execute('''INSERT INTO analytics_daily_breakdown
+                    (qr_code_id, date, dimension, value, detail, scans)
+                    SELECT qr_code_id, DATE(scanned_at), 'city', city, COALESCE(country, ''), COUNT(*)
+                    FROM scan_tracking
+                    WHERE city IS NOT NULL
+                    GROUP BY 1, 2, 4, 5''')
+    conn.execute('''INSERT OR IGNORE INTO analytics_daily_visitors
+                    SELECT DISTINCT qr_code_id, DATE(scanned_at), COALESCE(ip_address, '')
+                    FROM scan_tracking''')
+    conn.execute(f'''UPDATE analytics_summary SET
+                         mobile_scans = {_device_scans_sql('mobile')},
+                         desktop_scans = {_device_scans_sql('desktop')},
+                         tablet_scans = {_device_scans_sql('tablet')},
+                         unique_ips = (SELECT COUNT(*) FROM analytics_daily_visitors v
+                                       WHERE v.qr_code_id = analytics_summary.qr_code_id
+                                       AND v.date = analytics_summary.date),
+                         top_city = (SELECT value FROM analytics_daily_breakdown b
+                                     WHERE b.qr_code_id = analytics_summary.qr_code_id
+                                     AND b.date = analytics_summary.date
+                                     AND b.dimension = 'city'
+                                     ORDER BY b.scans DESC LIMIT 1)''')
+
+
+def _device_scans_sql(device_type):
+    return f'''(SELECT COALESCE(SUM(scans), 0) FROM analytics_daily_breakdown b
+                  WHERE b.qr_code_id = analytics_summary.qr_code_id
+                  AND b.date = analytics_summary.date
+                  AND b.dimension = 'device' AND b.value = '{device_type}')'''
+
+
+@migration(4, 'HyperLogLog visitor sketches')
+def add_visitor_sketches(conn):
+    # period is a day (YYYY-MM-DD) or 'all' for the lifetime sketch of a QR code
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_visitor_sketches
+                    (qr_code_id TEXT NOT NULL,
+                     period TEXT NOT NULL,
+                     registers BLOB NOT NULL,
+                     PRIMARY KEY (qr_code_id, period))
+                    WITHOUT ROWID''')
+
+    # Replace the exact per-day visitor sets with sketches
+    sketches = {}
+    for qr_id, day, ip_address in conn.execute('''SELECT qr_code_id, date, ip_address
+                                                  FROM analytics_daily_visitors'''):
+        for period in (str(day), 'all'):
+            sketch = sketches.get((qr_id, period))
+            if sketch is None:
+                sketch = sketches[(qr_id, period)] = HyperLogLog()
+            sketch.add(ip_address)
+    conn.executemany('''INSERT OR REPLACE INTO analytics_visitor_sketches
+                        (qr_code_id, period, registers) VALUES (?, ?, ?)''',
+                     [(qr_id, period, sketch.to_bytes())
+                      for (qr_id, period), sketch in sketches.items()])
+    conn.execute('DROP TABLE analytics_daily_visitors')
+
+
+@migration(5, 'global scan counters and per-QR totals for the dashboard')
+def add_dashboard_counters(conn):
+    # period is a day (YYYY-MM-DD) or a month (YYYY-MM)
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_scan_counters
+                    (period TEXT PRIMARY KEY,
+                     scans INTEGER NOT NULL DEFAULT 0)
+                    WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_qr_totals
+                    (qr_code_id TEXT PRIMARY KEY,
+                     total_scans INTEGER NOT NULL DEFAULT 0)''')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_analytics_qr_totals_scans
+                    ON analytics_qr_totals (total_scans)''')
+    # Serves half-open [start, end) range counts on the raw table
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_scan_tracking_scanned_at
+                    ON scan_tracking (scanned_at)''')
+
+    conn.execute('''INSERT OR REPLACE INTO analytics_scan_counters (period, scans)
+                    SELECT date, SUM(total_scans) FROM analytics_summary GROUP BY date''')
+    conn.execute('''INSERT OR REPLACE INTO analytics_scan_counters (period, scans)
+                    SELECT substr(date, 1, 7), SUM(total_scans) FROM analytics_summary GROUP BY 1''')
+    conn.execute('''INSERT OR REPLACE INTO analytics_qr_totals (qr_code_id, total_scans)
+                    SELECT qr_code_id, SUM(total_scans) FROM analytics_summary GROUP BY qr_code_id''')
+
+
+@migration(6, 'Merkle anchoring batches, inclusion proofs and local chain')
+def add_anchoring(conn):
+    # Batches cover contiguous qr_codes rowid ranges; the next batch starts
+    # after MAX(last_rowid), so finding pending codes is a rowid range seek
+    conn.execute('''CREATE TABLE IF NOT EXISTS anchor_batches
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     merkle_root TEXT NOT NULL,
+                     leaf_count INTEGER NOT NULL,
+                     first_rowid INTEGER NOT NULL,
+                     last_rowid INTEGER NOT NULL,
+                     created_at TIMESTAMP,
+                     chain_tx TEXT)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS qr_anchor_proofs
+                    (qr_code_id TEXT PRIMARY KEY,
+                     batch_id INTEGER NOT NULL,
+                     leaf_index INTEGER NOT NULL,
+                     proof BLOB NOT NULL)
+                    WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS anchor_chain
+                    (height INTEGER PRIMARY KEY AUTOINCREMENT,
+                     tx_hash TEXT UNIQUE NOT NULL,
+                     merkle_root TEXT NOT NULL,
+                     prev_hash TEXT NOT NULL,
+                     anchored_at TIMESTAMP)''')
+
+
+@migration(7, 'change log of verify-visible QR code fields')
+def add_qr_code_changes(conn):
+    # Filled by triggers, so every writer (API, scripts, manual SQL) is seen
+    # by the processes that cache verify responses
+    conn.execute('''CREATE TABLE IF NOT EXISTS qr_code_changes
+                    (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                     qr_code_id TEXT NOT NULL,
+                     changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS qr_codes_verify_changed
+                    AFTER UPDATE OF is_active, validation_data, product_name, brand ON qr_codes
+                    BEGIN
+                        INSERT INTO qr_code_changes (qr_code_id) VALUES (NEW.id);
+                    END''')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS qr_codes_verify_deleted
+                    AFTER DELETE ON qr_codes
+                    BEGIN
+                        INSERT INTO qr_code_changes (qr_code_id) VALUES (OLD.id);
+                    END''')
+
+
+@migration(8, 'monthly scan partitions')
+def partition_scans(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_partitions
+                    (month TEXT PRIMARY KEY,
+                     table_name TEXT NOT NULL,
+                     status TEXT NOT NULL DEFAULT 'hot',
+                     row_count INTEGER,
+                     archive_path TEXT,
+                     created_at TIMESTAMP,
+                     archived_at TIMESTAMP)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_id_sequence
+                    (name TEXT PRIMARY KEY,
+                     next_id INTEGER NOT NULL)''')
+    conn.execute('''INSERT INTO scan_id_sequence (name, next_id)
+                    SELECT 'scan_tracking', COALESCE(MAX(id), 0) + 1 FROM scan_tracking''')
+
+    # Move the existing rows month by month, keeping their ids
+    months = [row[0] for row in conn.execute(
+        '''SELECT DISTINCT substr(COALESCE(scanned_at, '1970-01'), 1, 7) FROM scan_tracking''')]
+    conn.execute('ALTER TABLE scan_tracking RENAME TO scan_tracking_unpartitioned')
+    refresh_scan_view(conn)
+    for month in sorted(months):
+        table = create_partition(conn, month)
+        start, end = month_bounds(month)
+        conn.execute(f'''INSERT INTO {table}
+                         SELECT * FROM scan_tracking_unpartitioned
+                         WHERE COALESCE(scanned_at, '1970-01-01') >= ?
+                         AND COALESCE(scanned_at, '1970-01-01') < ?''', (start, end))
+    conn.execute('DROP TABLE scan_tracking_unpartitioned')
+
+
+@migration(9, 'repeat scan counter on the daily summary')
+def add_rescans(conn):
+    # Scans deduplicated within the repeat window (qr_dedup) only bump this
+    conn.execute('ALTER TABLE analytics_summary ADD COLUMN rescans INTEGER NOT NULL DEFAULT 0')
+
+
+@migration(10, 'hourly, daily and weekly scan timeline')
+def add_scan_timeline(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_timeline
+                    (qr_code_id TEXT NOT NULL,
+                     resolution TEXT NOT NULL,
+                     bucket TEXT NOT NULL,
+                     scans INTEGER NOT NULL,
+                     PRIMARY KEY (qr_code_id, resolution, bucket)) WITHOUT ROWID''')
+    # Compaction and hour expiry work across codes by bucket range
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_analytics_timeline_resolution_bucket
+                    ON analytics_timeline (resolution, bucket)''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS timeline_watermarks
+                    (resolution TEXT PRIMARY KEY,
+                     compacted_until TEXT NOT NULL)''')
+
+    # Past days come from the daily summary, past weeks from those days and
+    # the hours of the retention window from the raw scans
+    today = date.today()
+    day_mark, week_mark = today.isoformat(), week_bucket(today)
+    conn.execute('''INSERT INTO analytics_timeline (qr_code_id, resolution, bucket, scans)
+                    SELECT qr_code_id, 'day', date, SUM(total_scans) FROM analytics_summary
+                    WHERE date < ? AND total_scans > 0
+                    GROUP BY qr_code_id, date''', (day_mark,))
+    conn.execute('''INSERT INTO analytics_timeline (qr_code_id, resolution, bucket, scans)
+                    SELECT qr_code_id, 'week', date(bucket, 'weekday 0', '-6 days'), SUM(scans)
+                    FROM analytics_timeline
+                    WHERE resolution = 'day' AND bucket < ?
+                    GROUP BY qr_code_id, date(bucket, 'weekday 0', '-6 days')''', (week_mark,))
+    hours_from = (today - timedelta(days=HOURLY_RETENTION_DAYS)).isoformat()
+    for _, table in hot_partitions(conn, hours_from, None):
+        conn.execute(f'''INSERT INTO analytics_timeline (qr_code_id, resolution, bucket, scans)
+                         SELECT qr_code_id, 'hour', replace(substr(scanned_at, 1, 13), 'T', ' '), COUNT(*)
+                         FROM {table}
+                         WHERE scanned_at >= ?
+                         GROUP BY qr_code_id, replace(substr(scanned_at, 1, 13), 'T', ' ')''',
+                     (hours_from,))
+    conn.executemany('INSERT INTO timeline_watermarks (resolution, compacted_until) VALUES (?, ?)',
+                     [('day', day_mark), ('week', week_mark)])
+
+
+@migration(11, 'top products and cities summaries')
+def add_topk_summaries(conn):
+    # granularity is day, week, month or all; subject is '' for the global
+    # summaries and a QR id for the per-code top cities
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_topk
+                    (dimension TEXT NOT NULL,
+                     subject TEXT NOT NULL,
+                     granularity TEXT NOT NULL,
+                     period TEXT NOT NULL,
+                     total INTEGER NOT NULL,
+                     counters TEXT NOT NULL,
+                     PRIMARY KEY (dimension, subject, granularity, period)) WITHOUT ROWID''')
+    backfill_topk(conn)
+
+
+@migration(12, 'drop per-QR totals, superseded by the top products summaries')
+def drop_qr_totals(conn):
+    conn.execute('DROP INDEX IF EXISTS idx_analytics_qr_totals_scans')
+    conn.execute('DROP TABLE IF EXISTS analytics_qr_totals')
+
+
+# Queries on the scan/verify/analytics hot paths. {partition} stands for a
+# monthly scan_tracking_YYYYMM table. None of them may plan a
+# full table scan once the migrations above are applied.
+HOT_QUERIES = {
+    'qr_lookup': ('SELECT * FROM qr_codes WHERE id = ?', ('x',)),
+    'verify': ('SELECT * FROM qr_codes WHERE id = ? AND is_active = 1', ('x',)),
+    'anchor_proof': ('''SELECT p.batch_id, p.leaf_index, p.proof, b.merkle_root, b.chain_tx
+                        FROM qr_anchor_proofs p
+                        JOIN anchor_batches b ON b.id = p.batch_id
+                        WHERE p.qr_code_id = ?''', ('x',)),
+    'anchor_pending': ('''SELECT rowid, id FROM qr_codes
+                          WHERE rowid > ? ORDER BY rowid LIMIT ?''', (0, 10000)),
+    'chain_tx': ('SELECT merkle_root FROM anchor_chain WHERE tx_hash = ?', ('x',)),
+    'qr_code_changes': ('SELECT seq, qr_code_id FROM qr_code_changes WHERE seq > ? ORDER BY seq',
+                        (0,)),
+    'summary_upsert': ('''INSERT INTO analytics_summary (qr_code_id, date, total_scans)
+                          VALUES (?, ?, ?)
+                          ON CONFLICT(qr_code_id, date)
+                          DO UPDATE SET total_scans = total_scans + excluded.total_scans''',
+                       ('x', '2025-01-01', 1)),
+    'summary_by_day': ('''SELECT * FROM analytics_summary
+                          WHERE qr_code_id = ? AND date = ?''', ('x', '2025-01-01')),
+    'total_scans': ('SELECT SUM(total_scans) FROM analytics_summary WHERE qr_code_id = ?', ('x',)),
+    'breakdown': ('''SELECT value, SUM(scans) FROM analytics_daily_breakdown
+                     WHERE qr_code_id = ? AND dimension = ?
+                     GROUP BY value''', ('x', 'device')),
+    'visitor_sketch': ('''SELECT registers FROM analytics_visitor_sketches
+                          WHERE qr_code_id = ? AND period = ?''', ('x', 'all')),
+    'scan_timeline': ('''SELECT date, total_scans FROM analytics_summary
+                         WHERE qr_code_id = ? AND date >= date('now', '-30 days')
+                         ORDER BY date''', ('x',)),
+    'timeline_range': ('''SELECT bucket, scans FROM analytics_timeline
+                          WHERE qr_code_id = ? AND resolution = ? AND bucket >= ? AND bucket < ?''',
+                       ('x', 'week', '2025-01-01', '2026-01-01')),
+    'timeline_rollup': ('''SELECT qr_code_id, substr(bucket, 1, 10), SUM(scans) FROM analytics_timeline
+                           WHERE resolution = ? AND bucket >= ? AND bucket < ?
+                           GROUP BY qr_code_id, substr(bucket, 1, 10)''', ('hour', '', '2025-01-01')),
+    'topk_summary': ('''SELECT total, counters FROM analytics_topk
+                        WHERE dimension = ? AND subject = ? AND granularity = ? AND period = ?''',
+                     ('city', 'x', 'all', 'all')),
+    'period_counter': ('SELECT scans FROM analytics_scan_counters WHERE period = ?', ('2025-01',)),
+    'scans_between': ('''SELECT COUNT(*) FROM {partition}
+                         WHERE scanned_at >= ? AND scanned_at < ?''', ('2025-01-01', '2025-02-01')),
+    'recent_scans': ('''SELECT scanned_at, ip_address, city, device_type, browser
+                        FROM {partition}
+                        WHERE qr_code_id = ?
+                        ORDER BY scanned_at DESC
+                        LIMIT 10''', ('x',)),
+}
+
+
+def table_scans(conn, sql, params):
+    """Return the EXPLAIN QUERY PLAN steps that scan a whole table"""
+    plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    return [row[3] for row in plan
+            if row[3].startswith('SCAN ') and not row[3].startswith('SCAN CONSTANT ROW')]
+
+
+def check_query_plans(conn):
+    """Map each hot query that plans a table scan to its offending steps.
+
+    Queries on {partition} are checked against the newest hot partition.
+    """
+    partitions = hot_partitions(conn, newest_first=True)
+    offenders = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        if '{partition}' in sql:
+            if not partitions:
+                continue
+            sql = sql.format(partition=partitions[0][1])
+        scans = table_scans(conn, sql, params)
+        if scans:
+            offenders[name] = scans
+    return offenders
+
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'qr_tracking.db'
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    for version, description in migrate(conn):
+        print(f"✅ Migration {version}: {description}")
+    conn.execute('COMMIT')
+    print(f"Schema version: {schema_version(conn)}")
+
+    offenders = check_query_plans(conn)
+    for name, scans in offenders.items():
+        print(f"❌ {name}: {'; '.join(scans)}")
+    if offenders:
+        sys.exit(1)
+    print(f"All {len(HOT_QUERIES)} hot queries use an index")
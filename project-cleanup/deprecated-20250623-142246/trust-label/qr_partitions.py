@@ -0,0 +1,343 @@
+"""
+TRUST Label - Monthly scan partitions
+Scans live in one table per month (scan_tracking_YYYYMM) listed in the
+scan_partitions catalog; queries only touch the months they overlap.
+Cold months are archived to compressed columnar files and dropped.
+Scans that arrive late for an archived month are not stored: its rows
+and rollups are final.
+
+The QR API applies retention from a background thread (RetentionJob).
+Deployments that disable it (QR_SCAN_RETENTION_MONTHS=0) can run the
+CLI from cron instead, e.g. nightly:
+    15 3 * * * cd /srv/trust-label && python qr_partitions.py qr_tracking.db --retain-months 13
+
+Usage: python qr_partitions.py [db_path] [--retain-months N] [--archive-dir DIR] [--vacuum]
+Migrates the database, archives partitions older than the retention window
+and lists the catalog.
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date, datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+SCAN_COLUMNS = ('id', 'qr_code_id', 'scanned_at', 'ip_address', 'user_agent',
+                'location_lat', 'location_lng', 'city', 'country',
+                'device_type', 'browser', 'referrer')
+
+# Rows per Parquet row group / JSON column chunk when archiving
+ARCHIVE_CHUNK_ROWS = 50000
+
+DEFAULT_RETAIN_MONTHS = 13
+
+logger = logging.getLogger(__name__)
+
+
+class ArchivedPartitionError(ValueError):
+    """A scan's month was archived; it no longer accepts scans"""
+
+    def __init__(self, month, status):
+        super().__init__(f'scan partition {month} is {status}; it no longer accepts scans')
+        self.month = month
+
+
+def month_of(value):
+    """'YYYY-MM' of a datetime, date or stored timestamp string"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()[:7]
+    return str(value)[:7]
+
+
+def month_bounds(month):
+    """Half-open ['YYYY-MM-01', next month's '-01') bounds as timestamp strings"""
+    year, mon = int(month[:4]), int(month[5:7])
+    year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f'{month}-01', f'{year:04d}-{mon:02d}-01'
+
+
+def partition_table(month):
+    return 'scan_tracking_' + month.replace('-', '')
+
+
+def create_partition(conn, month):
+    """Create a month's table and indexes and register it in the catalog"""
+    table = partition_table(month)
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {table}
+                     (id INTEGER PRIMARY KEY,
+                      qr_code_id TEXT,
+                      scanned_at TIMESTAMP,
+                      ip_address TEXT,
+                      user_agent TEXT,
+                      location_lat REAL,
+                      location_lng REAL,
+                      city TEXT,
+                      country TEXT,
+                      device_type TEXT,
+                      browser TEXT,
+                      referrer TEXT)''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_qr_scanned ON {table} (qr_code_id, scanned_at)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_scanned ON {table} (scanned_at)')
+    conn.execute('''INSERT INTO scan_partitions (month, table_name, status, created_at)
+                    VALUES (?, ?, 'hot', ?)''', (month, table, datetime.now()))
+    refresh_scan_view(conn)
+    return table
+
+
+def ensure_partition(conn, month):
+    row = conn.execute('SELECT table_name, status FROM scan_partitions WHERE month = ?',
+                       (month,)).fetchone()
+    if row is None:
+        return create_partition(conn, month)
+    if row[1] != 'hot':
+        raise ArchivedPartitionError(month, row[1])
+    return row[0]
+
+
+def refresh_scan_view(conn):
+    """Point the scan_tracking view at the current hot partitions (for ad-hoc SQL)"""
+    tables = [row[0] for row in conn.execute(
+        "SELECT table_name FROM scan_partitions WHERE status = 'hot' ORDER BY month")]
+    columns = ', '.join(SCAN_COLUMNS)
+    if tables:
+        body = ' UNION ALL '.join(f'SELECT {columns} FROM {table}' for table in tables)
+    else:
+        body = 'SELECT ' + ', '.join(f'NULL AS {column}' for column in SCAN_COLUMNS) + ' WHERE 0'
+    conn.execute('DROP VIEW IF EXISTS scan_tracking')
+    conn.execute(f'CREATE VIEW scan_tracking AS {body}')
+
+
+def hot_partitions(conn, start=None, end=None, newest_first=False):
+    """Hot (month, table) pairs overlapping the half-open range [start, end)"""
+    start = str(start) if start is not None else None
+    end = str(end) if end is not None else None
+    order = 'DESC' if newest_first else 'ASC'
+    partitions = []
+    for month, table in conn.execute(f'''SELECT month, table_name FROM scan_partitions
+                                         WHERE status = 'hot' ORDER BY month {order}'''):
+        month_start, month_end = month_bounds(month)
+        if (start is None or month_end > start) and (end is None or month_start < end):
+            partitions.append((month, table))
+    return partitions
+
+
+def insert_scans(conn, scans):
+    """Route a batch of Scan tuples to their month partitions, in the caller's transaction.
+
+    Returns the scans of archived months, which are not inserted.
+    """
+    by_month = {}
+    for scan in scans:
+        by_month.setdefault(month_of(scan.scanned_at), []).append(scan)
+
+    # Ids come from one sequence so they stay unique across partitions
+    next_id = conn.execute("SELECT next_id FROM scan_id_sequence WHERE name = 'scan_tracking'").fetchone()[0]
+    conn.execute("UPDATE scan_id_sequence SET next_id = next_id + ? WHERE name = 'scan_tracking'",
+                 (len(scans),))
+    placeholders = ', '.join('?' * len(SCAN_COLUMNS))
+    late = []
+    for month, batch in by_month.items():
+        try:
+            table = ensure_partition(conn, month)
+        except ArchivedPartitionError:
+            late.extend(batch)
+            continue
+        conn.executemany(f'INSERT INTO {table} ({", ".join(SCAN_COLUMNS)}) VALUES ({placeholders})',
+                         [(next_id + i,) + tuple(scan) for i, scan in enumerate(batch)])
+        next_id += len(batch)
+    return late
+
+
+def count_scans(conn, start, end):
+    """Scans with start <= scanned_at < end across the overlapping partitions"""
+    total = 0
+    for _, table in hot_partitions(conn, start, end):
+        total += conn.execute(f'SELECT COUNT(*) FROM {table} WHERE scanned_at >= ? AND scanned_at < ?',
+                              (str(start), str(end))).fetchone()[0]
+    return total
+
+
+def recent_scans(conn, qr_code_id, limit=10,
+                 columns='scanned_at, ip_address, city, device_type, browser'):
+    """Newest scans of one QR code, walking partitions newest first until limit is reached"""
+    rows = []
+    for _, table in hot_partitions(conn, newest_first=True):
+        rows.extend(conn.execute(f'''SELECT {columns} FROM {table}
+                                     WHERE qr_code_id = ?
+                                     ORDER BY scanned_at DESC
+                                     LIMIT ?''', (qr_code_id, limit - len(rows))).fetchall())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def write_archive(path, chunks):
+    """Write row chunks to a columnar archive; returns the path written.
+
+    Parquet (zstd) when pyarrow is installed, otherwise gzip'd JSON lines
+    holding one column-oriented chunk each.
+    """
+    if pa is not None:
+        path += '.parquet'
+        writer = None
+        for rows in chunks:
+            table = pa.table({column: [row[i] for row in rows] for i, column in enumerate(SCAN_COLUMNS)})
+            if writer is None:
+                writer = pq.ParquetWriter(path + '.tmp', table.schema, compression='zstd')
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+    else:
+        path += '.columns.json.gz'
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            for rows in chunks:
+                chunk = {column: [row[i] for row in rows] for i, column in enumerate(SCAN_COLUMNS)}
+                f.write(json.dumps({'rows': len(rows), 'columns': chunk}) + '\n')
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_archive(path):
+    """Yield the scans in an archive as dicts"""
+    if path.endswith('.parquet'):
+        if pa is None:
+            raise RuntimeError('pyarrow is required to read Parquet archives')
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=ARCHIVE_CHUNK_ROWS):
+            yield from batch.to_pylist()
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            chunk = json.loads(line)
+            columns = chunk['columns']
+            for i in range(chunk['rows']):
+                yield {column: columns[column][i] for column in SCAN_COLUMNS}
+
+
+def archive_partition(conn, month, archive_dir):
+    """Archive one hot partition and drop it from the database.
+
+    conn must be in autocommit mode (isolation_level=None). The file is
+    written under a read transaction; the catalog update and DROP TABLE
+    happen in one short write transaction afterwards. Returns (path, rows).
+    """
+    table = partition_table(month)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    conn.execute('BEGIN')
+    try:
+        count = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        cursor = conn.execute(f'SELECT {", ".join(SCAN_COLUMNS)} FROM {table} ORDER BY id')
+        chunks = iter(lambda: [tuple(row) for row in cursor.fetchmany(ARCHIVE_CHUNK_ROWS)], [])
+        path = write_archive(os.path.join(archive_dir, table), chunks) if count else None
+    finally:
+        conn.execute('COMMIT')
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] != count:
+            raise RuntimeError(f'{table} changed while it was being archived')
+        conn.execute('''UPDATE scan_partitions
+                        SET status = 'archived', row_count = ?, archive_path = ?, archived_at = ?
+                        WHERE month = ?''', (count, path, datetime.now(), month))
+        conn.execute(f'DROP TABLE {table}')
+        refresh_scan_view(conn)
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return path, count
+
+
+def apply_retention(conn, retain_months=DEFAULT_RETAIN_MONTHS, archive_dir='scan_archive', today=None):
+    """Archive every hot partition older than the newest retain_months months.
+
+    Freed pages go to SQLite's freelist and are reused by new partitions,
+    so the file stays at roughly the size of the retention window.
+    """
+    if retain_months < 1:
+        raise ValueError('retain_months must be at least 1 (the current month)')
+    today = today or date.today()
+    month_index = today.year * 12 + today.month - 1 - (retain_months - 1)
+    cutoff = f'{month_index // 12:04d}-{month_index % 12 + 1:02d}'
+    archived = []
+    for month, _ in hot_partitions(conn):
+        if month < cutoff:
+            archived.append((month,) + archive_partition(conn, month, archive_dir))
+    return archived
+
+
+class RetentionJob:
+    """Background thread that archives partitions past the retention window every interval seconds"""
+
+    def __init__(self, pool, retain_months=DEFAULT_RETAIN_MONTHS, archive_dir='scan_archive', interval=3600.0):
+        self.pool = pool
+        self.retain_months = retain_months
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='qr-scan-retention', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=30.0):
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+
+    def run_once(self):
+        """Archive what is due; returns [(month, path, rows)]"""
+        # archive_partition runs its own transactions on a pooled (autocommit) connection
+        conn = self.pool.acquire()
+        try:
+            archived = apply_retention(conn, self.retain_months, self.archive_dir)
+        finally:
+            self.pool.release(conn)
+        for month, path, count in archived:
+            logger.info('Scan partition %s archived: %d scans in %s', month, count, path or '(empty)')
+        return archived
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except (sqlite3.Error, OSError, RuntimeError):
+                logger.exception('Scan retention failed; retried next interval')
+
+
+if __name__ == '__main__':
+    from qr_migrations import migrate
+
+    parser = argparse.ArgumentParser(description='Archive cold scan partitions')
+    parser.add_argument('db_path', nargs='?', default='qr_tracking.db')
+    parser.add_argument('--retain-months', type=int,
+                        default=int(os.environ.get('QR_SCAN_RETENTION_MONTHS', DEFAULT_RETAIN_MONTHS)))
+    parser.add_argument('--archive-dir', default=os.environ.get('QR_SCAN_ARCHIVE_DIR', 'scan_archive'))
+    parser.add_argument('--vacuum', action='store_true',
+                        help='VACUUM afterwards to return freed pages to the filesystem')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    migrate(conn)
+    conn.execute('COMMIT')
+
+    for month, path, count in apply_retention(conn, args.retain_months, args.archive_dir):
+        print(f"📦 {month}: {count} scans archived to {path or '(empty, dropped)'}")
+    if args.vacuum:
+        conn.execute('VACUUM')
+
+    for month, status, row_count, path in conn.execute(
+            'SELECT month, status, row_count, archive_path FROM scan_partitions ORDER BY month'):
+        detail = f'{row_count} scans in {path}' if status == 'archived' else ''
+        print(f"  {month}  {status:<8} {detail}")
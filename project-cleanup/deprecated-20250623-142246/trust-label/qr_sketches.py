@@ -0,0 +1,288 @@
+"""
+TRUST Label - Probabilistic sketches
+Compact summaries used by the QR tracking API
+"""
+
+import hashlib
+import heapq
+import json
+import math
+import threading
+
+
+def hash64(value):
+    """Stable 64-bit hash of a string (same across processes and restarts)"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**precision one-byte registers.
+
+    The relative standard error is 1.04 / sqrt(2**precision): at the
+    default precision of 12 (4 KB per sketch) that is about 1.6%, so
+    roughly 95% of estimates land within 3.3% of the true count. Sketches
+    with the same precision merge losslessly (register-wise max), so a
+    count over any set of days or QR codes costs one merge per sketch.
+
+    Most daily sketches see a handful of visitors, so a sketch starts
+    sparse: only its non-zero registers, stored as 3-byte (index, rank)
+    pairs. It turns dense once it has more than 2**precision / 8 of them,
+    where the pairs would take 3/8 of the dense size. The two serialized
+    forms are told apart by length, as 2**precision is never a multiple
+    of 3.
+    """
+
+    def __init__(self, precision=12, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision must be between 4 and 16')
+        self.precision = precision
+        self.size = 1 << precision
+        self.sparse_limit = self.size // 8
+        # Exactly one of sparse ({index: rank}) and registers is set
+        self.sparse = None
+        self.registers = None
+        if registers is None:
+            self.sparse = {}
+        elif len(registers) == self.size:
+            self.registers = bytearray(registers)
+            # Dense blobs written before sparse sketches existed shrink on their next write
+            if self.size - self.registers.count(0) <= self.sparse_limit:
+                self.sparse = {index: rank for index, rank in enumerate(self.registers) if rank}
+                self.registers = None
+        elif len(registers) % 3 == 0 and len(registers) // 3 <= self.sparse_limit:
+            self.sparse = {int.from_bytes(registers[i:i + 2], 'big'): registers[i + 2]
+                           for i in range(0, len(registers), 3)}
+        else:
+            raise ValueError(f'expected {self.size} registers or up to {self.sparse_limit} '
+                             f'sparse pairs, got {len(registers)} bytes')
+
+    @property
+    def standard_error(self):
+        return 1.04 / math.sqrt(self.size)
+
+    def add(self, value):
+        """Add a value; returns True if the sketch changed"""
+        x = hash64(value)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if self.sparse is not None:
+            if rank > self.sparse.get(index, 0):
+                self.sparse[index] = rank
+                if len(self.sparse) > self.sparse_limit:
+                    self._densify()
+                return True
+            return False
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('cannot merge sketches with different precision')
+        if other.sparse is not None:
+            if self.sparse is not None:
+                for index, rank in other.sparse.items():
+                    if rank > self.sparse.get(index, 0):
+                        self.sparse[index] = rank
+                if len(self.sparse) > self.sparse_limit:
+                    self._densify()
+            else:
+                registers = self.registers
+                for index, rank in other.sparse.items():
+                    if rank > registers[index]:
+                        registers[index] = rank
+            return self
+        if self.sparse is not None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def _densify(self):
+        self.registers = bytearray(self.size)
+        for index, rank in self.sparse.items():
+            self.registers[index] = rank
+        self.sparse = None
+
+    def count(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        if self.sparse is not None:
+            zeros = m - len(self.sparse)
+            harmonic = zeros + sum(2.0 ** -rank for rank in self.sparse.values())
+        else:
+            # Histogram of register values via bytearray.count (C speed) rather
+            # than a Python-level pass over every register
+            zeros = self.registers.count(0)
+            harmonic = float(zeros)
+            remaining = m - zeros
+            rank = 1
+            while remaining:
+                n = self.registers.count(rank)
+                harmonic += n * 2.0 ** -rank
+                remaining -= n
+                rank += 1
+        estimate = alpha * m * m / harmonic
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+    def to_bytes(self):
+        if self.sparse is not None:
+            return b''.join(index.to_bytes(2, 'big') + bytes((rank,))
+                            for index, rank in sorted(self.sparse.items()))
+        return bytes(self.registers)
+
+
+class BloomFilter:
+    """Bloom filter sized for capacity items at a target false-positive rate.
+
+    Membership answers are "definitely not present" or "probably present";
+    items cannot be removed, so a removed item simply stays a false positive
+    until the filter is rebuilt. Bits per item is -ln(fpr) / ln(2)**2:
+    about 9.6 bits (1.2 bytes) per item at 1%.
+    """
+
+    def __init__(self, capacity, fpr=0.01):
+        if capacity <= 0 or not 0 < fpr < 1:
+            raise ValueError('capacity must be positive and fpr in (0, 1)')
+        self.capacity = capacity
+        self.fpr = fpr
+        self.num_bits = max(8, math.ceil(-capacity * math.log(fpr) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        # bits[i] |= x is a read-modify-write; concurrent adds to the same
+        # byte could otherwise lose a bit and create a false negative
+        self._lock = threading.Lock()
+
+    def _positions(self, value):
+        # Kirsch-Mitzenmacher double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, value):
+        """Add a value; returns True if the filter changed (re-adds are not counted)"""
+        positions = self._positions(value)
+        bits = self.bits
+        changed = False
+        with self._lock:
+            for position in positions:
+                mask = 1 << (position & 7)
+                if not bits[position >> 3] & mask:
+                    bits[position >> 3] |= mask
+                    changed = True
+            if changed:
+                self.count += 1
+        return changed
+
+    def __contains__(self, value):
+        bits = self.bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def estimated_fpr(self):
+        """Expected false-positive rate at the current fill"""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def stats(self):
+        return {
+            'capacity': self.capacity,
+            'items': self.count,
+            'target_fpr': self.fpr,
+            'estimated_fpr': self.estimated_fpr(),
+            'bits': self.num_bits,
+            'hashes': self.num_hashes,
+            'memory_bytes': len(self.bits)
+        }
+
+
+class SpaceSaving:
+    """Space-Saving heavy hitters (Metwally et al.) in at most `capacity` counters.
+
+    An item that is not monitored takes over the smallest counter and
+    inherits its count as error, so a monitored count overestimates the
+    true one by at most its error, and the error never exceeds total /
+    capacity. Any item seen more than total / capacity times is monitored.
+    Summaries merge (counts and errors add, unmonitored items count as the
+    other summary's minimum) with the same guarantees, which is how stored
+    summaries absorb the counts of several processes. Items are strings or
+    tuples of strings.
+    """
+
+    def __init__(self, capacity=100, counters=(), total=0):
+        self.capacity = capacity
+        self.total = total
+        self.counts = {}
+        self.errors = {}
+        for item, count, error in counters:
+            self.counts[item] = count
+            self.errors[item] = error
+        # One (count, item) entry per monitored item; entries go stale as
+        # counts grow and are refreshed only when they reach the top
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, item, weight=1):
+        self.total += weight
+        counts = self.counts
+        if item in counts:
+            counts[item] += weight
+            return
+        if len(counts) < self.capacity:
+            counts[item] = weight
+            self.errors[item] = 0
+            heapq.heappush(self._heap, (weight, item))
+            return
+        heap = self._heap
+        while True:
+            count, victim = heap[0]
+            actual = counts[victim]
+            if actual == count:
+                break
+            heapq.heapreplace(heap, (actual, victim))
+        del counts[victim]
+        del self.errors[victim]
+        counts[item] = count + weight
+        self.errors[item] = count
+        heapq.heapreplace(heap, (count + weight, item))
+
+    def min_count(self):
+        """Upper bound on the count of any item that is not monitored"""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def merge(self, other):
+        floor, other_floor = self.min_count(), other.min_count()
+        merged = []
+        for item in self.counts.keys() | other.counts.keys():
+            count = self.counts.get(item, floor) + other.counts.get(item, other_floor)
+            error = self.errors.get(item, floor) + other.errors.get(item, other_floor)
+            merged.append((item, count, error))
+        if len(merged) > self.capacity:
+            merged = heapq.nlargest(self.capacity, merged, key=lambda c: c[1])
+        self.__init__(self.capacity, merged, self.total + other.total)
+        return self
+
+    def top(self, k):
+        """The k largest (item, count, error), count descending"""
+        return heapq.nlargest(k, ((item, count, self.errors[item]) for item, count in self.counts.items()),
+                              key=lambda c: c[1])
+
+    def __len__(self):
+        return len(self.counts)
+
+    def to_json(self):
+        return json.dumps([[item, count, self.errors[item]] for item, count in self.counts.items()])
+
+    @classmethod
+    def from_json(cls, text, capacity, total):
+        counters = [(tuple(item) if isinstance(item, list) else item, count, error)
+                    for item, count, error in json.loads(text)]
+        return cls(capacity, counters, total)
@@ -0,0 +1,263 @@
+"""
+TRUST Label - Multi-resolution scan timeline
+Per-QR scan counts in hourly, daily and weekly buckets. Ingest adds to the
+hourly buckets; a compaction job rolls finished days up from hours and
+finished weeks up from days, and drops hours past their retention. Range
+queries read the coarsest buckets that cover each part of the range.
+
+Buckets are strings: 'YYYY-MM-DD HH' (hour), 'YYYY-MM-DD' (day) and the
+Monday 'YYYY-MM-DD' of the week. Per resolution, a watermark in
+timeline_watermarks marks how far compaction has got: days before the
+'day' watermark exist as daily rows, weeks before the 'week' one as weekly
+rows.
+
+Usage: python qr_timeline.py [db_path] [--qr-id ID --from TS --to TS --granularity G]
+Compacts the timeline, then prints a timeline and how long it took to read.
+"""
+
+import argparse
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('hour', 'day', 'week')
+
+# Hourly buckets are kept this long; older ranges are answered by day or week
+HOURLY_RETENTION_DAYS = 35
+
+# 'auto' picks the finest granularity that keeps a timeline to a few hundred points
+AUTO_HOURLY_MAX = timedelta(days=3)
+AUTO_DAILY_MAX = timedelta(days=180)
+
+UPSERT_TIMELINE_SQL = '''INSERT INTO analytics_timeline (qr_code_id, resolution, bucket, scans)
+                         VALUES (?, ?, ?, ?)
+                         ON CONFLICT(qr_code_id, resolution, bucket) DO UPDATE SET
+                             scans = scans + excluded.scans'''
+
+ROLLUP_SQL = '''INSERT INTO analytics_timeline (qr_code_id, resolution, bucket, scans)
+                SELECT qr_code_id, ?, {bucket}, SUM(scans) FROM analytics_timeline
+                WHERE resolution = ? AND bucket >= ? AND bucket < ?
+                GROUP BY qr_code_id, {bucket}
+                ON CONFLICT(qr_code_id, resolution, bucket) DO UPDATE SET
+                    scans = scans + excluded.scans'''
+
+# SQLite expressions mapping a finer bucket to its day and week
+DAY_OF_BUCKET = 'substr(bucket, 1, 10)'
+WEEK_OF_BUCKET = "date(substr(bucket, 1, 10), 'weekday 0', '-6 days')"
+
+
+def hour_bucket(value):
+    return str(value)[:13].replace('T', ' ')
+
+
+def day_bucket(value):
+    return str(value)[:10]
+
+
+def week_bucket(value):
+    """Monday of the week of a date, datetime or bucket string"""
+    day = date.fromisoformat(str(value)[:10])
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def bucket_of(value, granularity):
+    return {'hour': hour_bucket, 'day': day_bucket, 'week': week_bucket}[granularity](value)
+
+
+def next_bucket(bucket, granularity):
+    step = {'hour': timedelta(hours=1), 'day': timedelta(days=1), 'week': timedelta(weeks=1)}[granularity]
+    return bucket_of(parse_time(bucket) + step, granularity)
+
+
+def watermarks(conn):
+    rows = conn.execute('SELECT resolution, compacted_until FROM timeline_watermarks').fetchall()
+    marks = {'day': '', 'week': ''}
+    marks.update((row[0], row[1]) for row in rows)
+    return marks
+
+
+def record_timeline(conn, scans):
+    """Add a batch of scans to the hourly buckets, in the caller's transaction.
+
+    Scans older than a watermark (backfills, a delayed write queue) go
+    straight into the already compacted day and week buckets too, so
+    compaction never has to look back.
+    """
+    hours = Counter((scan.qr_code_id, hour_bucket(scan.scanned_at)) for scan in scans)
+    marks = watermarks(conn)
+    rows = []
+    for (qr_id, hour), count in hours.items():
+        rows.append((qr_id, 'hour', hour, count))
+        if hour < marks['day']:
+            rows.append((qr_id, 'day', day_bucket(hour), count))
+            week = week_bucket(hour)
+            if week < marks['week']:
+                rows.append((qr_id, 'week', week, count))
+    conn.executemany(UPSERT_TIMELINE_SQL, rows)
+
+
+def compact_timeline(conn, now=None, hourly_retention_days=HOURLY_RETENTION_DAYS):
+    """Roll finished days and weeks up and expire old hours, in the caller's write transaction"""
+    today = (now or datetime.now()).date()
+    marks = watermarks(conn)
+    day_mark = today.isoformat()
+    week_mark = week_bucket(today)
+    rolled = {'days': 0, 'weeks': 0, 'hours_expired': 0}
+
+    if day_mark > marks['day']:
+        rolled['days'] = conn.execute(ROLLUP_SQL.format(bucket=DAY_OF_BUCKET),
+                                      ('day', 'hour', marks['day'], day_mark)).rowcount
+        set_watermark(conn, 'day', day_mark)
+    if week_mark > marks['week']:
+        rolled['weeks'] = conn.execute(ROLLUP_SQL.format(bucket=WEEK_OF_BUCKET),
+                                       ('week', 'day', marks['week'], week_mark)).rowcount
+        set_watermark(conn, 'week', week_mark)
+
+    expire_before = min(day_mark, (today - timedelta(days=hourly_retention_days)).isoformat())
+    rolled['hours_expired'] = conn.execute(
+        "DELETE FROM analytics_timeline WHERE resolution = 'hour' AND bucket < ?",
+        (expire_before,)).rowcount
+    return rolled
+
+
+def set_watermark(conn, resolution, value):
+    conn.execute('''INSERT INTO timeline_watermarks (resolution, compacted_until) VALUES (?, ?)
+                    ON CONFLICT(resolution) DO UPDATE SET compacted_until = excluded.compacted_until''',
+                 (resolution, value))
+
+
+def parse_time(value):
+    """datetime from a datetime, date or ISO string ('YYYY-MM-DD[ HH[:MM[:SS]]]')"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    text = str(value).replace('T', ' ')
+    if len(text) == 13:
+        text += ':00'
+    return datetime.fromisoformat(text)
+
+
+def choose_granularity(start, end):
+    span = end - start
+    if span <= AUTO_HOURLY_MAX:
+        return 'hour'
+    if span <= AUTO_DAILY_MAX:
+        return 'day'
+    return 'week'
+
+
+def scan_timeline(conn, qr_id, start, end, granularity='auto'):
+    """Scan counts of one QR code per granularity bucket, for buckets overlapping [start, end).
+
+    Returns (granularity, [(bucket, scans), ...]) with empty buckets left
+    out. Each part of the range is read at the coarsest stored resolution
+    that is still at least as fine as the granularity: weekly rows for
+    compacted weeks, daily rows for compacted days and hourly rows for the
+    rest. Hourly timelines only reach back HOURLY_RETENTION_DAYS.
+    """
+    start, end = parse_time(start), parse_time(end)
+    if granularity == 'auto':
+        granularity = choose_granularity(start, end)
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of auto, {', '.join(GRANULARITIES)}")
+
+    # Whole buckets, from the one containing start to the one containing
+    # the last instant before end; finer buckets compare correctly against
+    # these bounds as strings ('YYYY-MM-DD HH' >= 'YYYY-MM-DD')
+    low = bucket_of(start, granularity)
+    high = next_bucket(bucket_of(end - timedelta(microseconds=1), granularity), granularity)
+    marks = watermarks(conn)
+
+    # (resolution, lower, upper) ranges that tile [low, high) without overlap
+    if granularity == 'hour':
+        reads = [('hour', low, high)]
+    elif granularity == 'day':
+        split = max(low, min(high, marks['day']))
+        reads = [('day', low, split), ('hour', split, high)]
+    else:
+        week_split = max(low, min(high, marks['week']))
+        day_split = max(week_split, min(high, marks['day']))
+        reads = [('week', low, week_split), ('day', week_split, day_split), ('hour', day_split, high)]
+
+    counts = Counter()
+    for resolution, lower, upper in reads:
+        if lower >= upper:
+            continue
+        for bucket, scans in conn.execute('''SELECT bucket, scans FROM analytics_timeline
+                                             WHERE qr_code_id = ? AND resolution = ?
+                                             AND bucket >= ? AND bucket < ?''',
+                                          (qr_id, resolution, lower, upper)):
+            counts[bucket_of(bucket, granularity)] += scans
+    return granularity, sorted(counts.items())
+
+
+class TimelineCompactor:
+    """Background thread that compacts the timeline every interval seconds"""
+
+    def __init__(self, pool, interval=300.0, hourly_retention_days=HOURLY_RETENTION_DAYS):
+        self.pool = pool
+        self.interval = interval
+        self.hourly_retention_days = hourly_retention_days
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='qr-timeline-compactor', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=30.0):
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+
+    def run_once(self):
+        with self.pool.transaction(write=True) as conn:
+            return compact_timeline(conn, hourly_retention_days=self.hourly_retention_days)
+
+    def _run(self):
+        # Compact on startup too: the process may have been down over midnight
+        while True:
+            try:
+                self.run_once()
+            except sqlite3.Error:
+                logger.exception('Timeline compaction failed; retried next interval')
+            if self._stop.wait(self.interval):
+                return
+
+
+if __name__ == '__main__':
+    from qr_db import ConnectionPool
+    from qr_migrations import migrate
+
+    parser = argparse.ArgumentParser(description='Compact and query the scan timeline')
+    parser.add_argument('db_path', nargs='?', default='qr_tracking.db')
+    parser.add_argument('--qr-id')
+    parser.add_argument('--from', dest='start')
+    parser.add_argument('--to', dest='end')
+    parser.add_argument('--granularity', default='auto', choices=('auto',) + GRANULARITIES)
+    args = parser.parse_args()
+
+    pool = ConnectionPool(args.db_path, size=1)
+    with pool.transaction(write=True) as conn:
+        migrate(conn)
+        rolled = compact_timeline(conn)
+    print(f"✅ Compacted: {rolled['days']} daily and {rolled['weeks']} weekly rows rolled up, "
+          f"{rolled['hours_expired']} hourly rows expired")
+
+    if args.qr_id:
+        end = args.end or datetime.now()
+        start = args.start or parse_time(end) - timedelta(days=365)
+        started = time.perf_counter()
+        with pool.transaction() as conn:
+            granularity, timeline = scan_timeline(conn, args.qr_id, start, end, args.granularity)
+        elapsed = (time.perf_counter() - started) * 1000
+        for bucket, scans in timeline:
+            print(f"  {bucket}  {scans}")
+        print(f"{len(timeline)} {granularity} buckets, {sum(s for _, s in timeline)} scans "
+              f"in {elapsed:.2f} ms")
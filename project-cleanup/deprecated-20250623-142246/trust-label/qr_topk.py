@@ -0,0 +1,302 @@
+"""
+TRUST Label - Most-scanned products and cities
+Space-Saving summaries (qr_sketches) of the most scanned QR codes and
+cities per day, week and month and over all time, plus the top cities of
+each QR code over all time. A top-K read loads one bounded summary row
+instead of grouping and sorting scan counts.
+
+Each process counts its scans into in-memory deltas; a background job
+merges the deltas into the summaries stored in analytics_topk every
+interval, so several workers and restarts add up. Reads merge the
+stored summary with the deltas not yet flushed.
+
+Usage: python qr_topk.py [db_path] [--k 10]
+Checks stored summaries, and summaries rebuilt by streaming the raw scans,
+against exact GROUP BY counts over the hot scan partitions.
+"""
+
+import argparse
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from qr_sketches import SpaceSaving
+from qr_timeline import week_bucket
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('day', 'week', 'month', 'all')
+DIMENSIONS = ('product', 'city')
+
+# Counters per summary. Any item with more than total / capacity scans is
+# kept, and a kept count is off by at most total / capacity.
+PRODUCT_CAPACITY = 200
+CITY_CAPACITY = 100
+QR_CITY_CAPACITY = 32
+
+SELECT_SUMMARY_SQL = '''SELECT total, counters FROM analytics_topk
+                        WHERE dimension = ? AND subject = ? AND granularity = ? AND period = ?'''
+
+UPSERT_SUMMARY_SQL = '''INSERT INTO analytics_topk (dimension, subject, granularity, period, total, counters)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(dimension, subject, granularity, period) DO UPDATE SET
+                            total = excluded.total,
+                            counters = excluded.counters'''
+
+
+@lru_cache(maxsize=1024)
+def periods_of(day):
+    """(granularity, period) pairs a 'YYYY-MM-DD' day counts towards"""
+    return (('day', day), ('week', week_bucket(day)), ('month', day[:7]), ('all', 'all'))
+
+
+def period_of(granularity, day):
+    return dict(periods_of(day))[granularity]
+
+
+def capacity_of(key):
+    dimension, subject = key[0], key[1]
+    if subject:
+        return QR_CITY_CAPACITY
+    return PRODUCT_CAPACITY if dimension == 'product' else CITY_CAPACITY
+
+
+def summary_counts(scans):
+    """Counter of (dimension, subject, granularity, period, item) for
+    (qr_id, day, city, country) tuples.
+
+    Products and cities are counted per day, week, month and overall;
+    cities per QR code (subject) overall only, which keeps the number of
+    summaries proportional to the number of codes.
+    """
+    counts = Counter()
+    for qr_id, day, city, country in scans:
+        for granularity, period in periods_of(day):
+            counts[('product', '', granularity, period, qr_id)] += 1
+            if city is not None:
+                counts[('city', '', granularity, period, (city, country or ''))] += 1
+        if city is not None:
+            counts[('city', qr_id, 'all', 'all', (city, country or ''))] += 1
+    return counts
+
+
+def load_summary(conn, key):
+    row = conn.execute(SELECT_SUMMARY_SQL, key).fetchone()
+    if row is None:
+        return SpaceSaving(capacity_of(key))
+    return SpaceSaving.from_json(row[1], capacity_of(key), row[0])
+
+
+def save_summary(conn, key, summary):
+    conn.execute(UPSERT_SUMMARY_SQL, key + (summary.total, summary.to_json()))
+
+
+def merge_summaries(conn, deltas):
+    """Fold {key: SpaceSaving} into the stored summaries, in the caller's write transaction"""
+    for key, delta in deltas.items():
+        save_summary(conn, key, load_summary(conn, key).merge(delta))
+
+
+def backfill_topk(conn):
+    """Exact summaries from the daily rollups (for databases that predate the table)"""
+    exact = defaultdict(Counter)
+    for qr_id, day, scans in conn.execute('''SELECT qr_code_id, date, total_scans FROM analytics_summary
+                                             WHERE total_scans > 0'''):
+        for granularity, period in periods_of(str(day)):
+            exact[('product', '', granularity, period)][qr_id] += scans
+    for qr_id, day, city, country, scans in conn.execute('''SELECT qr_code_id, date, value, detail, scans
+                                                            FROM analytics_daily_breakdown
+                                                            WHERE dimension = 'city' '''):
+        for granularity, period in periods_of(str(day)):
+            exact[('city', '', granularity, period)][(city, country)] += scans
+        exact[('city', qr_id, 'all', 'all')][(city, country)] += scans
+
+    for key, counts in exact.items():
+        # Dropped items count no more than the smallest kept one, as the
+        # summary invariant requires
+        top = counts.most_common(capacity_of(key))
+        save_summary(conn, key, SpaceSaving(capacity_of(key), [(item, count, 0) for item, count in top],
+                                            sum(counts.values())))
+    return len(exact)
+
+
+class TopKTracker:
+    """Per-process deltas over the stored summaries, flushed every interval seconds"""
+
+    def __init__(self, pool, interval=10.0):
+        self.pool = pool
+        self.interval = interval
+        self._deltas = {}
+        # Deltas being written: still counted by reads until committed
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='qr-topk-flusher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self, timeout=30.0):
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+        try:
+            self.run_once()
+        except sqlite3.Error:
+            logger.exception('Final top-K flush failed')
+
+    def record(self, scans):
+        """Count committed scans (Scan tuples)"""
+        counts = summary_counts((scan.qr_code_id, scan.scanned_at.date().isoformat(),
+                                 scan.city, scan.country) for scan in scans)
+        with self._lock:
+            deltas = self._deltas
+            for key_item, count in counts.items():
+                key = key_item[:4]
+                delta = deltas.get(key)
+                if delta is None:
+                    delta = deltas[key] = SpaceSaving(capacity_of(key))
+                delta.add(key_item[4], count)
+
+    def run_once(self):
+        """Write pending deltas; returns how many summaries were updated"""
+        with self._lock:
+            pending, self._deltas = self._deltas, {}
+            self._flushing = pending
+        if not pending:
+            return 0
+        try:
+            with self.pool.transaction(write=True) as conn:
+                merge_summaries(conn, pending)
+        except sqlite3.Error:
+            with self._lock:
+                for key, delta in self._deltas.items():
+                    pending[key] = pending[key].merge(delta) if key in pending else delta
+                self._deltas = pending
+                self._flushing = {}
+            raise
+        with self._lock:
+            self._flushing = {}
+        return len(pending)
+
+    def top(self, conn, dimension, granularity, period, k, subject=''):
+        """The k most scanned (item, count, error) of a summary, including unflushed scans"""
+        key = (dimension, subject, granularity, period)
+        summary = load_summary(conn, key)
+        with self._lock:
+            for deltas in (self._flushing, self._deltas):
+                delta = deltas.get(key)
+                if delta is not None:
+                    summary.merge(delta)
+        return summary.top(k)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except sqlite3.Error:
+                logger.exception('Top-K flush failed; retried next interval')
+
+
+def exact_top(conn, dimension, start, end, k, qr_id=None):
+    """Exact (item, count) top k from the scan partitions over [start, end)"""
+    column = 'qr_code_id' if dimension == 'product' else 'city, country'
+    sql = f'''SELECT {column}, COUNT(*) AS scans FROM scan_tracking
+              WHERE scanned_at >= ? AND scanned_at < ?
+              {"AND city IS NOT NULL" if dimension == 'city' else ""}
+              {"AND qr_code_id = ?" if qr_id else ""}
+              GROUP BY {column}'''
+    params = (start, end) + ((qr_id,) if qr_id else ())
+    rows = conn.execute(sql, params).fetchall()
+    if dimension == 'product':
+        counts = {row[0]: row[1] for row in rows}
+    else:
+        counts = {(row[0], row[1] or ''): row[2] for row in rows}
+    return counts, sorted(counts.items(), key=lambda c: -c[1])[:k]
+
+
+def accuracy(reported, counts, exact):
+    """(recall of the exact top k, largest count error relative to the exact count, bounds hold)"""
+    k = len(exact)
+    if not k:
+        return 1.0, 0.0, True
+    kth = exact[-1][1]
+    # Ties at the k-th count make several top-k sets equally correct
+    hits = sum(1 for item, _, _ in reported[:k] if counts.get(item, 0) >= kth)
+    worst = max((abs(count - counts.get(item, 0)) / max(1, counts.get(item, 0))
+                 for item, count, _ in reported[:k]), default=0.0)
+    bounded = all(count - error <= counts.get(item, 0) <= count for item, count, error in reported)
+    return hits / k, worst, bounded
+
+
+if __name__ == '__main__':
+    from datetime import date, timedelta
+
+    parser = argparse.ArgumentParser(description='Check top-K summaries against exact counts')
+    parser.add_argument('db_path', nargs='?', default='qr_tracking.db')
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db_path)
+    latest = conn.execute('SELECT MAX(scanned_at) FROM scan_tracking').fetchone()[0]
+    if latest is None:
+        raise SystemExit('No scans to check')
+    day = str(latest)[:10]
+    busiest = [row[0] for row in conn.execute('''SELECT qr_code_id FROM scan_tracking
+                                                 GROUP BY qr_code_id ORDER BY COUNT(*) DESC LIMIT 3''')]
+
+    # Replay every scan through fresh summaries, oldest first
+    started = time.perf_counter()
+    replayed = {}
+    scans = 0
+    rows = conn.execute('SELECT qr_code_id, scanned_at, city, country FROM scan_tracking ORDER BY scanned_at')
+    for qr_id, scanned_at, city, country in rows:
+        scans += 1
+        for key_item in summary_counts([(qr_id, str(scanned_at)[:10], city, country)]):
+            key = key_item[:4]
+            summary = replayed.get(key)
+            if summary is None:
+                summary = replayed[key] = SpaceSaving(capacity_of(key))
+            summary.add(key_item[4])
+    elapsed = time.perf_counter() - started
+    print(f"Replayed {scans} scans into {len(replayed)} summaries in {elapsed:.1f}s "
+          f"({elapsed / max(1, scans) * 1e6:.1f} us per scan)")
+
+    def bounds(granularity):
+        if granularity == 'all':
+            # Date-shaped, so they never compare as numbers against scanned_at
+            return '0001-01-01', '9999-12-31'
+        start = date.fromisoformat(period_of(granularity, day) + ('-01' if granularity == 'month' else ''))
+        if granularity == 'day':
+            end = start + timedelta(days=1)
+        elif granularity == 'week':
+            end = start + timedelta(weeks=1)
+        else:
+            end = (start + timedelta(days=32)).replace(day=1)
+        return start.isoformat(), end.isoformat()
+
+    checks = [(dimension, '', granularity) for dimension in DIMENSIONS for granularity in GRANULARITIES]
+    checks += [('city', qr_id, 'all') for qr_id in busiest]
+    failures = 0
+    read_time = 0.0
+    print(f"{'summary':<44} {'stored recall/error':>20} {'replayed recall/error':>22}")
+    for dimension, subject, granularity in checks:
+        key = (dimension, subject, granularity, period_of(granularity, day))
+        counts, exact = exact_top(conn, dimension, *bounds(granularity), args.k, subject or None)
+        started = time.perf_counter()
+        stored = load_summary(conn, key).top(args.k)
+        read_time += time.perf_counter() - started
+        replayed_top = replayed.get(key, SpaceSaving(capacity_of(key))).top(args.k)
+        results = [accuracy(stored, counts, exact), accuracy(replayed_top, counts, exact)]
+        ok = all(recall == 1.0 and bounded for recall, _, bounded in results)
+        failures += not ok
+        label = f"{dimension} {granularity} {key[3]}" + (f" qr={subject[:8]}" if subject else '')
+        print(f"{'✅' if ok else '⚠️ '} {label:<41} "
+              + ' '.join(f"{recall:>10.0%} / {error:>6.2%}{'' if bounded else ' ❌bounds'}"
+                         for recall, error, bounded in results))
+    print(f"{len(checks) - failures}/{len(checks)} summaries return the exact top {args.k}; "
+          f"stored top-{args.k} reads take {read_time / len(checks) * 1000:.2f} ms on average")
@@ -0,0 +1,306 @@
+"""
+TRUST Label - Service metrics
+Per-route request latency histograms, per-statement SQLite timings and
+row counts, and connection/lock-wait counters for the Flask services,
+exposed in the Prometheus text format on /metrics.
+
+Usage: python service_metrics.py
+Measures the per-request and per-statement overhead of the instrumentation.
+"""
+
+import bisect
+import random
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from flask import Response, g, request
+
+# Seconds; request latencies and SQLite statement times share the scale
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Statement labels are the SQL text, whitespace-collapsed and truncated
+STATEMENT_LABEL_LENGTH = 120
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class MetricsRegistry:
+    """Thread-safe counters and fixed-bucket histograms keyed by label values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def declare(self, name, kind, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self._metrics[name] = {'kind': kind, 'help': help_text, 'labelnames': labelnames,
+                               'buckets': buckets, 'series': {}}
+
+    def observe(self, name, labels, value, weight=1):
+        """Add value to a histogram; a sample standing for weight observations counts weight times"""
+        metric = self._metrics[name]
+        i = bisect.bisect_left(metric['buckets'], value)
+        with self._lock:
+            series = metric['series'].get(labels)
+            if series is None:
+                series = metric['series'][labels] = _Histogram(len(metric['buckets']) + 1)
+            series.counts[i] += weight
+            series.sum += value * weight
+
+    def inc(self, name, labels=(), amount=1):
+        metric = self._metrics[name]
+        with self._lock:
+            metric['series'][labels] = metric['series'].get(labels, 0) + amount
+
+    def value(self, name, labels=()):
+        series = self._metrics[name]['series'].get(labels)
+        return series.sum if isinstance(series, _Histogram) else series
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (0.0.4)"""
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} {metric['kind']}")
+                labelnames = metric['labelnames']
+                for labels, series in sorted(metric['series'].items()):
+                    pairs = [f'{k}="{escape_label(v)}"' for k, v in zip(labelnames, labels)]
+                    if metric['kind'] == 'counter':
+                        lines.append(f"{name}{format_labels(pairs)} {series}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(metric['buckets'] + ('+Inf',), series.counts):
+                        cumulative += count
+                        bucket_labels = format_labels(pairs + ['le="%s"' % bound])
+                        lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(pairs)} {series.sum}")
+                    lines.append(f"{name}_count{format_labels(pairs)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# One registry per process, shared by whichever service runs in it
+REGISTRY = MetricsRegistry()
+REGISTRY.declare('http_request_duration_seconds', 'histogram',
+                 'Time to produce a response (streamed bodies: until the first byte)',
+                 ('app', 'method', 'route', 'status'))
+REGISTRY.declare('sqlite_statement_duration_seconds', 'histogram',
+                 'Time spent in execute()/executemany() per SQL statement (sampled, scaled up)',
+                 ('statement',))
+REGISTRY.declare('sqlite_statement_rows_total', 'counter',
+                 'Rows fetched by, or changed by, each SQL statement (sampled, scaled up)',
+                 ('statement',))
+REGISTRY.declare('sqlite_busy_errors_total', 'counter',
+                 'Statements that failed with "database is locked"')
+REGISTRY.declare('sqlite_connections_opened_total', 'counter', 'SQLite connections opened')
+REGISTRY.declare('db_pool_acquire_wait_seconds', 'histogram',
+                 'Wait for a pooled connection when none was idle')
+REGISTRY.declare('sqlite_write_lock_wait_seconds', 'histogram',
+                 'Time BEGIN IMMEDIATE waited for the database write lock')
+
+
+@lru_cache(maxsize=4096)
+def statement_label(sql):
+    return _WHITESPACE_RE.sub(' ', sql).strip()[:STATEMENT_LABEL_LENGTH]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times statements and counts the rows they return or change"""
+
+    registry = REGISTRY
+    # Statements each observation stands for (see InstrumentedConnection)
+    weight = 1
+    _metrics_label = None
+
+    def execute(self, sql, parameters=()):
+        label = self._metrics_label = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            self._busy(e)
+            raise
+        finally:
+            self._observe(label, started)
+
+    def executemany(self, sql, seq_of_parameters):
+        label = self._metrics_label = statement_label(sql)
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            self._busy(e)
+            raise
+        finally:
+            self._observe(label, started)
+
+    def _observe(self, label, started):
+        self.registry.observe('sqlite_statement_duration_seconds', (label,), time.perf_counter() - started,
+                              self.weight)
+        if self.rowcount > 0:
+            # INSERT/UPDATE/DELETE; SELECT rows are counted as they are fetched
+            self.registry.inc('sqlite_statement_rows_total', (label,), self.rowcount * self.weight)
+
+    def _busy(self, error):
+        if 'locked' in str(error):
+            self.registry.inc('sqlite_busy_errors_total')
+
+    def _count(self, rows):
+        if rows and self._metrics_label is not None:
+            self.registry.inc('sqlite_statement_rows_total', (self._metrics_label,), rows * self.weight)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        self._count(1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection factory: sqlite3.connect(path, factory=InstrumentedConnection)
+
+    execute() and executemany() time a random one in sample_every
+    statements, on an InstrumentedCursor whose observations are weighted by
+    sample_every; the rest run on a plain cursor, and only lock errors are
+    counted for them. Cursors from cursor() time every statement.
+    """
+
+    registry = REGISTRY
+    sample_every = 1
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.registry.inc('sqlite_connections_opened_total')
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if random.random() * self.sample_every >= 1:
+            try:
+                return super().cursor(sqlite3.Cursor).execute(sql, parameters)
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+                raise
+        return self._sampled().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if random.random() * self.sample_every >= 1:
+            try:
+                return super().cursor(sqlite3.Cursor).executemany(sql, seq_of_parameters)
+            except sqlite3.OperationalError as e:
+                self._busy(e)
+                raise
+        return self._sampled().executemany(sql, seq_of_parameters)
+
+    def _sampled(self):
+        cursor = super().cursor(InstrumentedCursor)
+        cursor.weight = self.sample_every
+        return cursor
+
+    def _busy(self, error):
+        if 'locked' in str(error):
+            self.registry.inc('sqlite_busy_errors_total')
+
+
+def sampled_connection(sample_every):
+    """An InstrumentedConnection factory timing one statement in sample_every"""
+    return type('SampledConnection', (InstrumentedConnection,), {'sample_every': sample_every})
+
+
+def instrument_app(app, app_name, registry=REGISTRY):
+    """Record per-route latency for a Flask app and serve GET /metrics"""
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            # The URL rule, not the path, keeps label cardinality bounded
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            registry.observe('http_request_duration_seconds',
+                             (app_name, request.method, route, str(response.status_code)),
+                             time.perf_counter() - started)
+        return response
+
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
+    return app
+
+
+if __name__ == '__main__':
+    from flask import Flask
+
+    def per_call(func, number):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        return (time.perf_counter() - started) / number * 1e6
+
+    connections = {name: sqlite3.connect(':memory:', factory=factory)
+                   for name, factory in (('plain', sqlite3.Connection), ('every', InstrumentedConnection),
+                                         ('1-in-10', sampled_connection(10)))}
+    for conn in connections.values():
+        conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)')
+        conn.executemany('INSERT INTO t (v) VALUES (?)', [(str(i),) for i in range(1000)])
+    query = 'SELECT v FROM t WHERE id = ?'
+    timings = {name: min(per_call(lambda: conn.execute(query, (7,)).fetchone(), 50000) for _ in range(3))
+               for name, conn in connections.items()}
+    print(f"SQLite point query: {timings['plain']:.2f} us plain; "
+          f"+{timings['every'] - timings['plain']:.2f} us timing every statement, "
+          f"+{timings['1-in-10'] - timings['plain']:.2f} us timing 1 in 10")
+
+    def flask_app(instrument):
+        app = Flask(__name__)
+        app.add_url_rule('/item/<item_id>', 'item', lambda item_id: {'id': item_id})
+        if instrument:
+            instrument_app(app, 'bench')
+        return app.test_client()
+
+    # Interleaved rounds, best of each: the difference is close to the noise
+    bare, wrapped = flask_app(False), flask_app(True)
+    rounds = [(per_call(lambda: bare.get('/item/1'), 500), per_call(lambda: wrapped.get('/item/1'), 500))
+              for _ in range(15)]
+    base, timed = min(r[0] for r in rounds), min(r[1] for r in rounds)
+    print(f"Flask request: {base:.1f} us plain, {timed:.1f} us instrumented (+{timed - base:.1f} us)")
+
+    render = per_call(REGISTRY.render, 100)
+    print(f"/metrics render: {render:.0f} us for {len(REGISTRY.render().splitlines())} lines")
@@ -2,14 +2,84 @@
 import http.server
 import socketserver
 import os
+import sys
+import uuid
 
 PORT = 8001
 DIRECTORY = os.path.dirname(os.path.abspath(__file__))
 
+# http_ranges.py fica na raiz do repositório, ao lado de serve-app.py
+sys.path.insert(0, os.path.abspath(os.path.join(DIRECTORY, '..', '..', '..')))
+from http_ranges import parse_range, range_allowed
+
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=DIRECTORY, **kwargs)
 
+    def send_head(self):
+        self.segments = None
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if not range_header or os.path.isdir(path):
+            return super().send_head()
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        fs = os.fstat(f.fileno())
+        last_modified = self.date_time_string(fs.st_mtime)
+        ranges = None
+        # Sem ETag aqui: If-Range só casa com o Last-Modified atual
+        if range_allowed(self.headers.get('If-Range'), None, last_modified):
+            ranges = parse_range(range_header, fs.st_size)
+        if ranges is None:
+            f.close()
+            return super().send_head()
+        if not ranges:
+            f.close()
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{fs.st_size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        ctype = self.guess_type(path)
+        self.send_response(206)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", last_modified)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.segments = [(start, end - start + 1)]
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{fs.st_size}")
+            self.send_header("Content-Length", str(end - start + 1))
+        else:
+            boundary = uuid.uuid4().hex
+            self.segments = []
+            for start, end in ranges:
+                self.segments.append((f"\r\n--{boundary}\r\nContent-Type: {ctype}\r\n"
+                                      f"Content-Range: bytes {start}-{end}/{fs.st_size}\r\n\r\n").encode('latin-1'))
+                self.segments.append((start, end - start + 1))
+            self.segments.append(f"\r\n--{boundary}--\r\n".encode('latin-1'))
+            length = sum(s[1] if isinstance(s, tuple) else len(s) for s in self.segments)
+            self.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+            self.send_header("Content-Length", str(length))
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        # sendfile: os bytes vão do arquivo ao socket sem passar pelo Python
+        if not self.segments:
+            self.connection.sendfile(source)
+            return
+        for segment in self.segments:
+            if isinstance(segment, tuple):
+                self.connection.sendfile(source, *segment)
+            else:
+                outputfile.write(segment)
+
 print(f"Iniciando servidor na porta {PORT}...")
 print(f"Servindo arquivos de: {DIRECTORY}")
 print("\nAcesse o TRUST Label em:")
@@ -22,4 +92,4 @@ with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\nServidor parado.")
\ No newline at end of file
+        print("\nServidor parado.")
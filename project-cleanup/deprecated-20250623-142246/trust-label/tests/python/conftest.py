@@ -0,0 +1,10 @@
+# Python service tests: python -m pytest tests/python (from the project root)
+
+import os
+import sys
+
+# The service modules live at the project root, next to qr-tracking-api.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# http_ranges.py is shared with serve-app.py at the repository root
+sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', '..')))
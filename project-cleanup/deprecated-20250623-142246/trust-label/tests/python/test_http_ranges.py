@@ -0,0 +1,42 @@
+"""HTTP Range parsing and If-Range validation shared by the static file servers"""
+
+import pytest
+
+from http_ranges import MAX_RANGES, parse_range, range_allowed
+
+LAST_MODIFIED = 'Wed, 15 Oct 2025 10:00:00 GMT'
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=900-', [(900, 999)]),
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=990-2000', [(990, 999)]),
+    ('bytes=0-0, 10-19', [(0, 0), (10, 19)]),
+    ('bytes=1000-', []),
+    ('bytes=-0', []),
+    ('bytes=5-1', None),
+    ('bytes=a-b', None),
+    ('items=0-1', None),
+    ('bytes=' + ','.join(['0-0'] * (MAX_RANGES + 1)), None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('if_range, allowed', [
+    (None, True),
+    ('"abc"', True),
+    ('"old"', False),
+    ('W/"abc"', False),
+    (LAST_MODIFIED, True),
+    ('Tue, 14 Oct 2025 10:00:00 GMT', False),
+])
+def test_if_range_against_current_version(if_range, allowed):
+    assert range_allowed(if_range, '"abc"', LAST_MODIFIED) is allowed
+
+
+def test_if_range_etag_without_current_etag():
+    # start-web-server.py sends no ETag: only a Last-Modified If-Range can match
+    assert not range_allowed('"abc"', None, LAST_MODIFIED)
+    assert range_allowed(LAST_MODIFIED, None, LAST_MODIFIED)
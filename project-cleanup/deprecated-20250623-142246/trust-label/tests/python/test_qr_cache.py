@@ -0,0 +1,41 @@
+"""TTLCache: fills read outside the cache lock do not resurrect invalidated entries"""
+
+from qr_cache import TTLCache
+
+
+def test_fill_racing_an_invalidation_is_skipped():
+    cache = TTLCache(maxsize=4, ttl=60)
+    generation = cache.generation()
+    # ... the row is read here; a concurrent update commits and invalidates
+    cache.invalidate('qr-a')
+    assert not cache.set_if_unchanged('qr-a', 'stale', generation)
+    assert cache.get('qr-a') is None
+
+    generation = cache.generation()
+    assert cache.set_if_unchanged('qr-a', 'fresh', generation)
+    assert cache.get('qr-a') == 'fresh'
+
+
+def test_other_keys_still_fill():
+    cache = TTLCache(maxsize=4, ttl=60)
+    generation = cache.generation()
+    cache.invalidate('qr-b')
+    assert cache.set_if_unchanged('qr-a', 'value', generation)
+
+
+def test_forgotten_invalidations_stay_conservative():
+    cache = TTLCache(maxsize=2, ttl=60)
+    generation = cache.generation()
+    for key in ('qr-a', 'qr-b', 'qr-c'):
+        cache.invalidate(key)
+    # qr-a's record was dropped to bound memory; it may have been invalidated
+    assert not cache.set_if_unchanged('qr-a', 'stale', generation)
+    assert not cache.set_if_unchanged('qr-d', 'value', generation)
+    assert cache.set_if_unchanged('qr-d', 'value', cache.generation())
+
+
+def test_clear_invalidates_every_fill_in_progress():
+    cache = TTLCache(maxsize=4, ttl=60)
+    generation = cache.generation()
+    cache.clear()
+    assert not cache.set_if_unchanged('qr-a', 'stale', generation)
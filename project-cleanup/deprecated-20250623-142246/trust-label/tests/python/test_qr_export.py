@@ -0,0 +1,60 @@
+"""Scan export: time bounds compare like the stored scanned_at text"""
+
+from datetime import datetime
+
+import pytest
+
+from qr_db import ConnectionPool
+from qr_export import iter_scan_pages, scan_time
+from qr_ingest import Scan, record_scans
+from qr_migrations import migrate
+
+TIMES = [datetime(2025, 3, 1, 9, 30), datetime(2025, 3, 1, 10, 0), datetime(2025, 3, 1, 10, 0, 0, 250000),
+         datetime(2025, 3, 1, 11, 15), datetime(2025, 3, 2, 8, 0)]
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'export.db'), size=2)
+    with pool.transaction(write=True) as conn:
+        migrate(conn)
+        conn.execute("INSERT INTO qr_codes (id, product_id, product_name, brand) VALUES ('qr-a', 'p', 'P', 'B')")
+        record_scans(conn, [Scan('qr-a', at, '10.0.0.1', 'Mozilla/5.0', None, None, 'Recife', 'BR',
+                                 'mobile', 'Safari', '') for at in TIMES])
+    yield pool
+    pool.close_all()
+
+
+def exported(pool, **kwargs):
+    return [(row['scanned_at'], row['id']) for page in iter_scan_pages(pool, page_size=2, **kwargs)
+            for row in page]
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('2025-03-01', '2025-03-01 00:00:00'),
+    ('2025-03-01T10', '2025-03-01 10:00:00'),
+    ('2025-03-01T10:00', '2025-03-01 10:00:00'),
+    ('2025-03-01 10:00:00.250000', '2025-03-01 10:00:00.250000'),
+    (datetime(2025, 3, 1, 10), '2025-03-01 10:00:00'),
+])
+def test_scan_time(value, expected):
+    assert scan_time(value) == expected
+
+
+@pytest.mark.parametrize('value', ['yesterday', '2025-13-01', '01/03/2025'])
+def test_scan_time_rejects(value):
+    with pytest.raises(ValueError):
+        scan_time(value)
+
+
+def test_t_separated_bounds(pool):
+    rows = exported(pool, start='2025-03-01T10:00', end='2025-03-01T11:15:00')
+    assert [at for at, _ in rows] == [str(at) for at in TIMES[1:3]]
+
+
+def test_resume_after_a_t_separated_cursor(pool):
+    rows = exported(pool)
+    assert [at for at, _ in rows] == [str(at) for at in TIMES]
+    at, row_id = rows[1]
+    resumed = exported(pool, after=(at.replace(' ', 'T'), row_id))
+    assert resumed == rows[2:]
@@ -0,0 +1,65 @@
+"""Scan ingestion: dropped batches and background rescan flushes"""
+
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import qr_ingest
+from qr_db import ConnectionPool
+from qr_dedup import ScanDeduplicator
+from qr_ingest import RescanFlusher, Scan, ScanWriter
+from qr_migrations import migrate
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'ingest.db'), size=2)
+    with pool.transaction(write=True) as conn:
+        migrate(conn)
+        conn.execute("INSERT INTO qr_codes (id, product_id, product_name, brand) VALUES ('qr-a', 'p', 'P', 'B')")
+    yield pool
+    pool.close_all()
+
+
+def scan():
+    return Scan('qr-a', datetime(2025, 3, 3, 12), '10.0.0.1', 'Mozilla/5.0', None, None,
+                'Recife', 'BR', 'mobile', 'Safari', '')
+
+
+def rescans_of(pool):
+    with pool.transaction() as conn:
+        return conn.execute("SELECT COALESCE(SUM(rescans), 0) FROM analytics_summary").fetchone()[0]
+
+
+def test_dropped_batch_is_reported(pool, monkeypatch):
+    def failing(conn, scans):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(qr_ingest, 'record_scans', failing)
+    monkeypatch.setattr(qr_ingest.time, 'sleep', lambda seconds: None)
+    dropped = []
+    writer = ScanWriter(pool, flush_interval=0.01, on_drop=dropped.extend).start()
+    writer.submit(scan())
+    writer.close()
+    assert writer.dropped == 1 and dropped == [scan()]
+
+
+def test_rescans_flushed_on_close_and_restored_on_failure(pool, monkeypatch):
+    dedup = ScanDeduplicator(10)
+    flusher = RescanFlusher(pool, dedup, interval=3600).start()
+    for _ in range(3):
+        dedup.check('qr-a', '10.0.0.1', 'Mozilla/5.0', '2025-03-03')
+
+    def failing(conn, rescans):
+        raise sqlite3.OperationalError('database is locked')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(qr_ingest, 'record_rescans', failing)
+        with pytest.raises(sqlite3.OperationalError):
+            flusher.run_once()
+    assert rescans_of(pool) == 0
+
+    flusher.close()
+    assert rescans_of(pool) == 2
+    assert flusher.run_once() == 0
@@ -0,0 +1,123 @@
+"""Schema migrations: fresh and pre-migration databases end up on indexed query plans"""
+
+import sqlite3
+from datetime import date
+
+import pytest
+
+from qr_migrations import (HOT_QUERIES, MIGRATIONS, add_scan_indexes, check_query_plans,
+                           migrate, schema_version)
+from qr_partitions import create_partition, hot_partitions, month_of
+
+# Schema created by init_db() before versioned migrations existed
+BASELINE_SCHEMA = '''
+CREATE TABLE qr_codes
+    (id TEXT PRIMARY KEY, product_id TEXT, product_name TEXT, brand TEXT,
+     created_at TIMESTAMP, validation_data TEXT, blockchain_ref TEXT,
+     is_active INTEGER DEFAULT 1);
+CREATE TABLE scan_tracking
+    (id INTEGER PRIMARY KEY AUTOINCREMENT, qr_code_id TEXT, scanned_at TIMESTAMP,
+     ip_address TEXT, user_agent TEXT, location_lat REAL, location_lng REAL,
+     city TEXT, country TEXT, device_type TEXT, browser TEXT, referrer TEXT,
+     FOREIGN KEY(qr_code_id) REFERENCES qr_codes(id));
+CREATE TABLE analytics_summary
+    (id INTEGER PRIMARY KEY AUTOINCREMENT, qr_code_id TEXT, date DATE,
+     total_scans INTEGER DEFAULT 0, unique_ips INTEGER DEFAULT 0,
+     mobile_scans INTEGER DEFAULT 0, desktop_scans INTEGER DEFAULT 0, top_city TEXT,
+     FOREIGN KEY(qr_code_id) REFERENCES qr_codes(id));
+'''
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA foreign_keys = OFF')
+    return conn
+
+
+def run_migrations(conn):
+    conn.execute('BEGIN IMMEDIATE')
+    applied = migrate(conn)
+    conn.execute('COMMIT')
+    return applied
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A database as the pre-migration API left it, with duplicate daily summary rows"""
+    conn = connect(str(tmp_path / 'baseline.db'))
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany('INSERT INTO qr_codes (id, product_id, product_name, brand) VALUES (?, ?, ?, ?)',
+                     [('qr-a', 'p-a', 'Product A', 'Acme'), ('qr-b', 'p-b', 'Product B', 'Acme')])
+    conn.executemany('''INSERT INTO scan_tracking
+                        (qr_code_id, scanned_at, ip_address, city, country, device_type, browser)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     [('qr-a', '2025-01-05 10:00:00', '10.0.0.1', 'Recife', 'BR', 'mobile', 'Safari'),
+                      ('qr-a', '2025-01-05 11:00:00', '10.0.0.2', 'Recife', 'BR', 'desktop', 'Chrome'),
+                      ('qr-b', '2025-02-01 09:00:00', '10.0.0.3', 'Natal', 'BR', 'mobile', 'Chrome')])
+    # The old select-then-insert summary update could race into two rows per day
+    conn.executemany('INSERT INTO analytics_summary (qr_code_id, date, total_scans) VALUES (?, ?, ?)',
+                     [('qr-a', '2025-01-05', 2), ('qr-a', '2025-01-05', 3), ('qr-b', '2025-02-01', 1)])
+    yield conn
+    conn.close()
+
+
+def assert_hot_queries_indexed(conn):
+    # Queries on {partition} are only checked when a hot partition exists
+    assert hot_partitions(conn)
+    assert check_query_plans(conn) == {}
+
+
+def test_fresh_database_migrates_to_indexed_plans(tmp_path):
+    conn = connect(str(tmp_path / 'fresh.db'))
+    applied = run_migrations(conn)
+
+    assert [version for version, _ in applied] == [version for version, _, _ in MIGRATIONS]
+    assert schema_version(conn) == MIGRATIONS[-1][0]
+    conn.execute('BEGIN IMMEDIATE')
+    create_partition(conn, month_of(date.today()))
+    conn.execute('COMMIT')
+    assert_hot_queries_indexed(conn)
+    assert len(HOT_QUERIES) == 18
+
+
+def test_baseline_database_migrates_to_indexed_plans(baseline_db):
+    run_migrations(baseline_db)
+
+    assert schema_version(baseline_db) == MIGRATIONS[-1][0]
+    assert_hot_queries_indexed(baseline_db)
+    assert {month for month, _ in hot_partitions(baseline_db)} == {'2025-01', '2025-02'}
+    assert baseline_db.execute('SELECT COUNT(*) FROM scan_tracking').fetchone()[0] == 3
+
+
+def test_migrations_are_idempotent(baseline_db):
+    run_migrations(baseline_db)
+    assert run_migrations(baseline_db) == []
+
+
+def test_migration_2_folds_duplicate_summary_rows(baseline_db):
+    add_scan_indexes(baseline_db)
+
+    rows = baseline_db.execute('''SELECT qr_code_id, date, total_scans FROM analytics_summary
+                                  ORDER BY qr_code_id, date''').fetchall()
+    assert rows == [('qr-a', '2025-01-05', 5), ('qr-b', '2025-02-01', 1)]
+    # The unique index now rejects a second row for the same day
+    with pytest.raises(sqlite3.IntegrityError):
+        baseline_db.execute("INSERT INTO analytics_summary (qr_code_id, date) VALUES ('qr-a', '2025-01-05')")
+
+
+def test_duplicate_summary_rows_survive_full_migration(baseline_db):
+    run_migrations(baseline_db)
+
+    totals = dict(baseline_db.execute('''SELECT qr_code_id, SUM(total_scans) FROM analytics_summary
+                                         GROUP BY qr_code_id'''))
+    assert totals == {'qr-a': 5, 'qr-b': 1}
+    assert baseline_db.execute('''SELECT COUNT(*) FROM analytics_summary
+                                  WHERE qr_code_id = 'qr-a' ''').fetchone()[0] == 1
+
+
+def test_per_qr_totals_are_dropped(baseline_db):
+    run_migrations(baseline_db)
+
+    names = {name for (name,) in baseline_db.execute('SELECT name FROM sqlite_master')}
+    assert 'analytics_qr_totals' not in names
+    assert 'idx_analytics_qr_totals_scans' not in names
@@ -0,0 +1,65 @@
+"""Scan partitions: background retention and late scans for archived months"""
+
+from datetime import datetime
+
+import pytest
+
+from qr_db import ConnectionPool
+from qr_ingest import Scan, ScanWriter, record_scans
+from qr_migrations import migrate
+from qr_partitions import RetentionJob, read_archive
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'partitions.db'), size=2)
+    with pool.transaction(write=True) as conn:
+        migrate(conn)
+        conn.execute("INSERT INTO qr_codes (id, product_id, product_name, brand) VALUES ('qr-a', 'p', 'P', 'B')")
+    yield pool
+    pool.close_all()
+
+
+def scan(scanned_at):
+    return Scan('qr-a', scanned_at, '10.0.0.1', 'Mozilla/5.0', None, None,
+                'Recife', 'BR', 'mobile', 'Safari', '')
+
+
+def summary_scans(pool):
+    with pool.transaction() as conn:
+        return conn.execute('SELECT COALESCE(SUM(total_scans), 0) FROM analytics_summary').fetchone()[0]
+
+
+@pytest.fixture
+def archived(pool, tmp_path):
+    """2020-01 holds two scans and has been archived by the retention job"""
+    with pool.transaction(write=True) as conn:
+        record_scans(conn, [scan(datetime(2020, 1, 5, 10)), scan(datetime(2020, 1, 6, 10))])
+    job = RetentionJob(pool, retain_months=13, archive_dir=str(tmp_path / 'archive'))
+    [(month, path, count)] = job.run_once()
+    assert (month, count) == ('2020-01', 2)
+    assert len(list(read_archive(path))) == 2
+    assert job.run_once() == []
+    return month
+
+
+def test_late_scans_are_returned_not_stored(pool, archived):
+    now = datetime.now()
+    with pool.transaction(write=True) as conn:
+        late = record_scans(conn, [scan(datetime(2020, 1, 31, 23, 59)), scan(now)])
+        status = dict(conn.execute('SELECT month, status FROM scan_partitions'))
+    assert late == [scan(datetime(2020, 1, 31, 23, 59))]
+    assert status[archived] == 'archived' and status[now.isoformat()[:7]] == 'hot'
+    # Only the archived month's original two scans and today's are counted
+    assert summary_scans(pool) == 3
+
+
+def test_writer_drops_late_scans_and_keeps_running(pool, archived):
+    committed, dropped = [], []
+    writer = ScanWriter(pool, flush_interval=0.01, on_commit=committed.extend, on_drop=dropped.extend).start()
+    late, current = scan(datetime(2020, 1, 20, 8)), scan(datetime.now())
+    writer.submit(late)
+    writer.submit(current)
+    writer.close()
+    assert dropped == [late] and committed == [current]
+    assert writer.dropped == 1 and writer.flushed == 1
@@ -0,0 +1,60 @@
+"""HyperLogLog: sparse sketches for small counts, dense ones past the threshold"""
+
+import pytest
+
+from qr_sketches import HyperLogLog
+
+
+def sketch_of(values):
+    sketch = HyperLogLog()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def dense(sketch):
+    copy = HyperLogLog(registers=sketch.to_bytes())
+    if copy.sparse is not None:
+        copy._densify()
+    return copy
+
+
+def test_small_sketch_stays_sparse():
+    sketch = sketch_of(f'10.0.0.{i}' for i in range(3))
+    assert sketch.sparse is not None
+    assert len(sketch.to_bytes()) == 9
+    assert round(sketch.count()) == 3
+
+
+def test_sparse_and_dense_agree():
+    sketch = sketch_of(f'10.0.{i >> 8}.{i & 255}' for i in range(300))
+    assert sketch.sparse is not None
+    assert sketch.count() == dense(sketch).count()
+
+
+def test_sketch_turns_dense_past_the_threshold():
+    sketch = sketch_of(f'ip-{i}' for i in range(20000))
+    assert sketch.sparse is None
+    assert len(sketch.to_bytes()) == sketch.size
+    assert abs(sketch.count() / 20000 - 1) < 4 * sketch.standard_error
+
+
+@pytest.mark.parametrize('sizes', [(50, 60), (50, 5000), (5000, 50), (5000, 6000)])
+def test_merge_across_representations(sizes):
+    left = sketch_of(f'a-{i}' for i in range(sizes[0]))
+    right = sketch_of(f'b-{i}' for i in range(sizes[1]))
+    both = sketch_of([f'a-{i}' for i in range(sizes[0])] + [f'b-{i}' for i in range(sizes[1])])
+    assert left.merge(right).to_bytes() == both.to_bytes()
+
+
+def test_serialized_forms_round_trip():
+    for count in (0, 10, 20000):
+        sketch = sketch_of(f'ip-{i}' for i in range(count))
+        assert HyperLogLog(registers=sketch.to_bytes()).to_bytes() == sketch.to_bytes()
+
+
+def test_small_dense_blob_loads_sparse():
+    # Sketches stored before the sparse form are rewritten compactly
+    legacy = dense(sketch_of(['10.0.0.1', '10.0.0.2']))
+    sketch = HyperLogLog(registers=legacy.to_bytes())
+    assert sketch.sparse is not None and len(sketch.to_bytes()) == 6
@@ -0,0 +1,104 @@
+"""Top-K summaries: skewed scan traffic reports the true top k within the Space-Saving error bounds"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from qr_db import ConnectionPool
+from qr_ingest import Scan, record_scans
+from qr_migrations import migrate
+from qr_topk import QR_CITY_CAPACITY, TopKTracker, exact_top, period_of
+
+K = 10
+DAYS = [datetime(2025, 3, 3) + timedelta(days=d) for d in range(10)]
+
+
+@pytest.fixture(scope='module')
+def pool(tmp_path_factory):
+    pool = ConnectionPool(str(tmp_path_factory.mktemp('topk') / 'topk.db'), size=2)
+    with pool.transaction(write=True) as conn:
+        migrate(conn)
+    yield pool
+    pool.close_all()
+
+
+def skewed_scans(rng, count, products=1000, cities=400):
+    """Zipf-like popularity: far more products and cities than the summaries have counters"""
+    qr_ids = [f'qr-{i}' for i in range(products)]
+    places = [(f'City {i}', 'BR') for i in range(cities)]
+    qr_weights = [1 / (rank + 1) for rank in range(products)]
+    city_weights = [1 / (rank + 1) for rank in range(cities)]
+    scans = []
+    for qr_id, (city, country) in zip(rng.choices(qr_ids, qr_weights, k=count),
+                                      rng.choices(places, city_weights, k=count)):
+        scanned_at = rng.choice(DAYS) + timedelta(seconds=rng.randrange(86400))
+        scans.append(Scan(qr_id, scanned_at, '10.0.0.1', '', None, None, city, country,
+                          'mobile', 'Safari', ''))
+    return qr_ids, sorted(scans, key=lambda scan: scan.scanned_at)
+
+
+def bounds(granularity, day):
+    if granularity == 'all':
+        return '0001-01-01', '9999-12-31'
+    if granularity == 'day':
+        return day.date().isoformat(), (day + timedelta(days=1)).date().isoformat()
+    return '2025-03-01', '2025-04-01'
+
+
+def assert_top_k(reported, counts, exact, k=K):
+    kth = exact[-1][1]
+    # Ties at the k-th count make several top-k sets equally correct
+    assert all(counts.get(item, 0) >= kth for item, _, _ in reported[:k])
+    assert len(reported) == k
+    for item, count, error in reported:
+        assert count - error <= counts.get(item, 0) <= count, item
+
+
+@pytest.fixture(scope='module')
+def tracked(pool):
+    rng = random.Random(7)
+    qr_ids, scans = skewed_scans(rng, 20000)
+    with pool.transaction(write=True) as conn:
+        conn.executemany('INSERT INTO qr_codes (id, product_id, product_name, brand) VALUES (?, ?, ?, ?)',
+                         [(qr_id, qr_id, qr_id, 'Acme') for qr_id in qr_ids])
+    tracker = TopKTracker(pool)
+    # Several flushes, so stored summaries are merged with later deltas
+    for start in range(0, len(scans), 3000):
+        batch = scans[start:start + 3000]
+        with pool.transaction(write=True) as conn:
+            record_scans(conn, batch)
+        tracker.record(batch)
+        if start < 15000:
+            assert tracker.run_once() > 0
+    return tracker
+
+
+@pytest.mark.parametrize('dimension', ['product', 'city'])
+@pytest.mark.parametrize('granularity', ['day', 'month', 'all'])
+def test_top_k_recall_and_bounds(pool, tracked, dimension, granularity):
+    day = DAYS[4]
+    with pool.transaction() as conn:
+        counts, exact = exact_top(conn, dimension, *bounds(granularity, day), K)
+        reported = tracked.top(conn, dimension, granularity, period_of(granularity, day.date().isoformat()), K)
+    assert_top_k(reported, counts, exact)
+
+
+def test_top_cities_of_a_code(pool, tracked):
+    # 32 counters over ~400 cities: only cities above total / 32 scans are
+    # guaranteed a counter, which here is the top 3
+    k = 3
+    with pool.transaction() as conn:
+        counts, exact = exact_top(conn, 'city', *bounds('all', None), k, 'qr-0')
+        reported = tracked.top(conn, 'city', 'all', 'all', k, subject='qr-0')
+    assert exact[-1][1] > sum(counts.values()) / QR_CITY_CAPACITY
+    assert_top_k(reported, counts, exact, k)
+
+
+def test_flushed_summaries_match_unflushed_reads(pool, tracked):
+    with pool.transaction() as conn:
+        before = tracked.top(conn, 'product', 'all', 'all', K)
+    assert tracked.run_once() > 0
+    assert tracked.run_once() == 0
+    with pool.transaction() as conn:
+        assert tracked.top(conn, 'product', 'all', 'all', K) == before
@@ -0,0 +1,106 @@
+"""QR tracking API: caches follow other writers, jobs start when serving, verify reports anchoring"""
+
+import importlib.util
+import os
+
+import pytest
+
+API_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'qr-tracking-api.py')
+
+
+def load_api(patch, directory):
+    # qr_tracking.db is opened in the working directory
+    patch.chdir(directory)
+    patch.setenv('QR_CHANGES_POLL', '0')
+    spec = importlib.util.spec_from_file_location('qr_tracking_api', API_PATH)
+    api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(api)
+    return api
+
+
+@pytest.fixture(scope='module')
+def api(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patch:
+        yield load_api(patch, tmp_path_factory.mktemp('api'))
+
+
+@pytest.fixture
+def client(api):
+    return api.app.test_client()
+
+
+def generate(client, brand='Acme'):
+    response = client.post('/api/v1/qr/generate',
+                           json={'product_id': 'p-1', 'product_name': 'Product', 'brand': brand})
+    return response.get_json()['qr_id']
+
+
+def execute(api, sql, params):
+    # Out-of-band writer: the triggers log the change in qr_code_changes
+    with api.db.transaction(write=True) as conn:
+        conn.execute(sql, params)
+
+
+def test_brand_changed_out_of_band_is_picked_up(api, client):
+    qr_id = generate(client)
+    assert api.scanned_qr_code(qr_id) == {'brand': 'Acme'}
+
+    execute(api, 'UPDATE qr_codes SET brand = ? WHERE id = ?', ('Globex', qr_id))
+    assert api.scanned_qr_code(qr_id) == {'brand': 'Globex'}
+
+
+def test_scans_of_a_deleted_code_are_rejected(api, client):
+    qr_id = generate(client)
+    assert client.get(f'/api/v1/qr/track/{qr_id}').status_code == 200
+
+    execute(api, 'DELETE FROM qr_codes WHERE id = ?', (qr_id,))
+    assert client.get(f'/api/v1/qr/track/{qr_id}').status_code == 404
+
+
+def test_import_starts_no_background_threads(tmp_path, monkeypatch):
+    # The reloader parent and the ASGI supervisor import without serving
+    api = load_api(monkeypatch, tmp_path)
+    assert not api.anchorer._thread.is_alive()
+    assert not api.topk._thread.is_alive()
+
+    api.app.test_client().get('/api/v1/qr/filter/stats')
+    assert api.anchorer._thread.is_alive()
+    assert api.topk._thread.is_alive()
+
+
+def blockchain_of(client, qr_id):
+    return client.get(f'/api/v1/qr/verify/{qr_id}').get_json()['blockchain']
+
+
+def test_new_code_verifies_as_pending_until_anchored(api, client):
+    qr_id = generate(client)
+    blockchain = blockchain_of(client, qr_id)
+    assert blockchain['verified'] and blockchain['anchor_status'] == 'pending'
+
+    api.anchorer.run_once()
+    blockchain = blockchain_of(client, qr_id)
+    assert blockchain['verified'] and blockchain['anchor_status'] == 'anchored'
+
+    # Changing an anchored field out-of-band breaks the inclusion proof
+    execute(api, 'UPDATE qr_codes SET product_name = ? WHERE id = ?', ('Forged', qr_id))
+    blockchain = blockchain_of(client, qr_id)
+    assert not blockchain['verified'] and blockchain['anchor_status'] == 'invalid'
+
+
+def rebuild_filter(api):
+    # As on a restart
+    with api.db.transaction() as conn:
+        api.qr_filter = api.build_qr_filter(conn, api.QR_FILTER_CAPACITY)
+
+
+def test_deactivated_code_answers_the_same_after_a_filter_rebuild(api, client):
+    qr_id = generate(client)
+    assert client.patch(f'/api/v1/qr/{qr_id}', json={'is_active': False}).status_code == 200
+
+    for rebuilt in (False, True):
+        if rebuilt:
+            rebuild_filter(api)
+        # Still passes the prefilter, so SQLite decides
+        assert api.known_qr_code(qr_id), rebuilt
+        assert client.get(f'/api/v1/qr/verify/{qr_id}').status_code == 404
+        assert client.get(f'/api/v1/qr/track/{qr_id}').status_code == 200
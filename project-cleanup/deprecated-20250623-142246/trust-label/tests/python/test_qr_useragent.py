@@ -0,0 +1,28 @@
+import pytest
+
+from qr_useragent import CORPUS, KEYWORDS, classify_user_agent
+
+
+@pytest.mark.parametrize('user_agent,device,browser', CORPUS)
+def test_corpus(user_agent, device, browser):
+    assert classify_user_agent.__wrapped__(user_agent) == (device, browser)
+    assert classify_user_agent(user_agent) == (device, browser)
+
+
+@pytest.mark.parametrize('user_agent,expected', [
+    # Keywords only count as whole words
+    ('Smartphone Automobile Knowledge', ('desktop', 'Other')),
+    ('xMobile Mobilex Firefoxy', ('desktop', 'Other')),
+    ('a-mobile_b', ('mobile', 'Other')),
+    ('EDGE/1 iPhone', ('mobile', 'Edge')),
+    ('iPod touch; FxiOS/1', ('mobile', 'Firefox')),
+])
+def test_whole_words(user_agent, expected):
+    assert classify_user_agent.__wrapped__(user_agent) == expected
+
+
+@pytest.mark.parametrize('word', sorted(KEYWORDS))
+def test_every_keyword_is_recognised(word):
+    # Every token is named by a device or browser rule
+    for user_agent in (word, word.upper(), f'x/{word}/1'):
+        assert classify_user_agent.__wrapped__(user_agent) != ('desktop', 'Other'), user_agent
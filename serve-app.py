@@ -1,67 +1,547 @@
 #!/usr/bin/env python3
 
+import argparse
+import asyncio
+import gzip
+import hashlib
 import http.server
-import socketserver
+import mimetypes
 import os
+import re
+import socket
 import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
 from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from http_ranges import parse_range, range_allowed
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele servimos só gzip
+    brotli = None
 
 # Configurações
 PORT = 3001
 DIRECTORY = "client/dist"
+WORKERS = min(64, (os.cpu_count() or 1) * 8)
+KEEPALIVE_TIMEOUT = 15  # segundos de ociosidade antes de fechar a conexão
+ENGINES = ("asyncio", "threaded")
+MAX_CACHED_FILE_SIZE = 8 * 1024 * 1024  # arquivos maiores continuam sendo lidos do disco
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+                      'application/manifest+json', 'image/svg+xml')
+# Chunks do Vite em /assets/ levam o hash do conteúdo no nome (ex.: index-DVDeh87x.js)
+HASHED_ASSET = re.compile(r'^/assets/.+-[A-Za-z0-9_-]{8}\.\w+$')
+
+CORS_HEADERS = (
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', 'GET, POST, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type'),
+)
+
+
+class RouteManifest:
+    """Mapa url_path -> (arquivo, tamanho, mtime_ns) de tudo que client/dist serve"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.routes = {}
+
+    def scan(self):
+        """Relê o diretório; retorna True se algum arquivo mudou"""
+        routes = {}
+        for dirpath, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                file_path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                url_path = '/' + os.path.relpath(file_path, self.directory).replace(os.sep, '/')
+                routes[url_path] = (file_path, st.st_size, st.st_mtime_ns)
+        changed = routes != self.routes
+        self.routes = routes
+        return changed
+
+
+MANIFEST = RouteManifest(DIRECTORY)
+
+
+def resolve_path(request_path):
+    """Traduz o path da requisição para o arquivo servido (com fallback SPA)"""
+    path = unquote(urlsplit(request_path).path)
+    if path.endswith('/'):
+        path += 'index.html'
+    if path in MANIFEST.routes:
+        return path
+    if path.startswith('/assets/') or path.startswith('/js/'):
+        return path  # chunk inexistente: 404 em vez de index.html
+    return '/index.html'
+
+
+def guess_content_type(file_path):
+    return mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+
+
+def cache_control(url_path):
+    if HASHED_ASSET.match(url_path):
+        return 'public, max-age=31536000, immutable'
+    return 'no-cache'
+
+
+class StaticFile:
+    """Metadados comuns de um arquivo servido (ETag, Cache-Control, etc.)"""
+
+    variants = {}
+
+    def __init__(self, file_path, url_path, stamp):
+        self.file_path = file_path
+        self.stamp = stamp
+        self.size = stamp[0]
+        self.content_type = guess_content_type(file_path)
+        self.cache_control = cache_control(url_path)
+        self.last_modified = formatdate(stamp[1] / 1e9, usegmt=True)
+
+    def etag(self, encoding):
+        # ETag forte por representação: cada Content-Encoding tem o seu
+        if encoding == 'identity':
+            return f'"{self.etag_base}"'
+        return f'"{self.etag_base}-{encoding}"'
+
+    def matches(self, if_none_match):
+        """If-None-Match casa com qualquer variante do mesmo conteúdo"""
+        if not if_none_match:
+            return False
+        etags = {self.etag(encoding) for encoding in self.variants} | {self.etag('identity')}
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag in etags:
+                return True
+        return False
+
+
+class Asset(StaticFile):
+    """Arquivo de client/dist em memória, com variantes pré-comprimidas"""
+
+    def __init__(self, file_path, url_path, stamp):
+        super().__init__(file_path, url_path, stamp)
+        body = Path(file_path).read_bytes()
+        self.size = len(body)
+        self.etag_base = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {'identity': body}
+
+        if len(body) >= MIN_COMPRESS_SIZE and self.content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.variants['gzip'] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants['br'] = compressed
+
+    def segment(self, offset, count):
+        return memoryview(self.variants['identity'])[offset:offset + count]
+
+
+class DiskFile(StaticFile):
+    """Arquivo grande demais para o cache: enviado do disco com sendfile"""
+
+    def __init__(self, file_path, url_path, stamp):
+        super().__init__(file_path, url_path, stamp)
+        # Sem ler o conteúdo: ETag derivado de mtime e tamanho
+        self.etag_base = f'{stamp[1]:x}-{stamp[0]:x}'
+
+    def segment(self, offset, count):
+        return (offset, count)
+
+
+class AssetCache:
+    """Mantém em memória os arquivos do manifesto, indexados pelo path da URL"""
+
+    def __init__(self):
+        self.assets = {}
+
+    def load(self, manifest):
+        """(Re)carrega a partir do manifesto, reaproveitando arquivos inalterados"""
+        assets = {}
+        for url_path, (file_path, size, mtime_ns) in manifest.routes.items():
+            current = self.assets.get(url_path)
+            if current is not None and current.stamp == (size, mtime_ns):
+                assets[url_path] = current
+                continue
+            file_class = DiskFile if size > MAX_CACHED_FILE_SIZE else Asset
+            try:
+                assets[url_path] = file_class(file_path, url_path, (size, mtime_ns))
+            except OSError:
+                continue
+        self.assets = assets
+        return self
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    def stats(self):
+        cached = [asset for asset in self.assets.values() if isinstance(asset, Asset)]
+        raw = sum(asset.size for asset in cached)
+        best = sum(min(len(body) for body in asset.variants.values()) for asset in cached)
+        return len(cached), raw, best
+
+
+ASSET_CACHE = AssetCache()
+
+
+def watch_directory(interval):
+    """Rescan periódico: só recarrega o cache quando o build mudou"""
+    while True:
+        time.sleep(interval)
+        if MANIFEST.scan():
+            ASSET_CACHE.load(MANIFEST)
+            print(f"🔄 client/dist mudou: {len(MANIFEST.routes)} arquivos no manifesto")
+
+
+def negotiate_encoding(accept_encoding, variants):
+    """Escolhe br > gzip > identity entre as codificações aceitas (q > 0)"""
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if encoding in variants and quality > 0:
+            return encoding
+    return 'identity'
+
+
+def plan_response(resource, get_header):
+    """Decide (status, headers, partes) para um arquivo.
+
+    As partes são bytes em memória ou tuplas (offset, count) a enviar do
+    arquivo em disco com sendfile.
+    """
+    range_header = get_header('range')
+    # Range vale sobre os bytes originais: pedidos parciais saem sem compressão
+    if range_header:
+        encoding = 'identity'
+    else:
+        encoding = negotiate_encoding(get_header('accept-encoding'), resource.variants)
+    etag = resource.etag(encoding)
+    headers = [
+        ('ETag', etag),
+        ('Last-Modified', resource.last_modified),
+        ('Cache-Control', resource.cache_control),
+        ('Accept-Ranges', 'bytes'),
+        ('Vary', 'Accept-Encoding'),
+    ]
+    content_type = ('Content-Type', resource.content_type)
+
+    if resource.matches(get_header('if-none-match')):
+        return 304, headers, []
+    if encoding != 'identity':
+        headers += [content_type, ('Content-Encoding', encoding)]
+        return 200, headers, [resource.variants[encoding]]
+
+    ranges = None
+    if range_header and range_allowed(get_header('if-range'), etag, resource.last_modified):
+        ranges = parse_range(range_header, resource.size)
+    if ranges is None:
+        return 200, headers + [content_type], [resource.segment(0, resource.size)]
+    if not ranges:
+        return 416, headers + [('Content-Range', f'bytes */{resource.size}')], []
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers += [content_type, ('Content-Range', f'bytes {start}-{end}/{resource.size}')]
+        return 206, headers, [resource.segment(start, end - start + 1)]
+
+    boundary = uuid.uuid4().hex
+    headers.append(('Content-Type', f'multipart/byteranges; boundary={boundary}'))
+    parts = []
+    for start, end in ranges:
+        parts.append((f'\r\n--{boundary}\r\n'
+                      f'Content-Type: {resource.content_type}\r\n'
+                      f'Content-Range: bytes {start}-{end}/{resource.size}\r\n\r\n').encode('latin-1'))
+        parts.append(resource.segment(start, end - start + 1))
+    parts.append(f'\r\n--{boundary}--\r\n'.encode('latin-1'))
+    return 206, headers, parts
+
+
+def content_length(parts):
+    return sum(part[1] if isinstance(part, tuple) else len(part) for part in parts)
+
+
+class CustomHTTPRequestHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 mantém a conexão aberta entre os ~40 chunks de JS de uma página
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
 
-class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=DIRECTORY, **kwargs)
-    
     def end_headers(self):
         # Adicionar headers CORS para desenvolvimento
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        for name, value in CORS_HEADERS:
+            self.send_header(name, value)
         super().end_headers()
-    
+
     def do_GET(self):
         # Para SPA, redirecionar rotas não encontradas para index.html
-        if not os.path.exists(os.path.join(DIRECTORY, self.path.lstrip('/'))):
-            if not self.path.startswith('/assets/') and not self.path.startswith('/js/'):
-                self.path = '/index.html'
-        
-        return super().do_GET()
+        self.path = resolve_path(self.path)
+        self.send_static_file()
+
+    def do_HEAD(self):
+        self.path = resolve_path(self.path)
+        self.send_static_file(head_only=True)
+
+    def send_static_file(self, head_only=False):
+        resource = ASSET_CACHE.get(self.path)
+        if resource is None:
+            self.send_error(404, 'File not found')
+            return
+        status, headers, parts = plan_response(resource, self.headers.get)
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(content_length(parts)))
+        self.end_headers()
+        if head_only:
+            return
+
+        file = None
+        try:
+            for part in parts:
+                if isinstance(part, tuple):
+                    if file is None:
+                        file = open(resource.file_path, 'rb')
+                    # socket.sendfile usa os.sendfile: os bytes não passam pelo Python
+                    self.connection.sendfile(file, *part)
+                else:
+                    self.wfile.write(part)
+        finally:
+            if file is not None:
+                file.close()
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTPServer que atende conexões num pool fixo de threads.
+
+    Cada conexão ocupa um worker enquanto estiver aberta, inclusive ociosa
+    em keep-alive (até KEEPALIVE_TIMEOUT): com mais clientes que workers,
+    os novos esperam na fila. Por isso a engine padrão é a asyncio.
+    """
+
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers=WORKERS, reuse_port=False):
+        self.reuse_port = reuse_port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='serve-app')
+        super().__init__(server_address, handler_class)
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class AsyncSPAServer:
+    """Engine asyncio: uma única thread multiplexa todas as conexões keep-alive"""
+
+    def __init__(self, port=PORT, reuse_port=False):
+        self.port = port
+        self.reuse_port = reuse_port
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(
+            self.handle_connection, host='', port=self.port,
+            reuse_address=True, reuse_port=self.reuse_port or None)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = await self.handle_request(request_line, headers, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request_line, headers, writer):
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            self.send_response(writer, 400, [b'Bad Request'], keep_alive=False)
+            return False
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+
+        if method not in ('GET', 'HEAD'):
+            self.send_response(writer, 501, [b'Unsupported method'], keep_alive=keep_alive)
+            return keep_alive
+
+        resource = ASSET_CACHE.get(resolve_path(target))
+        if resource is None:
+            self.send_response(writer, 404, [b'File not found'], keep_alive=keep_alive)
+            return keep_alive
+
+        status, response_headers, parts = plan_response(resource, headers.get)
+        head_only = method == 'HEAD'
+        on_disk = any(isinstance(part, tuple) for part in parts)
+        self.send_response(writer, status, [] if head_only or on_disk else parts,
+                           response_headers, keep_alive=keep_alive, length=content_length(parts))
+        if head_only or not on_disk:
+            return keep_alive
+
+        # Arquivos grandes: loop.sendfile envia direto do disco para o socket
+        loop = asyncio.get_running_loop()
+        with open(resource.file_path, 'rb') as file:
+            for part in parts:
+                if isinstance(part, tuple):
+                    await writer.drain()
+                    await loop.sendfile(writer.transport, file, *part)
+                else:
+                    writer.write(part)
+        return keep_alive
+
+    def send_response(self, writer, status, parts, headers=None, keep_alive=True, length=None):
+        """Escreve status, headers e as partes do corpo já em memória"""
+        reason = http.server.BaseHTTPRequestHandler.responses.get(status, ('',))[0]
+        headers = headers or [('Content-Type', 'text/plain; charset=utf-8')]
+        lines = [f'HTTP/1.1 {status} {reason}', f'Date: {formatdate(usegmt=True)}']
+        lines.extend(f'{name}: {value}' for name, value in headers)
+        if status != 304:
+            lines.append(f'Content-Length: {content_length(parts) if length is None else length}')
+        lines.append(f'Connection: {"keep-alive" if keep_alive else "close"}')
+        lines.extend(f'{name}: {value}' for name, value in CORS_HEADERS)
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        for part in parts:
+            writer.write(part)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='True Label - Servidor da SPA (client/dist)')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--engine', choices=ENGINES, default='asyncio',
+                        help='asyncio (padrão): event loop único, conexões ociosas não ocupam '
+                             'threads; threaded: pool de threads, uma por conexão aberta')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='threads por processo (engine threaded)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processos compartilhando a porta via SO_REUSEPORT')
+    parser.add_argument('--watch', type=float, default=0, metavar='SECONDS',
+                        help='intervalo de rescan de client/dist (0 desativa)')
+    return parser.parse_args()
+
+
+def fork_processes(count):
+    """Cria count-1 filhos; cada processo abre seu próprio socket com SO_REUSEPORT"""
+    for _ in range(count - 1):
+        if os.fork() == 0:
+            return
+
+
+def serve(args):
+    reuse_port = args.processes > 1
+    if args.engine == 'asyncio':
+        asyncio.run(AsyncSPAServer(args.port, reuse_port).serve_forever())
+    else:
+        with PooledHTTPServer(("", args.port), CustomHTTPRequestHandler,
+                              args.workers, reuse_port) as httpd:
+            httpd.serve_forever()
+
 
 def main():
+    args = parse_args()
+
     # Verificar se o diretório existe
     if not os.path.exists(DIRECTORY):
         print(f"❌ Erro: Diretório '{DIRECTORY}' não encontrado!")
         print("Execute este script na raiz do projeto True Label")
         sys.exit(1)
-    
+
     # Verificar se index.html existe
     index_path = os.path.join(DIRECTORY, 'index.html')
     if not os.path.exists(index_path):
         print(f"❌ Erro: '{index_path}' não encontrado!")
         print("Execute 'npm run build' no diretório client primeiro")
         sys.exit(1)
-    
+
+    MANIFEST.scan()
+    count, raw, best = ASSET_CACHE.load(MANIFEST).stats()
+
     print("🏷️  True Label - Servidor de Desenvolvimento")
     print("=" * 50)
     print(f"📁 Servindo arquivos de: {DIRECTORY}")
-    print(f"🌐 URL: http://localhost:{PORT}")
+    print(f"🌐 URL: http://localhost:{args.port}")
+    print(f"🗜️  Cache: {count} arquivos, {raw // 1024} KB -> {best // 1024} KB comprimidos"
+          f"{'' if brotli else ' (instale brotli para variantes br)'}")
+    workers = f" | workers: {args.workers}" if args.engine == 'threaded' else ''
+    print(f"⚙️  Engine: {args.engine}{workers} | processos: {args.processes}")
     print("⏹️  Para parar: Pressione Ctrl+C")
     print()
-    
+
     try:
-        with socketserver.TCPServer(("", PORT), CustomHTTPRequestHandler) as httpd:
-            print(f"✅ Servidor iniciado na porta {PORT}")
-            print(f"🚀 Acesse: http://localhost:{PORT}")
-            print()
-            httpd.serve_forever()
+        if args.processes > 1:
+            fork_processes(args.processes)
+        if args.watch > 0:
+            threading.Thread(target=watch_directory, args=(args.watch,), daemon=True).start()
+        print(f"✅ Servidor iniciado na porta {args.port} (pid {os.getpid()})")
+        print(f"🚀 Acesse: http://localhost:{args.port}")
+        print()
+        serve(args)
     except KeyboardInterrupt:
         print("\n🛑 Servidor parado pelo usuário")
     except OSError as e:
-        if e.errno == 48:  # Address already in use
-            print(f"❌ Erro: Porta {PORT} já está em uso!")
-            print("Execute: lsof -ti:3001 | xargs kill -9")
+        if e.errno in (48, 98):  # Address already in use (macOS / Linux)
+            print(f"❌ Erro: Porta {args.port} já está em uso!")
+            print(f"Execute: lsof -ti:{args.port} | xargs kill -9")
         else:
             print(f"❌ Erro: {e}")
         sys.exit(1)